@@ -0,0 +1,75 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Compare cost of xyz axis mapping per sample and for numpy batches.
+
+Maps synthetic samples with the list based per sample algorithm which AxisMapper
+used earlier, with the precompiled AxisMapper.map_xyz_axis() and with
+AxisMapper.map_xyz_axis_batch() on a numpy array.
+"""
+import imports  # pylint: disable=unused-import
+import timeit
+from kx_lib.kx_sensor_base import AxisMapper
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HDR = 'ch!ax!ay!az'
+AXIS_MAP = [1, 0, 5]  # y, x, -z
+SAMPLE_COUNT = 10000
+
+
+def map_xyz_axis_lists(axis_mapper, measurement):
+    "Per sample mapping with intermediate lists"
+    measurement = list(measurement)
+    xyz_data = [measurement[ind] for ind in axis_mapper.xyz_ind]
+    xyz_data_extended = xyz_data + [-value for value in xyz_data]
+    xyz_mapped = [xyz_data_extended[ind] for ind in axis_mapper.axis_map]
+    for xyz_data_ind, measurement_data_ind in enumerate(axis_mapper.xyz_ind):
+        measurement[measurement_data_ind] = xyz_mapped[xyz_data_ind]
+    return measurement
+
+
+def make_samples(count):
+    return [(10, i % 32768, -i % 32768, (3 * i) % 32768) for i in range(count)]
+
+
+def map_lists(axis_mapper, samples):
+    for sample in samples:
+        map_xyz_axis_lists(axis_mapper, sample)
+
+
+def map_compiled(axis_mapper, samples):
+    for sample in samples:
+        axis_mapper.map_xyz_axis(sample)
+
+
+def run_benchmark(repeat=5):
+    axis_mapper = AxisMapper(HDR, AXIS_MAP)
+    samples = make_samples(SAMPLE_COUNT)
+
+    # all methods must give same result
+    for sample in samples[:100]:
+        assert list(axis_mapper.map_xyz_axis(sample)) == map_xyz_axis_lists(axis_mapper, sample)
+
+    tests = [('list based map_xyz_axis', lambda: map_lists(axis_mapper, samples)),
+             ('precompiled map_xyz_axis', lambda: map_compiled(axis_mapper, samples))]
+
+    if numpy is not None:
+        values = numpy.array(samples, dtype=numpy.int32)
+        assert axis_mapper.map_xyz_axis_batch(values[:100].copy()).tolist() == \
+            [map_xyz_axis_lists(axis_mapper, sample) for sample in samples[:100]]
+        tests.append(('map_xyz_axis_batch', lambda: axis_mapper.map_xyz_axis_batch(values)))
+
+    results = {}
+    for name, function in tests:
+        best = min(timeit.repeat(function, number=1, repeat=repeat))
+        results[name] = SAMPLE_COUNT / best
+        print('%-30s %12.0f samples/s' % (name, results[name]))
+
+    return results
+
+
+if __name__ == '__main__':
+    run_benchmark()
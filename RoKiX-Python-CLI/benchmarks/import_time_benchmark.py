@@ -0,0 +1,139 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Measure import time of library and application modules.
+
+Each module is imported in a fresh interpreter with python -X importtime (python 3.7+).
+Cumulative import time of the module and the most expensive modules it pulls in are
+printed. Modules in LAZY_MODULES must not be imported at start up; they are loaded only
+when the selected bus2 or feature needs them.
+
+Results can be saved and compared with an earlier run:
+    python import_time_benchmark.py --save import_times.json
+    python import_time_benchmark.py --baseline import_times.json
+Exit code is 1 if a lazy module was imported or import time grew more than tolerance.
+"""
+import imports  # pylint: disable=unused-import
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# module name -> directory added to sys.path and used as working directory
+MODULES = [
+    ('kx_lib.kx_util', ROOT),
+    ('kx_lib.kx_board', ROOT),
+    ('kx_lib.kx_data_stream', ROOT),
+    ('kx132_data_logger', os.path.join(ROOT, 'kx132')),
+    ('kx134_data_logger', os.path.join(ROOT, 'kx134')),
+]
+
+# modules which are imported only when needed
+LAZY_MODULES = ['serial', 'pygatt', 'numpy', 'kx_lib.aardvark_py', 'kx_lib.kx_bus2']
+
+TOP_COUNT = 8
+
+
+def import_times(module, path):
+    """Import module in new interpreter.
+
+    Args:
+        module(string): module name
+        path(string): directory added to sys.path and used as working directory
+
+    Returns:
+        dict: imported module name -> (self time, cumulative time) in microseconds
+    """
+    code = 'import sys; sys.path.insert(0, %r); sys.argv = sys.argv[:1]; import %s' % (path, module)
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code],
+                               cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError('Importing %s failed:\n%s' % (module, stderr))
+
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+
+def best_import_times(module, path, repeat):
+    "Smallest times of each imported module over repeated imports"
+    best = {}
+    for _ in range(repeat):
+        for name, (self_time, cumulative) in import_times(module, path).items():
+            old_self, old_cumulative = best.get(name, (self_time, cumulative))
+            best[name] = (min(self_time, old_self), min(cumulative, old_cumulative))
+    return best
+
+
+def run_benchmark(repeat=5, baseline=None, tolerance=1.5):
+    """Measure import times of MODULES.
+
+    Args:
+        repeat(int): imports per module, smallest time is used
+        baseline(dict): earlier results to compare with
+        tolerance(float): allowed growth factor compared to baseline
+
+    Returns:
+        tuple: results as {module: cumulative time in ms} and list of found problems
+    """
+    results = {}
+    problems = []
+    for module, path in MODULES:
+        times = best_import_times(module, path, repeat)
+        total = times[module][1] / 1000.0
+        results[module] = total
+        print('%-30s %8.1f ms' % (module, total))
+
+        top = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:TOP_COUNT]
+        for name, (self_time, cumulative) in top:
+            print('    %-40s self %7.1f ms  cumulative %7.1f ms' % (name, self_time / 1000.0, cumulative / 1000.0))
+
+        for lazy_module in LAZY_MODULES:
+            if lazy_module in times:
+                problems.append('%s imports %s at start up' % (module, lazy_module))
+
+        if baseline and module in baseline and total > baseline[module] * tolerance:
+            problems.append('%s import time %.1f ms, baseline %.1f ms' % (module, total, baseline[module]))
+
+    for problem in problems:
+        print('REGRESSION: ' + problem)
+
+    return results, problems
+
+
+def main():
+    if sys.version_info < (3, 7):
+        raise SystemExit('python 3.7 or newer is needed for -X importtime')
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module')
+    parser.add_argument('--baseline', help='json file of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed growth factor compared to baseline')
+    parser.add_argument('--save', help='write results to json file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as infile:
+            baseline = json.load(infile)
+
+    results, problems = run_benchmark(args.repeat, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(results, outfile, indent=4, sort_keys=True)
+
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Compare per sample decoding speed of stream indications.
+
+Decodes synthetic indication payloads with the format string based decoding
+(struct.unpack + AxisMapper.map_xyz_axis) and with the precompiled decoder
+of RequestMessageDefinition.
+"""
+import imports  # pylint: disable=unused-import
+import struct
+import timeit
+from array import array
+from kx_lib.kx_configuration_enum import CFG_AXIS_MAP
+from kx_lib.kx_data_stream import RequestMessageDefinition
+
+FMT = '<Bhhh'
+HDR = 'ch!ax!ay!az'
+AXIS_MAP = [1, 0, 5]  # y, x, -z
+FRAME_COUNT = 10000
+
+
+class BenchmarkSensor(object):
+    "Minimal sensor for creating RequestMessageDefinition without board"
+    resource = {CFG_AXIS_MAP: AXIS_MAP}
+
+
+def make_frames(count):
+    return [array('B', struct.pack(FMT, 0x30, i % 32768, -i % 32768, (3 * i) % 32768)) for i in range(count)]
+
+
+def decode_unpack(request, frames):
+    for resp in frames:
+        data = struct.unpack(request.msg_fmt, resp)
+        data = request.axis_mapper.map_xyz_axis(data)
+
+
+def decode_compiled(request, frames):
+    for resp in frames:
+        data = request.decode(resp)
+
+
+def run_benchmark(repeat=5):
+    request = RequestMessageDefinition(BenchmarkSensor(), FMT, HDR)
+    frames = make_frames(FRAME_COUNT)
+
+    # both methods must give same result
+    for resp in frames[:100]:
+        assert list(request.decode(resp)) == list(request.axis_mapper.map_xyz_axis(struct.unpack(FMT, resp)))
+
+    results = {}
+    for name, function in [('struct.unpack + map_xyz_axis', decode_unpack),
+                           ('precompiled decode', decode_compiled)]:
+        best = min(timeit.repeat(lambda: function(request, frames), number=1, repeat=repeat))
+        results[name] = FRAME_COUNT / best
+        print('%-30s %12.0f samples/s' % (name, results[name]))
+
+    return results
+
+
+if __name__ == '__main__':
+    run_benchmark()
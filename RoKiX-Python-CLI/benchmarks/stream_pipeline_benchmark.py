@@ -0,0 +1,339 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Measure throughput of the stream receive path stage by stage.
+
+Stages are measured with synthetic KX132 style indications ('<Bhhh' payload):
+    framing   ProtocolEngine._receive_single_message() splitting a byte stream to messages
+    decode    unpack_response_data() + struct.unpack() + AxisMapper.map_xyz_axis(),
+              and the same with precompiled RequestMessageDefinition.decode()
+    log       SensorDataLogger.feed_values() with console on/off and csv/binary file on/off
+    pipeline  byte stream to log file as in StreamConfig.read_data_stream()
+
+For each stage samples/s (best of repeats), p50/p99 latency of one sample and
+allocations per sample are reported. Allocations are memory blocks allocated by one
+sample which are still alive when the next sample starts (sys.getallocatedblocks()
+while results of the samples are kept); temporary objects freed within the sample
+are not counted. Console output is written to os.devnull.
+
+Results can be saved and compared with an earlier run:
+    python stream_pipeline_benchmark.py --save stream_pipeline.json
+    python stream_pipeline_benchmark.py --baseline stream_pipeline.json
+Exit code is 1 if samples/s of some stage dropped more than tolerance.
+"""
+import imports  # pylint: disable=unused-import
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from functools import partial
+from kx_lib import kx_protocol_2_x
+from kx_lib.kx_bus2 import KxConnection
+from kx_lib.kx_configuration_enum import CFG_AXIS_MAP
+from kx_lib.kx_data_logger import SensorDataLogger
+from kx_lib.kx_data_stream import RequestMessageDefinition
+from kx_lib.kx_exception import ProtocolTimeoutException
+from kx_lib.kx_log_writer import LOG_FORMAT_CSV, LOG_FORMAT_BINARY, LOG_FILE_EXTENSIONS
+
+FMT = '<Bhhh'
+HDR = 'ch!ax!ay!az'
+AXIS_MAP = [1, 0, 5]  # y, x, -z
+MACRO_ID = kx_protocol_2_x.EVKIT_MSG_MACRO_IND_BASE
+CHUNK_SIZE = 64  # bytes returned by one read, like one USB packet of serial adapter
+SAMPLE_COUNT = 20000
+
+TIMER = getattr(time, 'perf_counter', time.time)
+
+
+class BenchmarkSensor(object):
+    "Minimal sensor for creating RequestMessageDefinition without board"
+    resource = {CFG_AXIS_MAP: AXIS_MAP}
+
+
+class StreamConnection(KxConnection):
+    """Connection returning prerecorded bytes in CHUNK_SIZE pieces.
+
+    Args:
+        data(bytes): received byte stream
+        chunk_size(int): bytes returned by read_available() if more is waiting
+    """
+
+    def __init__(self, data, chunk_size=CHUNK_SIZE):
+        self.data = data
+        self.position = 0
+        self.chunk_size = chunk_size
+
+    def flush(self):
+        self.position = len(self.data)
+
+    def read(self, length=1):
+        if self.position + length > len(self.data):
+            raise ProtocolTimeoutException('End of benchmark stream')
+        data = self.data[self.position:self.position + length]
+        self.position += length
+        return data
+
+    def read_available(self, length=1):
+        return self.read(min(max(length, self.chunk_size), len(self.data) - self.position) or length)
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_stream(count):
+    "Byte stream of count indication messages"
+    frame = struct.Struct('<BBhhh')
+    return b''.join(frame.pack(frame.size, MACRO_ID, i % 32768, -i % 32768, (3 * i) % 32768)
+                    for i in range(count))
+
+
+def make_frames(data):
+    "Split byte stream to messages as ProtocolEngine returns them"
+    engine = kx_protocol_2_x.ProtocolEngine2(StreamConnection(data))
+    frames = []
+    while engine.connection.position < len(data) or engine.frame_buffer.has_partial_frame():
+        frames.append(engine._receive_single_message())  # pylint: disable=protected-access
+    return frames
+
+
+class Stages(object):
+    """Setup functions of the benchmark stages.
+
+    Each setup returns (step, close) where step() processes the next sample and
+    close() releases what setup allocated.
+
+    Args:
+        count(int): samples in one run
+        work_dir(string): directory for log files
+    """
+
+    def __init__(self, count, work_dir):
+        self.count = count
+        self.work_dir = work_dir
+        self.stream = make_stream(count)
+        self.frames = make_frames(self.stream)
+        self.request = RequestMessageDefinition(BenchmarkSensor(), FMT, HDR)
+        self.msg_ind_dict = {MACRO_ID: self.request}
+        payloads = [kx_protocol_2_x.unpack_response_data(frame)[1] for frame in self.frames]
+        self.samples = [(self.request.decode(resp), resp) for resp in payloads]
+
+    def definitions(self):
+        "List of (stage name, setup function)"
+        stages = [('framing', self.framing),
+                  ('decode struct.unpack + map_xyz_axis', self.decode_unpack),
+                  ('decode precompiled', self.decode_compiled)]
+        for console in (False, True):
+            for log_format in (None, LOG_FORMAT_CSV, LOG_FORMAT_BINARY):
+                name = 'feed_values console %s file %s' % ('on' if console else 'off', log_format or 'off')
+                stages.append((name, partial(self.feed_values, console, log_format)))
+        stages.append(('pipeline file off', partial(self.pipeline, None)))
+        stages.append(('pipeline file binary', partial(self.pipeline, LOG_FORMAT_BINARY)))
+        return stages
+
+    def framing(self):
+        engine = kx_protocol_2_x.ProtocolEngine2(StreamConnection(self.stream))
+        return engine._receive_single_message, _nothing  # pylint: disable=protected-access
+
+    def decode_unpack(self):
+        next_frame = partial(next, iter(self.frames))
+        request = self.request
+
+        def step():
+            _, resp = kx_protocol_2_x.unpack_response_data(next_frame())
+            return request.axis_mapper.map_xyz_axis(struct.unpack(request.msg_fmt, resp))
+        return step, _nothing
+
+    def decode_compiled(self):
+        next_frame = partial(next, iter(self.frames))
+        request = self.request
+
+        def step():
+            _, resp = kx_protocol_2_x.unpack_response_data(next_frame())
+            return request.decode(resp)
+        return step, _nothing
+
+    def _data_logger(self, console, log_format):
+        "Started SensorDataLogger and function which stops it"
+        log_file_name = None
+        if log_format is not None:
+            log_file_name = os.path.join(self.work_dir, 'benchmark' + LOG_FILE_EXTENSIONS[log_format])
+        stdout = sys.stdout
+        if console:
+            sys.stdout = open(os.devnull, 'w')
+
+        data_logger = SensorDataLogger(console=console, log_file_name=log_file_name, log_format=log_format or LOG_FORMAT_CSV)
+        if log_file_name is None:
+            data_logger.writer = None  # ignore filename setting of rokix_settings.cfg
+        data_logger.add_channel(self.request.msg_hdr, MACRO_ID, fmt=self.request.msg_fmt,
+                                axis_map=self.request.axis_mapper.axis_map)
+        data_logger.start()
+
+        def close():
+            data_logger.stop()
+            if console:
+                sys.stdout.close()
+                sys.stdout = stdout
+        return data_logger, close
+
+    def feed_values(self, console, log_format):
+        data_logger, close = self._data_logger(console, log_format)
+        next_sample = partial(next, iter(self.samples))
+
+        def step():
+            data_logger.feed_values(*next_sample())
+        return step, close
+
+    def pipeline(self, log_format):
+        data_logger, close = self._data_logger(False, log_format)
+        engine = kx_protocol_2_x.ProtocolEngine2(StreamConnection(self.stream))
+        msg_ind_dict = self.msg_ind_dict
+
+        def step():
+            # loop body of StreamConfig.read_data_stream()
+            macro_index, resp = kx_protocol_2_x.unpack_response_data(engine.receive_single_message())
+            request = msg_ind_dict[macro_index]
+            if len(resp) != request.msg_size:
+                raise AssertionError('Wrong message length %d' % len(resp))
+            data = request.decode(resp)
+            data_logger.feed_values(data, resp)
+            return data
+        return step, close
+
+
+def _nothing():
+    pass
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def measure(setup, count, repeat):
+    """Run one stage.
+
+    Args:
+        setup(function): stage setup returning (step, close)
+        count(int): samples in one run
+        repeat(int): runs for throughput, best is used
+
+    Returns:
+        dict: samples_per_s, p50_us, p99_us and allocations_per_sample
+    """
+    best = None
+    for _ in range(repeat):
+        step, close = setup()
+        try:
+            start = TIMER()
+            for _ in range(count):
+                step()
+            elapsed = TIMER() - start
+        finally:
+            close()
+        best = elapsed if best is None else min(best, elapsed)
+
+    latencies = [0.0] * count
+    step, close = setup()
+    try:
+        for index in range(count):
+            start = TIMER()
+            step()
+            latencies[index] = TIMER() - start
+    finally:
+        close()
+    latencies.sort()
+
+    results = [None] * count
+    step, close = setup()
+    gc.collect()
+    gc.disable()
+    try:
+        blocks = sys.getallocatedblocks()
+        for index in range(count):
+            results[index] = step()
+        blocks = sys.getallocatedblocks() - blocks
+    finally:
+        gc.enable()
+        close()
+
+    return {
+        'samples_per_s': count / best,
+        'p50_us': percentile(latencies, 0.5) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'allocations_per_sample': float(blocks) / count}
+
+
+def run_benchmark(count=SAMPLE_COUNT, repeat=3, baseline=None, tolerance=0.7):
+    """Measure all stages.
+
+    Args:
+        count(int): samples in one run
+        repeat(int): runs per stage for throughput
+        baseline(dict): earlier results to compare with
+        tolerance(float): smallest allowed samples/s compared to baseline
+
+    Returns:
+        tuple: results dict and list of found problems
+    """
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'samples': count,
+        'stages': {}}
+    problems = []
+    work_dir = tempfile.mkdtemp(prefix='kx_benchmark_')
+    try:
+        stages = Stages(count, work_dir)
+        print('%-40s %12s %9s %9s %12s' % ('stage', 'samples/s', 'p50 us', 'p99 us', 'allocs/sample'))
+        for name, setup in stages.definitions():
+            result = measure(setup, count, repeat)
+            results['stages'][name] = result
+            print('%-40s %12.0f %9.2f %9.2f %12.2f' % (name, result['samples_per_s'], result['p50_us'],
+                                                    result['p99_us'], result['allocations_per_sample']))
+
+            old = baseline['stages'].get(name) if baseline else None
+            if old and result['samples_per_s'] < old['samples_per_s'] * tolerance:
+                problems.append('%s %.0f samples/s, baseline %.0f samples/s' %
+                                (name, result['samples_per_s'], old['samples_per_s']))
+    finally:
+        shutil.rmtree(work_dir)
+
+    for problem in problems:
+        print('REGRESSION: ' + problem)
+
+    return results, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=SAMPLE_COUNT, help='samples in one run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, best is used')
+    parser.add_argument('--baseline', help='json file of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.7, help='smallest allowed samples/s compared to baseline')
+    parser.add_argument('--save', help='write results to json file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as infile:
+            baseline = json.load(infile)
+
+    results, problems = run_benchmark(args.count, args.repeat, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(results, outfile, indent=4, sort_keys=True)
+
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
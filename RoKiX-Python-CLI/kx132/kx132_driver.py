@@ -111,6 +111,19 @@ hz = [0.781, 1.563, 3.125, 6.25,
 class KX132Driver(SensorDriver):
     supported_parts = ['KX132-1211']
     _WAIS = [b.KX132_1211_WHO_AM_I_WAI_ID]
+    # registers which hardware changes or which have side effects on read. Not cached in register shadow.
+    # CNTL2 has self clearing SRST and COTC bits and CNTL5 self clearing MAN_WAKE and MAN_SLEEP bits.
+    _volatile_registers = [
+        r.KX132_1211_XADP_L, r.KX132_1211_XADP_H, r.KX132_1211_YADP_L, r.KX132_1211_YADP_H, r.KX132_1211_ZADP_L, r.KX132_1211_ZADP_H,
+        r.KX132_1211_XOUT_L, r.KX132_1211_XOUT_H, r.KX132_1211_YOUT_L, r.KX132_1211_YOUT_H, r.KX132_1211_ZOUT_L, r.KX132_1211_ZOUT_H,
+        r.KX132_1211_COTR, r.KX132_1211_TSCP, r.KX132_1211_TSPP,
+        r.KX132_1211_INS1, r.KX132_1211_INS2, r.KX132_1211_INS3, r.KX132_1211_STATUS_REG, r.KX132_1211_INT_REL, r.KX132_1211_CNTL2,
+        r.KX132_1211_CNTL5, r.KX132_1211_BUF_STATUS_1, r.KX132_1211_BUF_STATUS_2, r.KX132_1211_BUF_CLEAR, r.KX132_1211_BUF_READ]
+    # operating mode changes are written in program order when register writes are batched
+    _barrier_registers = [r.KX132_1211_CNTL1]
+    _burst_write = True
+    # ADP and accelerometer outputs are read by interrupt macro in MACRO_GPIO modes
+    _macro_read_registers = (r.KX132_1211_XADP_L, 12)
 
     def __init__(self):
         SensorDriver.__init__(self)
@@ -151,6 +164,7 @@ class KX132Driver(SensorDriver):
     def por(self):
         self.write_register(r.KX132_1211_CNTL2, b.KX132_1211_CNTL2_SRST)
         delay_seconds(1)
+        self.invalidate_register_shadow()
         LOGGER.debug("POR done")
 
     def set_power_on(self, channel=CH_ACC | CH_ADP):
@@ -336,15 +350,16 @@ class KX132Driver(SensorDriver):
 
         values = filter1_values[f1_value]
         f1_1a, f1_ba, f1_ca, f1_ish, f1_osh = values
-        # Separate reg writes for stream config
-        self.write_register(r.KX132_1211_ADP_CNTL3, f1_1a)
-        self.write_register(r.KX132_1211_ADP_CNTL4, f1_ba & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL5, (f1_ba >> 8) & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL6, (f1_ba >> 16) & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL7, f1_ca & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL8, (f1_ca >> 8) & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL9, (f1_ca >> 16) & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL10, f1_ish)
+        # Separate reg writes for stream config, pipelined to save round trips
+        self.write_registers([
+            (r.KX132_1211_ADP_CNTL3, f1_1a),
+            (r.KX132_1211_ADP_CNTL4, f1_ba & 255),
+            (r.KX132_1211_ADP_CNTL5, (f1_ba >> 8) & 255),
+            (r.KX132_1211_ADP_CNTL6, (f1_ba >> 16) & 255),
+            (r.KX132_1211_ADP_CNTL7, f1_ca & 255),
+            (r.KX132_1211_ADP_CNTL8, (f1_ca >> 8) & 255),
+            (r.KX132_1211_ADP_CNTL9, (f1_ca >> 16) & 255),
+            (r.KX132_1211_ADP_CNTL10, f1_ish)])
 
         # NOTE: multiwrite not supported for stream configs
         # self.write_register(r.KX132_1211_ADP_CNTL3, [
@@ -375,11 +390,12 @@ class KX132Driver(SensorDriver):
 
         values = filter2_values[f2_value]
         f2_1a, f2_ba, f2_ish, f2_osh = values
-        # Separate reg writes for stream config
-        self.write_register(r.KX132_1211_ADP_CNTL12, f2_ba & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL13, (f2_ba >> 8) & 255)
-        self.write_register(r.KX132_1211_ADP_CNTL18, f2_ish)
-        self.write_register(r.KX132_1211_ADP_CNTL19, f2_osh)
+        # Separate reg writes for stream config, pipelined to save round trips
+        self.write_registers([
+            (r.KX132_1211_ADP_CNTL12, f2_ba & 255),
+            (r.KX132_1211_ADP_CNTL13, (f2_ba >> 8) & 255),
+            (r.KX132_1211_ADP_CNTL18, f2_ish),
+            (r.KX132_1211_ADP_CNTL19, f2_osh)])
         # NOTE: multiwrite not supported for stream configs
         # self.write_register(r.KX132_1211_ADP_CNTL12,
         #                     [f2_ba & 255, (f2_ba >> 8) & 255]
@@ -0,0 +1,63 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2020 Rohm Semiconductor
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy 
+# of this software and associated documentation files (the "Software"), to deal 
+# in the Software without restriction, including without limitation the rights 
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell 
+# copies of the Software, and to permit persons to whom the Software is 
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in 
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR 
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE 
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN 
+# THE SOFTWARE.
+"""
+KX132 data logger application for multiple boards. Streams data from all connected
+boards and merges it to one time ordered log where each sample is tagged with board UID.
+"""
+import imports  # pylint: disable=unused-import
+from kx_lib import kx_logger
+from kx_lib.kx_util import get_datalogger_config, evkit_config
+from kx_lib.kx_multi_board import open_boards, MultiBoardCollector
+from kx132.kx132_driver import KX132Driver
+from kx132.kx132_data_logger import KX132DataLogger, KX132DataStream
+
+LOGGER = kx_logger.get_logger(__name__)
+# LOGGER.setLevel(kx_logger.DEBUG)
+
+_CODE_FORMAT_VERSION = 3.0
+
+
+def main():
+    get_datalogger_config()
+    assert evkit_config.stream_mode, 'Multi board logging needs stream_mode = TRUE'
+
+    boards = open_boards(odr=evkit_config.odr)
+    collector = MultiBoardCollector()
+    loggers = []
+    try:
+        for connection_manager in boards:
+            l = KX132DataLogger([KX132Driver], kwargs_parser=None, connection_manager=connection_manager)
+            loggers.append(l)
+            l.enable_data_logging(odr=evkit_config.odr)
+            collector.add_stream(KX132DataStream(l.sensors))
+
+        collector.read(loop=evkit_config.loop or None)
+
+    finally:
+        for l in loggers:
+            l.power_off()
+        for connection_manager in boards:
+            connection_manager.disconnect()
+
+
+if __name__ == '__main__':
+    main()
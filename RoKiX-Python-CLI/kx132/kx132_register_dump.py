@@ -22,14 +22,31 @@
 """ Reads and prints sensor register content """
 import imports  # pylint: disable=unused-import
 from kx_lib.kx_board import ConnectionManager
+from kx_lib.kx_register_dump import DUMP_FORMATS, DUMP_FORMAT_TEXT, RegisterDump, format_diff
+from kx_lib.kx_util import evkit_config
 from kx132.kx132_driver import KX132Driver
 
 
 def main():
+    evkit_config.add_argument('--dump_format', choices=DUMP_FORMATS, default=DUMP_FORMAT_TEXT,
+                              help='Register dump output format')
+    evkit_config.add_argument('--dump_file', default=None,
+                              help='Save register dump to file instead of printing it. Format is selected by file extension.')
+    evkit_config.add_argument('--compare', default=None,
+                              help='Print registers which differ from earlier dump saved in json or csv file')
+    evkit_config.parse_args()
+
     sensor = KX132Driver()
     cm = ConnectionManager()
     cm.add_sensor(sensor)
-    sensor.register_dump()
+    dump = sensor.read_register_dump()
+
+    if evkit_config.compare:
+        print(format_diff(RegisterDump.load(evkit_config.compare).diff(dump)))
+    elif evkit_config.dump_file:
+        dump.save(evkit_config.dump_file)
+    else:
+        print(dump.format(evkit_config.dump_format))
 
 
 if __name__ == '__main__':
@@ -26,7 +26,7 @@ import imports  # pylint: disable=unused-import
 from kx_lib import kx_logger
 from kx_lib.kx_data_stream import StreamConfig
 from kx_lib.kx_util import get_drdy_pin_index, get_drdy_timer, evkit_config, convert_to_enumkey
-from kx_lib.kx_configuration_enum import CH_ACC, POLARITY_DICT, CFG_POLARITY, ADAPTER_GPIO1_INT, ADAPTER_GPIO2_INT, REG_POLL
+from kx_lib.kx_configuration_enum import CH_ACC, POLARITY_DICT, CFG_POLARITY, ADAPTER_GPIO1_INT, ADAPTER_GPIO2_INT, MACRO_GPIO1_INT, MACRO_GPIO2_INT, REG_POLL
 from kx_lib.kx_data_logger import SingleChannelReader
 from kx134.kx134_driver import KX134Driver, r, b, e
 
@@ -128,10 +128,10 @@ def enable_data_logging(sensor,
 
     _intpin = 0
     if int_number is None:
-        if evkit_config.drdy_function_mode == ADAPTER_GPIO1_INT:
+        if evkit_config.drdy_function_mode in [ADAPTER_GPIO1_INT, MACRO_GPIO1_INT]:
             _intpin = 1
 
-        elif evkit_config.drdy_function_mode == ADAPTER_GPIO2_INT:
+        elif evkit_config.drdy_function_mode in [ADAPTER_GPIO2_INT, MACRO_GPIO2_INT]:
             _intpin = 2
 
         elif evkit_config.drdy_function_mode == REG_POLL:
@@ -182,9 +182,20 @@ class KX134DataLogger(SingleChannelReader):
 
 
 def main():
+    evkit_config.add_argument(
+        '--batch',
+        type=int,
+        default=None,
+        help='Decode stream data in batches of given size (needs numpy)'
+    )
     l = KX134DataLogger([KX134Driver])
     l.enable_data_logging(odr=evkit_config.odr)
-    l.run(KX134DataStream)
+
+    reader_arguments = {}
+    if evkit_config.batch and evkit_config.stream_mode:
+        reader_arguments['batch'] = evkit_config.batch
+
+    l.run(KX134DataStream, reader_arguments=reader_arguments)
 
 
 if __name__ == '__main__':
@@ -25,73 +25,28 @@ KX134 data logger application
 # pylint: disable=duplicate-code
 import imports  # pylint: disable=unused-import
 from kx_lib import kx_logger
-from kx_lib.kx_data_stream import StreamConfig
-from kx_lib.kx_util import get_drdy_pin_index, evkit_config
-from kx_lib.kx_configuration_enum import POLARITY_DICT, CFG_PULLUP, CFG_TARGET, CFG_POLARITY, CFG_SAD, CFG_CS
+from kx_lib.kx_util import evkit_config
+from kx_lib.kx_configuration_enum import POLARITY_DICT, CFG_POLARITY
 from kx_lib.kx_data_logger import SingleChannelReader
+from kx_lib.kx_fifo_stream import FifoStreamConfig, fifo_watermark, link_bandwidth, FIFO_CAPACITY_16BIT, FIFO_CAPACITY_8BIT
 from kx134.kx134_driver import KX134Driver, r, b
 from kx134.kx134_data_logger import enable_data_logging
-from kx_lib.kx_data_stream import RequestMessageDefinition
 
 LOGGER = kx_logger.get_logger(__name__)
 # LOGGER.setLevel(kx_logger.DEBUG)
 
 _CODE_FORMAT_VERSION = 3.0
 
-WATERMARK_LEVEL = 10
 
-
-class KX134FIFODataStream(StreamConfig):
-    fmt = "<Bhhh"
-    hdr = "ch!ax!ay!az"
-    reg = r.KX134_1211_BUF_READ
+class KX134FIFODataStream(FifoStreamConfig):
+    reg_buf_cntl1 = r.KX134_1211_BUF_CNTL1
+    reg_buf_status_1 = r.KX134_1211_BUF_STATUS_1
+    reg_buf_read = r.KX134_1211_BUF_READ
 
     def __init__(self, sensors, pin_index=None, timer=None):
-        "DRDY and timer data stream"
+        "Watermark interrupt data stream"
         assert sensors[0].name in KX134Driver.supported_parts
-        StreamConfig.__init__(self, sensors[0])
-
-        # get pin_index if it is not given and timer is not used
-        if pin_index is None:
-            pin_index = get_drdy_pin_index()
-        protocol = self.adapter.protocol
-        message = RequestMessageDefinition(self.sensor,
-                                           fmt=self.fmt,
-                                           hdr=self.hdr,
-                                           reg=self.reg,
-                                           pin_index=pin_index)
-        # Create macro handler for interrupt
-        req = protocol.create_macro_req(
-            trigger_type=protocol.EVKIT_MACRO_TYPE_INTR,
-            gpio_pin=message.gpio_pin,
-            gpio_sense=self.sense_dict[sensors[0].resource[CFG_POLARITY]],
-            gpio_pullup=self.pullup_dict[sensors[0].resource[CFG_PULLUP]]
-        )
-        self.adapter.send_message(req)
-        _, macro_id = self.adapter.receive_message(
-            wait_for_message=protocol.EVKIT_MSG_CREATE_MACRO_RESP)
-        self.macro_id_list.append(macro_id)
-        self.msg_ind_dict[macro_id] = message
-        message.msg_req.append(req)
-        LOGGER.debug('Macro created with id %d', macro_id)
-
-        SPI_MODE = 0 if CFG_SAD in self.sensor.resource else 128
-
-        req = protocol.add_macro_action_req(
-            macro_id,
-            action=protocol.EVKIT_MACRO_ACTION_READ,
-            target=self.sensor.resource[CFG_TARGET],
-            identifier=self.sensor.get_identifier(),
-            start_register=message.reg | SPI_MODE,
-            bytes_to_read=6,
-            append=False,
-            run_count=WATERMARK_LEVEL)
-
-        self.adapter.send_message(req)
-        self.adapter.receive_message(
-            wait_for_message=protocol.EVKIT_MSG_ADD_MACRO_ACTION_RESP)
-        message.msg_req.append(req)
-        LOGGER.debug(req)
+        FifoStreamConfig.__init__(self, sensors, pin_index, timer)
 
 
 def enable_fifo_logging(
@@ -99,11 +54,19 @@ def enable_fifo_logging(
     buffer_mode=b.KX134_1211_BUF_CNTL2_BM_FIFO,
     buffer_res=b.KX134_1211_BUF_CNTL2_BRES,
     axis_mask=0x03,
-    watermark_level=2,
+    watermark_level=None,
     **kwargs
 ):
     kwargs.pop("sensor", None)
     kwargs.pop("power_off_on", None)
+    if watermark_level is None:
+        # drain with full indication messages at rate which the link can handle
+        watermark_level = fifo_watermark(
+            kwargs.get('odr', 25),
+            6 if buffer_res else 3,
+            FIFO_CAPACITY_16BIT if buffer_res else FIFO_CAPACITY_8BIT,
+            link_bandwidth(sensor.connection_manager.bus2_configuration))
+
     sensor.set_power_off()
     enable_data_logging(sensor, power_off_on=False, **kwargs)
     sensor.enable_fifo(buffer_mode, buffer_res, axis_mask)
@@ -140,8 +103,7 @@ class KX134FifoDataLogger(SingleChannelReader):
 
 def main():
     l = KX134FifoDataLogger([KX134Driver])
-    l.enable_data_logging(odr=evkit_config.odr,
-                          watermark_level=WATERMARK_LEVEL)
+    l.enable_data_logging(odr=evkit_config.odr)
     l.run(KX134FIFODataStream)
 
 
@@ -143,67 +143,69 @@ def enable_wu_bts(sensor,
         sensor.set_power_off()
         time.sleep(0.1)
 
-    # Wakeup dircetion mask and occurence
-    sensor.set_bit_pattern(
-        r.KX134_1211_INC2,
-        cfg.WUF_AXES | cfg.AOI,
-        WUF_AXES | m.KX134_1211_INC2_AOI_MASK)
-
-    # Interrupt pin routings and settings for wu and bts
-    sensor.set_bit(r.KX134_1211_INC6, b.KX134_1211_INC6_WUFI2)    # wu to int2
-    sensor.set_bit(r.KX134_1211_INC6, b.KX134_1211_INC6_BTSI2)    # bts to int2
-    sensor.set_bit(r.KX134_1211_INC5, b.KX134_1211_INC5_IEN2)     # enable in2 pin
-    polarity = POLARITY_DICT[sensor.resource[CFG_POLARITY]]
-    LOGGER.debug('Configuring interrupt polarity {}'.format(
-        sensor.resource[CFG_POLARITY]))
-    sensor.set_interrupt_polarity(intpin=2, polarity=polarity)
-
-    # Wakeup and back to sleep settings
-    # Wakeup threshold and Back to sleep threshold are 10 bit values
-    sensor.write_register(r.KX134_1211_WUFTH, cfg.WUF_THRESHOLD_VALUE & 0xff)
-    sensor.write_register(r.KX134_1211_BTSTH, cfg.BTS_THRESHOLD_VALUE & 0xff)
-    # Wakeup and back to sleep msb's
-    bts_msb = ((cfg.BTS_THRESHOLD_VALUE >> 8) & 0x07) << 4
-    wuf_msb = ((cfg.WUF_THRESHOLD_VALUE >> 8) & 0x07)
-    sensor.write_register(r.KX134_1211_BTSWUFTH, bts_msb | wuf_msb)
-    # Wakeup and back to sleep counters
-    sensor.write_register(r.KX134_1211_WUFC, cfg.WUF_COUNTER_VALUE)
-    sensor.write_register(r.KX134_1211_BTSC, cfg.BTS_COUNTER_VALUE)
-
-    # Enable
-    # NOTE () is mandatory on if else clause otherwise value evaluated incorectly
-    sensor.write_register(
-        r.KX134_1211_CNTL4,
-        b.KX134_1211_CNTL4_WUFE |  # WUF enabled
-        b.KX134_1211_CNTL4_BTSE |  # BTS enabled
-        (b.KX134_1211_CNTL4_PR_MODE if cfg.PR_MODE else 0) |
-        (b.KX134_1211_CNTL4_TH_MODE if cfg.TH_MODE else 0) |
-        (b.KX134_1211_CNTL4_C_MODE_DECREMENTED if cfg.C_MODE else b.KX134_1211_CNTL4_C_MODE_RESET)
-    )
-
-    # print('a 0b{:08b}'.format((sensor.read_register(r.KX134_1211_CNTL4)[0])))
-
-    # Wakeup odr
-    sensor.set_bit_pattern(r.KX134_1211_CNTL3, e.KX134_1211_CNTL3_OWUF[convert_to_enumkey(odr_owuf)], m.KX134_1211_CNTL3_OWUF_MASK)
-    # Back to sleep odr
-    sensor.set_bit_pattern(r.KX134_1211_CNTL4, e.KX134_1211_CNTL4_OBTS[convert_to_enumkey(odr_bts)], m.KX134_1211_CNTL4_OBTS_MASK)
-
-    # set Motion engine to wake mode
-    sensor.set_bit(r.KX134_1211_CNTL5, b.KX134_1211_CNTL5_MAN_SLEEP)
-
-    # route raw data or ADP data to WUFBTS
-    if ADP_WB_ISEL:  # ADP data to Motion Engine
-        # NOTE ADP must be enabled and configured separately kx134_raw_adp_logger.configure_adp()
-
-        # route adp data to Motion engine (instead of raw data)
-        sensor.set_bit(r.KX134_1211_ADP_CNTL2, b.KX134_1211_ADP_CNTL2_ADP_WB_ISEL)
-
-        # ADP to WUF works only with RMS data
-        sensor.set_bit(r.KX134_1211_ADP_CNTL2, b.KX134_1211_ADP_CNTL2_RMS_WB_OSEL)  # ADP RMS output data
-
-    else:  # raw data to Motion Engine
-        # route raw data to Motion engine (instead of ADP data)
-        sensor.reset_bit(r.KX134_1211_ADP_CNTL2, b.KX134_1211_ADP_CNTL2_ADP_WB_ISEL)
+    # configuration writes are sent at once when the batch ends
+    with sensor.batch():
+        # Wakeup dircetion mask and occurence
+        sensor.set_bit_pattern(
+            r.KX134_1211_INC2,
+            cfg.WUF_AXES | cfg.AOI,
+            WUF_AXES | m.KX134_1211_INC2_AOI_MASK)
+
+        # Interrupt pin routings and settings for wu and bts
+        sensor.set_bit(r.KX134_1211_INC6, b.KX134_1211_INC6_WUFI2)    # wu to int2
+        sensor.set_bit(r.KX134_1211_INC6, b.KX134_1211_INC6_BTSI2)    # bts to int2
+        sensor.set_bit(r.KX134_1211_INC5, b.KX134_1211_INC5_IEN2)     # enable in2 pin
+        polarity = POLARITY_DICT[sensor.resource[CFG_POLARITY]]
+        LOGGER.debug('Configuring interrupt polarity {}'.format(
+            sensor.resource[CFG_POLARITY]))
+        sensor.set_interrupt_polarity(intpin=2, polarity=polarity)
+
+        # Wakeup and back to sleep settings
+        # Wakeup threshold and Back to sleep threshold are 10 bit values
+        sensor.write_register(r.KX134_1211_WUFTH, cfg.WUF_THRESHOLD_VALUE & 0xff)
+        sensor.write_register(r.KX134_1211_BTSTH, cfg.BTS_THRESHOLD_VALUE & 0xff)
+        # Wakeup and back to sleep msb's
+        bts_msb = ((cfg.BTS_THRESHOLD_VALUE >> 8) & 0x07) << 4
+        wuf_msb = ((cfg.WUF_THRESHOLD_VALUE >> 8) & 0x07)
+        sensor.write_register(r.KX134_1211_BTSWUFTH, bts_msb | wuf_msb)
+        # Wakeup and back to sleep counters
+        sensor.write_register(r.KX134_1211_WUFC, cfg.WUF_COUNTER_VALUE)
+        sensor.write_register(r.KX134_1211_BTSC, cfg.BTS_COUNTER_VALUE)
+
+        # Enable
+        # NOTE () is mandatory on if else clause otherwise value evaluated incorectly
+        sensor.write_register(
+            r.KX134_1211_CNTL4,
+            b.KX134_1211_CNTL4_WUFE |  # WUF enabled
+            b.KX134_1211_CNTL4_BTSE |  # BTS enabled
+            (b.KX134_1211_CNTL4_PR_MODE if cfg.PR_MODE else 0) |
+            (b.KX134_1211_CNTL4_TH_MODE if cfg.TH_MODE else 0) |
+            (b.KX134_1211_CNTL4_C_MODE_DECREMENTED if cfg.C_MODE else b.KX134_1211_CNTL4_C_MODE_RESET)
+        )
+
+        # print('a 0b{:08b}'.format((sensor.read_register(r.KX134_1211_CNTL4)[0])))
+
+        # Wakeup odr
+        sensor.set_bit_pattern(r.KX134_1211_CNTL3, e.KX134_1211_CNTL3_OWUF[convert_to_enumkey(odr_owuf)], m.KX134_1211_CNTL3_OWUF_MASK)
+        # Back to sleep odr
+        sensor.set_bit_pattern(r.KX134_1211_CNTL4, e.KX134_1211_CNTL4_OBTS[convert_to_enumkey(odr_bts)], m.KX134_1211_CNTL4_OBTS_MASK)
+
+        # set Motion engine to wake mode
+        sensor.set_bit(r.KX134_1211_CNTL5, b.KX134_1211_CNTL5_MAN_SLEEP)
+
+        # route raw data or ADP data to WUFBTS
+        if ADP_WB_ISEL:  # ADP data to Motion Engine
+            # NOTE ADP must be enabled and configured separately kx134_raw_adp_logger.configure_adp()
+
+            # route adp data to Motion engine (instead of raw data)
+            sensor.set_bit(r.KX134_1211_ADP_CNTL2, b.KX134_1211_ADP_CNTL2_ADP_WB_ISEL)
+
+            # ADP to WUF works only with RMS data
+            sensor.set_bit(r.KX134_1211_ADP_CNTL2, b.KX134_1211_ADP_CNTL2_RMS_WB_OSEL)  # ADP RMS output data
+
+        else:  # raw data to Motion Engine
+            # route raw data to Motion engine (instead of ADP data)
+            sensor.reset_bit(r.KX134_1211_ADP_CNTL2, b.KX134_1211_ADP_CNTL2_ADP_WB_ISEL)
 
     # Turn on operating mode (disables setup)
     if power_off_on:
@@ -240,25 +242,26 @@ def main():
 
     if evkit_config.use_adp:
         sensor.set_power_off()
-        kx134_raw_adp_logger.enable_data_logging(
-            sensor,
-            odr=evkit_config.odr,
-            max_range='2G',
-            lp_mode='128_SAMPLE_AVG',
-            low_pass_filter='ODR_2',
-            filter1_setting=None,
-            filter2_setting=None,
-            adp_odr=evkit_config.odr,
-            rms_average='2_SAMPLE_AVG',
-            power_off_on=False)
-
-        enable_wu_bts(
-            sensor,
-            ADP_WB_ISEL=1,
-            odr_owuf=12.5,
-            odr_bts=12.5,
-            cfg=Parameter_set_1,
-            power_off_on=False)  # ADP data to WUFBTS
+        with sensor.batch():
+            kx134_raw_adp_logger.enable_data_logging(
+                sensor,
+                odr=evkit_config.odr,
+                max_range='2G',
+                lp_mode='128_SAMPLE_AVG',
+                low_pass_filter='ODR_2',
+                filter1_setting=None,
+                filter2_setting=None,
+                adp_odr=evkit_config.odr,
+                rms_average='2_SAMPLE_AVG',
+                power_off_on=False)
+
+            enable_wu_bts(
+                sensor,
+                ADP_WB_ISEL=1,
+                odr_owuf=12.5,
+                odr_bts=12.5,
+                cfg=Parameter_set_1,
+                power_off_on=False)  # ADP data to WUFBTS
 
         sensor.set_power_on(CH_ACC | CH_ADP)
 
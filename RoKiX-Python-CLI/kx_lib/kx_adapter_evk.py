@@ -6,23 +6,35 @@ import time
 import struct
 from kx_lib import kx_protocol
 from kx_lib import kx_protocol_2_x
-from kx_lib.kx_exception import ProtocolException
+from kx_lib.kx_exception import ProtocolException, ProtocolTimeoutException, ProtocolPipelineException
 from kx_lib.kx_base_class import KxAdapterBase
 from kx_lib import kx_logger
-from kx_lib.kx_configuration_enum import PULLUP, PULLDOWN, NOPULL, NODRIVE, DRIVELOW, DRIVEHIGH
+from kx_lib.kx_configuration_enum import PULLUP, PULLDOWN, NOPULL, NODRIVE, DRIVELOW, DRIVEHIGH, MAX_PACKET_SIZE
 
 LOGGER = kx_logger.get_logger(__name__)
 
 # LOGGER.setLevel(kx_logger.INFO)
 # LOGGER.setLevel(kx_logger.DEBUG)
 
+# max amount of pipelined requests waiting for response
+PIPELINE_WINDOW = 8
+
 
 class KxAdapterEvk(KxAdapterBase):
-    def __init__(self, bus2):
+    """Connection to RoKiX firmware.
+
+    Args:
+        bus2: opened bus2 connection
+        known_board(dict): discovery cache entry of the board. If firmware_id reported by the
+            board matches the entry then device UID is taken from the entry instead of querying it.
+    """
+
+    def __init__(self, bus2, known_board=None):
         KxAdapterBase.__init__(self)
         self.stream_support = True
         self.bus2 = bus2
         self.protocol = None  # protocol engine instance and message definitions
+        self._known_board = known_board or {}
 
         self.adapter_connect()
 
@@ -51,6 +63,69 @@ class KxAdapterEvk(KxAdapterBase):
         # wait for response message
         self.receive_message(self.protocol.EVKIT_MSG_WRITE_RESP)
 
+    def max_write_length(self):
+        "Max amount of register values fitting in one write request message"
+        return MAX_PACKET_SIZE - len(self.protocol.write_req(0, 0, 0, []))
+
+    def max_read_length(self):
+        "Max amount of register values fitting in one read response message"
+        return MAX_PACKET_SIZE - self.protocol.READ_RESP_HEADER_LENGTH
+
+    def adapter_write_sensor_registers_i2c(self, target, sad, writes):
+        """Write multiple registers without waiting response of each write before sending next one.
+
+        Args:
+            writes (list): (register, values) tuples
+
+        Raises:
+            ProtocolPipelineException: One or more writes failed. Other writes are done.
+        """
+        requests = [self.protocol.write_req(target, sad, register, values) for register, values in writes]
+        self.send_pipelined(requests, self.protocol.EVKIT_MSG_WRITE_RESP)
+
+    def send_pipelined(self, requests, response_type, window=PIPELINE_WINDOW):
+        """Send requests back-to-back and collect their responses in order.
+
+        At most window requests are waiting for response at the same time so
+        that firmware receive buffer is not overflown.
+
+        Args:
+            requests (list): request messages
+            response_type (int): response message type of all requests
+            window (int): max amount of requests waiting for response
+
+        Returns:
+            list: unpacked responses, None for failed requests
+
+        Raises:
+            ProtocolPipelineException: One or more requests failed.
+        """
+        responses = []
+        errors = []
+        sent = 0
+        for index in range(len(requests)):
+            while sent < len(requests) and sent - index < window:
+                self.send_message(requests[sent])
+                sent += 1
+
+            try:
+                responses.append(self.receive_message(response_type))
+            except ProtocolTimeoutException as exception:
+                # responses can not be matched to requests anymore
+                errors.extend((ind, exception) for ind in range(index, len(requests)))
+                responses.extend([None] * (len(requests) - index))
+                break
+            except ProtocolException as exception:
+                errors.append((index, exception))
+                responses.append(None)
+
+        if errors:
+            for index, exception in errors:
+                LOGGER.error('Pipelined request %d failed: %s' % (index, exception))
+            raise ProtocolPipelineException('%d of %d pipelined requests failed' % (len(errors), len(requests)), errors)
+
+        return responses
+
     def adapter_read_gpio(self, gpio_pin):
 
         msg = self.protocol.gpio_state_req(gpio_pin)
@@ -294,7 +369,7 @@ class KxAdapterEvk(KxAdapterBase):
         self.engine = kx_protocol.ProtocolEngine(self.bus2)
 
         for retry in range(2):
-            self.bus2.flush()  # Flush com port in case there is already some unwanted data
+            self.engine.flush()  # Flush com port in case there is already some unwanted data
 
             self.send_message(kx_protocol.version_req())  # Version REQ is same for all protocol versions
 
@@ -304,7 +379,9 @@ class KxAdapterEvk(KxAdapterBase):
             # https://github.com/pyserial/pyserial/issues/287
 
             try:
-                _, [major_version, minor_version] = self.receive_message(wait_for_message=kx_protocol.EVKIT_MSG_VERSION_RESP)
+                version_resp = self.engine.receive_single_message(wait_for_message=kx_protocol.EVKIT_MSG_VERSION_RESP)
+                LOGGER.debug(version_resp)
+                _, [major_version, minor_version] = kx_protocol.unpack_response_data(version_resp)
                 self.fw_protocol_version = '%d.%d' % (major_version, minor_version)
                 break
 
@@ -328,16 +405,27 @@ class KxAdapterEvk(KxAdapterBase):
 
             self.adapter_read_sensor_register_spi = self.adapter_read_sensor_register_i2c
             self.adapter_write_sensor_register_spi = self.adapter_write_sensor_register_i2c
-
-            # ask board_id
-            self.send_message(kx_protocol.version_req())
-            _, [_, _, board_id] = self.receive_message(wait_for_message=kx_protocol.EVKIT_MSG_VERSION_RESP)
+            self.adapter_write_sensor_registers_spi = self.adapter_write_sensor_registers_i2c
+
+            # board_id is included in version response of protocol v2
+            if len(version_resp) > 5:
+                _, [_, _, board_id] = kx_protocol_2_x.unpack_response_data(version_resp)
+            else:
+                self.send_message(kx_protocol.version_req())
+                _, [_, _, board_id] = self.receive_message(wait_for_message=kx_protocol.EVKIT_MSG_VERSION_RESP)
             self.board_id = board_id
             LOGGER.info('Board hw id %s' % board_id)
 
-            LOGGER.info('Device UID ' + ':'.join(['%02X' % t for t in self.get_dev_id()]))
-            LOGGER.info('Firmware version '
-                        + ''.join(['%02x' % t for t in self.get_firmware_id()]))
+            self.firmware_id = ''.join(['%02x' % t for t in self.get_firmware_id()])
+            LOGGER.info('Firmware version ' + self.firmware_id)
+
+            if self._known_board.get('dev_id') and \
+                    self._known_board.get('firmware_id') == self.firmware_id and \
+                    self._known_board.get('board_id') == board_id:
+                self.dev_id = self._known_board['dev_id']
+            else:
+                self.dev_id = ':'.join(['%02X' % t for t in self.get_dev_id()])
+            LOGGER.info('Device UID ' + self.dev_id)
 
         else:
             raise ProtocolException('Invalid protocol version (%d.%d)' % (major_version, minor_version))
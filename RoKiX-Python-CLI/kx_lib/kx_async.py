@@ -0,0 +1,385 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""asyncio version of the evaluation kit connection, protocol engine and adapter.
+
+One event loop can drive multiple boards, each board having own KxAsyncComPort,
+AsyncProtocolEngine and KxAsyncAdapterEvk instance.
+
+Note:
+    Python 3 only. Serial port support needs pyserial-asyncio package.
+
+Example:
+    async def main():
+        com_port = KxAsyncComPort(bus2_configuration)
+        await com_port.initialize('/dev/ttyACM0')
+        adapter = KxAsyncAdapterEvk(com_port)
+        await adapter.adapter_connect()
+        print(await adapter.adapter_read_sensor_register_i2c(target, sad, 0x13, 1))
+        await adapter.adapter_disconnect()
+"""
+import asyncio
+from collections import deque
+from kx_lib import kx_protocol
+from kx_lib import kx_protocol_2_x
+from kx_lib.kx_bus2 import KxComPort
+from kx_lib.kx_exception import ProtocolException, ProtocolTimeoutException, EvaluationKitException
+from kx_lib.kx_protocol import KxFrameBuffer
+from kx_lib.kx_protocol_definition_2_x import EVKIT_MSG_MACRO_IND_BASE
+from kx_lib.kx_configuration_enum import PULLUP, PULLDOWN, NOPULL, NODRIVE, DRIVELOW, DRIVEHIGH
+from kx_lib import kx_logger
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+LOGGER = kx_logger.get_logger(__name__)
+
+# LOGGER.setLevel(kx_logger.DEBUG)
+
+RESPONSE_TIMEOUT = 2.0  # seconds
+INDICATION_QUEUE_SIZE = 10000  # per macro
+
+
+class KxAsyncComPort(object):
+    """Serial port connection using asyncio streams.
+
+    Args:
+        bus2_configuration (dict): bus2 configuration blob from board configuration json file.
+    """
+
+    def __init__(self, bus2_configuration):
+        if serial_asyncio is None:
+            raise EvaluationKitException('pyserial-asyncio is needed for asyncio serial port.')
+        self.bus2_configuration = bus2_configuration
+        self._reader = None
+        self._writer = None
+
+    def get_com_port(self):
+        "Autodetect connected serial devices. See KxComPort.get_com_port()"
+        return KxComPort(self.bus2_configuration).get_com_port()
+
+    async def initialize(self, comport):
+        """Open the serial connection.
+
+        Args:
+            comport (str): Name of the serial device (e.g. 'COM9', '/dev/ttyACM0').
+        """
+        self._reader, self._writer = await serial_asyncio.open_serial_connection(
+            url=comport,
+            baudrate=self.bus2_configuration['baud_rate'],
+            rtscts=self.bus2_configuration['rtscts'],
+            xonxoff=self.bus2_configuration['xonxoff'])
+
+        delay = self.bus2_configuration['start_up_delay_ms']
+        if delay > 0:
+            LOGGER.info('Waiting start up delay {}(ms).'.format(delay))
+            await asyncio.sleep(delay / 1000.0)
+
+    async def read_available(self):
+        """Read all data what is available, wait until at least one byte is received."""
+        data = await self._reader.read(4096)
+        if not data:
+            raise ProtocolException('Connection closed.')
+        return data
+
+    def write(self, data):
+        LOGGER.debug(data)
+        self._writer.write(bytes(data))
+
+    async def drain(self):
+        await self._writer.drain()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class AsyncProtocolEngine(object):
+    """Sends requests and routes received messages.
+
+    Received responses resolve the oldest pending request waiting for that
+    response type. Error indication fails the oldest pending request of any type.
+    Macro indications are stored to a queue per macro id.
+
+    Args:
+        connection (KxAsyncComPort): connection to the board
+        protocol (module): kx_protocol or kx_protocol_2_x
+    """
+
+    def __init__(self, connection, protocol=kx_protocol):
+        self.connection = connection
+        self.protocol = protocol
+        self.frame_buffer = KxFrameBuffer()
+        self.indication_queue_size = INDICATION_QUEUE_SIZE
+        self.dropped_indications = 0
+        self._pending = {}  # {response type: deque of futures}
+        self._outstanding = deque()  # futures of all pending requests, oldest first
+        self._indications = {}  # {macro id: asyncio.Queue}
+        self._reader_task = None
+
+    def start(self):
+        if self._reader_task is None:
+            self._reader_task = asyncio.ensure_future(self._reader_loop())
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+
+    async def _reader_loop(self):
+        try:
+            while True:
+                self.frame_buffer.feed(await self.connection.read_available())
+                message = self.frame_buffer.pop_frame()
+                while message is not None:
+                    self._dispatch(message)
+                    message = self.frame_buffer.pop_frame()
+
+        except ProtocolException as exception:
+            # wake up all waiters
+            for futures in self._pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(exception)
+            raise
+
+    def _dispatch(self, message):
+        message_type = message[1]
+
+        if message_type >= EVKIT_MSG_MACRO_IND_BASE:
+            queue = self.indication_queue(message_type)
+            if queue.full():
+                queue.get_nowait()
+                self.dropped_indications += 1
+            queue.put_nowait(message)
+            return
+
+        if message_type == self.protocol.EVKIT_MSG_ERROR_IND:
+            # fail the oldest pending request
+            exception = ProtocolException('Error message received. Error id %d' % message[2], message[2])
+            while self._outstanding:
+                future = self._outstanding.popleft()
+                if not future.done():  # skip timed out requests
+                    future.set_exception(exception)
+                    return
+            LOGGER.error(exception)
+            return
+
+        futures = self._pending.get(message_type)
+        while futures:
+            future = futures.popleft()
+            if not future.done():  # skip cancelled requests
+                future.set_result(message)
+                return
+
+        LOGGER.debug('Unexpected message %s' % message)
+
+    def indication_queue(self, macro_id):
+        if macro_id not in self._indications:
+            self._indications[macro_id] = asyncio.Queue(self.indication_queue_size)
+        return self._indications[macro_id]
+
+    async def request(self, message, response_type, timeout=RESPONSE_TIMEOUT):
+        """Send request and wait for its response.
+
+        Args:
+            message (array): request message
+            response_type (int): EVKIT_MSG_*_RESP message type to wait
+            timeout (float): max time to wait in seconds
+
+        Returns:
+            array: received response message
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._pending.setdefault(response_type, deque()).append(future)
+        self._outstanding.append(future)
+        try:
+            self.connection.write(message)
+            await self.connection.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ProtocolTimeoutException('No response 0x%02x received.' % response_type)
+        finally:
+            if future in self._outstanding:
+                self._outstanding.remove(future)
+
+    async def receive_indication(self, macro_id, timeout=None):
+        """Wait for next macro indication.
+
+        Args:
+            macro_id (int): macro id
+            timeout (float): max time to wait in seconds, None waits forever
+
+        Returns:
+            array: received indication message
+        """
+        try:
+            return await asyncio.wait_for(self.indication_queue(macro_id).get(), timeout)
+        except asyncio.TimeoutError:
+            raise ProtocolTimeoutException('No data received.')
+
+
+class KxAsyncAdapterEvk(object):
+    """asyncio variant of KxAdapterEvk register, GPIO and macro methods.
+
+    Args:
+        bus2 (KxAsyncComPort): initialized connection
+    """
+
+    def __init__(self, bus2):
+        self.bus2 = bus2
+        self.protocol = kx_protocol
+        self.engine = AsyncProtocolEngine(bus2)
+        self.board_id = -1
+        self.fw_protocol_version = '0.0'
+        self.firmware_id = None
+        self.stream_support = True
+
+    async def request(self, message, response_type):
+        resp = await self.engine.request(message, response_type)
+        LOGGER.debug(resp)
+        return self.protocol.unpack_response_data(resp)
+
+    async def adapter_connect(self):
+        LOGGER.debug('>connect')
+        self.engine.start()
+
+        _, [major_version, minor_version] = await self.request(
+            kx_protocol.version_req(), kx_protocol.EVKIT_MSG_VERSION_RESP)
+        self.fw_protocol_version = '%d.%d' % (major_version, minor_version)
+        LOGGER.info('Firmware protocol version %d.%d' % (major_version, minor_version))
+
+        if (major_version, minor_version) in [(1, 1), (1, 2)]:
+            self.protocol = kx_protocol
+
+        elif (major_version, minor_version) == (2, 0):
+            self.protocol = kx_protocol_2_x
+
+            _, [_, _, self.board_id] = await self.request(
+                kx_protocol.version_req(), kx_protocol.EVKIT_MSG_VERSION_RESP)
+            LOGGER.info('Board hw id %s' % self.board_id)
+
+            _, firmware_id = await self.request(
+                self.protocol.dev_fw_id_req(), self.protocol.EVKIT_MSG_DEV_INFO_RESP)
+            self.firmware_id = ''.join(['%02x' % t for t in firmware_id])
+            LOGGER.info('Firmware version ' + self.firmware_id)
+
+        else:
+            raise ProtocolException('Invalid protocol version (%d.%d)' % (major_version, minor_version))
+
+        self.engine.protocol = self.protocol
+
+        # map logical pull mode to corresponding protocol definition
+        self.pullup_dict = {
+            NOPULL: self.protocol.EVKIT_GPIO_PIN_NOPULL,
+            PULLDOWN: self.protocol.EVKIT_GPIO_PIN_PULLDOWN,
+            PULLUP: self.protocol.EVKIT_GPIO_PIN_PULLUP
+        }
+        self._drivemode_dict = {
+            NODRIVE: self.protocol.EVKIT_GPIO_PIN_NODRIVE,
+            DRIVELOW: self.protocol.EVKIT_GPIO_PIN_DRIVELOW,
+            DRIVEHIGH: self.protocol.EVKIT_GPIO_PIN_DRIVEHIGH,
+        }
+
+        LOGGER.debug('<connect')
+
+    async def adapter_disconnect(self):
+        LOGGER.debug('>disconnect')
+        await self.engine.stop()
+        self.bus2.close()
+        LOGGER.debug('<disconnect')
+
+    async def adapter_read_sensor_register_i2c(self, target, sad, register, length=1):
+        _, message_data = await self.request(
+            self.protocol.read_req(target, sad, register, length), self.protocol.EVKIT_MSG_READ_RESP)
+        return message_data
+
+    async def adapter_write_sensor_register_i2c(self, target, sad, register, values):
+        await self.request(
+            self.protocol.write_req(target, sad, register, values), self.protocol.EVKIT_MSG_WRITE_RESP)
+
+    # protocol v2 uses same messages for i2c and spi
+    adapter_read_sensor_register_spi = adapter_read_sensor_register_i2c
+    adapter_write_sensor_register_spi = adapter_write_sensor_register_i2c
+
+    async def adapter_read_gpio(self, gpio_pin):
+        _, (_, gpio_state) = await self.request(
+            self.protocol.gpio_state_req(gpio_pin), self.protocol.EVKIT_MSG_GPIO_STATE_RESP)
+        if gpio_state == self.protocol.EVKIT_GPIO_PIN_SENSE_LOW:
+            return 0
+        elif gpio_state == self.protocol.EVKIT_GPIO_PIN_SENSE_HIGH:
+            return 1
+        raise ProtocolException('Unknown EVKIT_MSG_GPIO_STATE_RESP')
+
+    async def adapter_write_gpio(self, gpio_pin, value, connect_input=False):
+        await self.configure_pin(gpio_pin, self.protocol.EVKIT_GPIO_PIN_OUTPUT, value, connect_input)
+
+    async def configure_pin(self, gpio_pin, direction, drivemode, connect_input=True):
+        """Configure a GPIO pin. See KxAdapterEvk.configure_pin()"""
+        if self.protocol.EVKIT_PROTOCOL_VERSION_MAJOR == 1:
+            LOGGER.warning('GPIO configuration not supported on FW 1. Nothing to do.')
+            return
+
+        if connect_input:
+            input_conn_arg = self.protocol.EVKIT_GPIO_PIN_CONNECTED
+        else:
+            input_conn_arg = self.protocol.EVKIT_GPIO_PIN_DISCONNECTED
+
+        if direction == self.protocol.EVKIT_GPIO_PIN_INPUT:
+            drivemode = self.pullup_dict[drivemode]
+        elif direction == self.protocol.EVKIT_GPIO_PIN_OUTPUT:
+            drivemode = self._drivemode_dict[drivemode]
+        else:
+            raise ValueError('invalid pin direction')
+
+        await self.request(
+            self.protocol.gpio_config_req(gpio_pin, direction, input_conn_arg, drivemode),
+            self.protocol.EVKIT_MSG_GPIO_CONFIG_RESP)
+
+    async def configure_pin_as_input(self, gpio_pin, drivemode):
+        await self.configure_pin(gpio_pin, self.protocol.EVKIT_GPIO_PIN_INPUT, drivemode, connect_input=True)
+
+    async def configure_pin_as_output(self, gpio_pin, drivemode, connect_input=False):
+        await self.configure_pin(gpio_pin, self.protocol.EVKIT_GPIO_PIN_OUTPUT, drivemode, connect_input)
+
+    async def create_macro(self, **kwargs):
+        """Create macro. Arguments as in kx_protocol_2_x.create_macro_req()
+
+        Returns:
+            int: macro id
+        """
+        _, macro_id = await self.request(
+            self.protocol.create_macro_req(**kwargs), self.protocol.EVKIT_MSG_CREATE_MACRO_RESP)
+        return macro_id
+
+    async def add_macro_action(self, macro_id, **kwargs):
+        "Add action to macro. Arguments as in kx_protocol_2_x.add_macro_action_req()"
+        await self.request(
+            self.protocol.add_macro_action_req(macro_id, **kwargs), self.protocol.EVKIT_MSG_ADD_MACRO_ACTION_RESP)
+
+    async def start_macro(self, macro_id):
+        await self.request(
+            self.protocol.start_macro_action_req(macro_id), self.protocol.EVKIT_MSG_START_MACRO_RESP)
+
+    async def stop_macro(self, macro_id):
+        await self.request(
+            self.protocol.stop_macro_action_req(macro_id), self.protocol.EVKIT_MSG_STOP_MACRO_RESP)
+
+    async def remove_macro(self, macro_id):
+        await self.request(
+            self.protocol.remove_macro_req(macro_id), self.protocol.EVKIT_MSG_REMOVE_MACRO_RESP)
+
+    async def receive_indication(self, macro_id, timeout=None):
+        """Wait for next indication of a macro.
+
+        Returns:
+            array: indication payload, first byte is macro id
+        """
+        _, payload = self.protocol.unpack_response_data(await self.engine.receive_indication(macro_id, timeout))
+        return payload
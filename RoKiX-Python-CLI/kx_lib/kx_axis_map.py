@@ -0,0 +1,53 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Axis map tables shared by AxisMapper and BinaryLogReader.
+
+Kept free of rokix_settings.cfg and board dependencies so that binary logs can be read without them.
+"""
+from operator import itemgetter, mul
+
+
+def axis_tables(hdr, axis_map, length=None):
+    """Convert axis map to index and negation tables as AxisMapper.map_xyz_axis does the mapping.
+
+    Args:
+        hdr(string): channel names separated with ! mark
+        axis_map(list): axis map of the channel
+        length(int): amount of values in a sample. Defaults to amount of channel names.
+
+    Returns:
+        tuple: list of value indexes where each value is taken from and list of negated value indexes
+    """
+    labels = hdr.split('!')
+    gather = list(range(len(labels) if length is None else length))
+    negate = []
+    xyz_ind = [ind for ind, label in enumerate(labels) if label[-1] in ['x', 'y', 'z']]
+    if not axis_map or not xyz_ind:
+        return gather, negate
+
+    for xyz_data_ind, data_ind in enumerate(xyz_ind):
+        source = axis_map[xyz_data_ind]
+        gather[data_ind] = xyz_ind[source % len(xyz_ind)]
+        if source >= len(xyz_ind):
+            negate.append(data_ind)
+    return gather, negate
+
+
+def axis_mapping(hdr, axis_map, length=None):
+    """Returns function which maps xyz axis of a sample as AxisMapper.map_xyz_axis.
+
+    The function builds one tuple per sample. Samples without mapping are returned as is.
+    """
+    gather, negate = axis_tables(hdr, axis_map, length)
+    if not negate:
+        if gather == list(range(len(gather))):
+            return lambda data: data
+        return itemgetter(*gather)
+
+    signs = [-1 if ind in negate else 1 for ind in range(len(gather))]
+    if len(gather) == 1:
+        return lambda data: (-data[0],)
+
+    getter = itemgetter(*gather)
+    return lambda data: tuple(map(mul, getter(data), signs))
@@ -14,6 +14,8 @@ class KxAdapterBase(object):
         self.board_id = -1
         self.engine = None
         self.fw_protocol_version = "0.0"
+        self.firmware_id = None  # firmware version as hex string if known
+        self.dev_id = None  # board unique hw identifier as text if known
         self.stream_support = False
 
     def adapter_connect(self):
@@ -37,6 +39,27 @@ class KxAdapterBase(object):
     def adapter_write_sensor_register_spi(self, target, chip_select, register, values):
         raise EvaluationKitException('SPI support not available for this adapter')
 
+    def max_write_length(self):
+        "Max amount of register values in one register write"
+        return 1
+
+    def max_read_length(self):
+        "Max amount of register values in one register read"
+        return 1
+
+    def adapter_write_sensor_registers_i2c(self, target, sad, writes):
+        """Write multiple registers. Adapters which support it send writes pipelined.
+
+        Args:
+            writes (list): (register, values) tuples
+        """
+        for register, values in writes:
+            self.adapter_write_sensor_register_i2c(target, sad, register, values)
+
+    def adapter_write_sensor_registers_spi(self, target, chip_select, writes):
+        for register, values in writes:
+            self.adapter_write_sensor_register_spi(target, chip_select, register, values)
+
     def adapter_write_gpio(self, gpio_pin, value, connect_input=False):
         raise EvaluationKitException('Not implemented for this adapter.')
 
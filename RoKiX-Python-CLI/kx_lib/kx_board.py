@@ -4,9 +4,6 @@
 import os
 import json
 from kx_lib.kx_configuration_enum import *  # pylint: disable=unused-wildcard-import,wildcard-import
-from kx_lib.kx_bus2 import KxComPort, KxWinBLE, KxLinuxBLE
-from kx_lib.kx_adapter_aardvark import KxAdapterAardvark
-from kx_lib.kx_adapter_evk import KxAdapterEvk
 from kx_lib.kx_exception import *  # pylint: disable=unused-wildcard-import,wildcard-import
 from kx_lib.kx_util import DelayedKeyboardInterrupt, evkit_config
 
@@ -19,6 +16,41 @@ LOGGER = kx_logger.get_logger(__name__)
 _GPIO_STATE_INPUT, _GPIO_STATE_OUTPUT = range(2)
 
 
+def load_board_config(board_config_json):
+    """Load and verify board configuration json file.
+
+    Args:
+        board_config_json(string): File name of board configuration json file
+
+    Returns:
+        dict: board configuration
+    """
+    board_config = None
+
+    # list of location from where to look configuration file
+    filepath_list = [
+        os.path.join('cfg', board_config_json),
+        os.path.join(os.path.dirname(__file__), '..', 'cfg', board_config_json)]
+
+    for filepath in filepath_list:
+        LOGGER.debug('Search configuration %s' % format(filepath))
+        board_file_name = os.path.abspath(filepath)
+        if os.path.isfile(board_file_name):
+            LOGGER.info('Loading %s' % format(board_file_name))
+            with open(board_file_name, 'r') as infile:
+                board_config = json.load(infile)
+            break
+
+    assert board_config is not None, 'No configuration file found \n%s.' % '\n'.join(filepath_list)
+
+    # verify board config version
+    if board_config['structure_version'] not in SUPPORTED_BOARD_CONFIGURATION_VERSIONS:
+        raise EvaluationKitException('Board config version is %s. Supported versions are %s' % (
+            board_config['structure_version'], SUPPORTED_BOARD_CONFIGURATION_VERSIONS))
+
+    return board_config
+
+
 class ConnectionManager(object):
     """Handle communication from client application to firmware and sensor.
          - Load given board configuration
@@ -27,9 +59,12 @@ class ConnectionManager(object):
 
         Args:
             board_config_json(string): File name of board configoration json file
+            odr(int): ODR used to select board power save mode
+            skip_init(bool): do not apply board_init of board configuration
+            serial_port(string): serial port to open. If None then serial_port setting is used.
         """
 
-    def __init__(self, board_config_json=None, odr=None, skip_init=False):
+    def __init__(self, board_config_json=None, odr=None, skip_init=False, serial_port=None):
         LOGGER.debug('>init')
 
         if board_config_json is None:
@@ -39,35 +74,14 @@ class ConnectionManager(object):
 
         bus2_name = evkit_config.bus2
 
-        assert bus2_name in [BUS2_USB, BUS2_BLE, BLE_PYGATT, BUS2_SOCKET, BUS2_USB_SERIAL, BUS2_USB_AARDVARK]
+        assert bus2_name in [BUS2_USB, BUS2_BLE, BLE_PYGATT, BUS2_SOCKET, BUS2_USB_SERIAL, BUS2_USB_AARDVARK, BUS2_EMULATOR, BUS2_REPLAY]
 
         self.found_sensors = {}
         self._pin_mode_cache = {}  # store gpio pin mode _GPIO_STATE_INPUT / _GPIO_STATE_OUTPUT
         self.bus2_configuration = None
-        self.board_config = None
 
         self.board_config_json = board_config_json
-
-        # list of location from where to look configuration file
-        filepath_list = [
-            os.path.join('cfg', board_config_json),
-            os.path.join(os.path.dirname(__file__), '..', 'cfg', board_config_json)]
-
-        for filepath in filepath_list:
-            LOGGER.debug('Search configuration %s' % format(filepath))
-            board_file_name = os.path.abspath(filepath)
-            if os.path.isfile(board_file_name):
-                LOGGER.info('Loading %s' % format(board_file_name))
-                with open(board_file_name, 'r') as infile:
-                    self.board_config = json.load(infile)
-                break
-
-        assert self.board_config is not None, 'No configuration file found \n%s.' % '\n'.join(filepath_list)
-
-        # verify board config version
-        if self.board_config['structure_version'] not in SUPPORTED_BOARD_CONFIGURATION_VERSIONS:
-            raise EvaluationKitException('Board config version is %s. Supported versions are %s' % (
-                self.board_config['structure_version'], SUPPORTED_BOARD_CONFIGURATION_VERSIONS))
+        self.board_config = load_board_config(board_config_json)
 
         # verify that asked connection was found from board configuration
         connections_list = self.board_config['configuration']['bus2']['connections']
@@ -91,17 +105,31 @@ class ConnectionManager(object):
                 self.bus2_configuration = bus2_connection
                 break
 
+        # emulator and replay do not need connection definition from board configuration
+        if bus2_name in [BUS2_EMULATOR, BUS2_REPLAY]:
+            self.bus2_configuration = {'connection': bus2_name}
+
         if self.bus2_configuration is None:
             raise EvaluationKitException('Selected bus2 "{}" not found from board configuration {}'.format(bus2_name, board_config_json))
 
         # open the connection
+        # transports and adapters are imported only for the selected bus2
         if self.bus2_configuration['connection'] in [BUS2_USB_SERIAL]:
+            from kx_lib.kx_bus2 import KxComPort
+            from kx_lib.kx_adapter_evk import KxAdapterEvk
+            from kx_lib.kx_discovery_cache import DiscoveryCache
             bus2connection = KxComPort(bus2_configuration=self.bus2_configuration)
-            serial_port = evkit_config.serial_port
+            if serial_port is None:
+                serial_port = evkit_config.serial_port
+
+            # earlier connections from cache, used to select the port and skip handshake queries
+            discovery_cache = DiscoveryCache(evkit_config.get('discovery_cache', None))
 
             if serial_port == 'auto':
                 # auto discover the com port
                 found_ports = bus2connection.get_com_port()
+                found_ports = discovery_cache.order_ports(
+                    found_ports, bus2connection.hw_keys, self.board_config[CFG_CONFIGURATION]['board_id'])
             else:
                 # com port defined in rokix_settings.cfg
                 found_ports = [serial_port]
@@ -109,9 +137,14 @@ class ConnectionManager(object):
             for com_port in found_ports:
                 LOGGER.debug("Finding board from %s" % com_port)
                 bus2connection.initialize(com_port)
-                self.kx_adapter = KxAdapterEvk(bus2=bus2connection)
+                hw_key = bus2connection.get_hw_key(com_port)
+                self.kx_adapter = KxAdapterEvk(bus2=self._capture_bus2(bus2connection),
+                                               known_board=discovery_cache.lookup(hw_key))
+                discovery_cache.update(hw_key, com_port, self.kx_adapter)
 
                 if self.kx_adapter.board_id != self.board_config[CFG_CONFIGURATION]['board_id']:
+                    if self.kx_adapter.bus2 is not bus2connection:
+                        self.kx_adapter.bus2.discard()  # capture of other board is not kept
                     bus2connection.close()  # this was not right port. close it.
                     LOGGER.debug('Board id %s received. Expected id is %s.' % (
                         self.kx_adapter.board_id, self.board_config[CFG_CONFIGURATION]['board_id']))
@@ -122,25 +155,63 @@ class ConnectionManager(object):
                 raise EvaluationKitException('Expected evaluation board not found.')
 
         elif self.bus2_configuration['connection'] == BUS2_USB_AARDVARK:
+            from kx_lib.kx_adapter_aardvark import KxAdapterAardvark
             self.kx_adapter = KxAdapterAardvark(bus1config=self.board_config['configuration']['bus1']['targets'][0])
 
         elif self.bus2_configuration['connection'] == BUS2_BLE:
+            from kx_lib.kx_bus2 import KxWinBLE
+            from kx_lib.kx_adapter_evk import KxAdapterEvk
             bus2connection = KxWinBLE(bus2_configuration=self.bus2_configuration)
             # use mac address with BLE
             bus2connection.initialize(mac_address=evkit_config.ble_mac)
 
-            self.kx_adapter = KxAdapterEvk(bus2=bus2connection)
+            self.kx_adapter = KxAdapterEvk(bus2=self._capture_bus2(bus2connection))
 
         elif self.bus2_configuration['connection'] == BLE_PYGATT:
+            from kx_lib.kx_bus2 import KxLinuxBLE
+            from kx_lib.kx_adapter_evk import KxAdapterEvk
             bus2connection = KxLinuxBLE(bus2_configuration=self.bus2_configuration)
 
             bus2connection.initialize(mac_address=evkit_config.ble_mac)
 
+            self.kx_adapter = KxAdapterEvk(bus2=self._capture_bus2(bus2connection))
+
+        elif self.bus2_configuration['connection'] == BUS2_EMULATOR:
+            from kx_lib.kx_emulator import KxEmulator
+            from kx_lib.kx_adapter_evk import KxAdapterEvk
+            rate = evkit_config.get('emulator_odr', None)
+            bus2connection = KxEmulator.from_board_config(
+                self.board_config,
+                rate=odr if rate is None else rate,
+                corrupt_rate=evkit_config.get('emulator_corrupt_rate', 0.0),
+                drop_rate=evkit_config.get('emulator_drop_rate', 0.0))
+
+            self.kx_adapter = KxAdapterEvk(bus2=self._capture_bus2(bus2connection))
+
+        elif self.bus2_configuration['connection'] == BUS2_REPLAY:
+            from kx_lib.kx_capture import KxReplayConnection
+            from kx_lib.kx_adapter_evk import KxAdapterEvk
+            replay_file = evkit_config.get('replay_file', None)
+            if replay_file is None:
+                raise EvaluationKitException('replay_file must be set with bus2=REPLAY.')
+            bus2connection = KxReplayConnection(replay_file,
+                                                speed=evkit_config.get('replay_speed', 0),
+                                                session=evkit_config.get('replay_session', 0))
+
             self.kx_adapter = KxAdapterEvk(bus2=bus2connection)
 
         else:
             raise EvaluationKitException('No rule found to configure bus 2.')
 
+        if evkit_config.get('threaded_receive', False) and \
+                self.bus2_configuration['connection'] in [BUS2_USB_SERIAL, BUS2_BLE]:
+            self.kx_adapter.bus2.start_reader()
+
+        if self.kx_adapter.stream_support:
+            message_cache = self.kx_adapter.engine.message_cache
+            message_cache.policy = evkit_config.get('message_fifo_policy', message_cache.policy)
+            message_cache.max_size = evkit_config.get('message_fifo_size', message_cache.max_size)
+
         # verify that board FW is supported
         if self.kx_adapter.fw_protocol_version not in SUPPORTED_FIRMWARE_PROTOCOL_VERSIONS:
             raise EvaluationKitException("Board reported protocol version %s. Supported versions are %s" % (
@@ -265,6 +336,41 @@ class ConnectionManager(object):
         else:
             raise EvaluationKitException('Unable write data to sensor register.')
 
+    def write_sensor_registers(self, sensor_driver, writes):
+        """Write multiple sensor registers. Writes are pipelined if adapter supports it.
+
+        Args:
+            sensor_driver(SensorDriver): sensor driver instance
+            writes(list): (register, values) tuples in write order
+
+        Note:
+            Sensor must be first added with add_sensor() before this operation can be done.
+        """
+        _, sensor_resource = self.found_sensors[sensor_driver.name]
+        bus1_name = sensor_driver.selected_connectivity
+
+        if bus1_name == BUS1_I2C:
+            target = sensor_resource[CFG_TARGET]
+            sad = sensor_resource[CFG_SAD]
+
+            with DelayedKeyboardInterrupt():
+                return self.kx_adapter.adapter_write_sensor_registers_i2c(target, sad, writes)
+
+        elif bus1_name == BUS1_SPI:
+            target = sensor_resource[CFG_TARGET]
+            cs = sensor_resource[CFG_CS]
+
+            if sensor_resource[CFG_SPI_PROTOCOL] == 1:
+                # When using SPI, Kionix sensors require that the address' MSB is
+                # cleared to indicate that this is a write.
+                writes = [(register & ~(1 << 7), values) for register, values in writes]
+
+            with DelayedKeyboardInterrupt():
+                return self.kx_adapter.adapter_write_sensor_registers_spi(target, cs, writes)
+
+        else:
+            raise EvaluationKitException('Unable write data to sensor register.')
+
     def gpio_config_for_adc(self, sensor_driver):
         """Configure GPIO lines to enable analog sensor.
 
@@ -368,6 +474,25 @@ class ConnectionManager(object):
         pull = PULL_DICT[sensor_driver.resource[CFG_PULLUP]]
         return self.read_gpio_pin(gpio_pin, pull=pull)
 
+    def _capture_bus2(self, bus2connection):
+        """Wrap bus2 connection with KxCaptureConnection if bus2_capture is set.
+
+        Args:
+            bus2connection(KxConnection): opened bus2 connection
+
+        Returns:
+            KxConnection: connection to give to the adapter
+        """
+        capture_file = evkit_config.get('bus2_capture', None)
+        if capture_file is None:
+            return bus2connection
+
+        from kx_lib.kx_capture import KxCaptureConnection
+        LOGGER.info('Capturing bus2 traffic to %s' % capture_file)
+        return KxCaptureConnection(bus2connection, capture_file, metadata={
+            'board_id': self.board_config[CFG_CONFIGURATION]['board_id'],
+            'bus2': self.bus2_configuration['connection']})
+
     def disconnect(self):
         """Close bus2 connection"""
         self.kx_adapter.adapter_disconnect()
@@ -4,10 +4,13 @@
 import os
 import subprocess
 import signal
+import threading
 import time
+from collections import deque
 import serial
-import serial.tools.list_ports as list_ports
-from kx_lib.kx_exception import ProtocolException, ProtocolTimeoutException, EvaluationKitException
+from kx_lib.kx_exception import ProtocolException, ProtocolTimeoutException, ProtocolBus2Exception, EvaluationKitException
+from kx_lib.kx_protocol import KxFrameBuffer
+from kx_lib.kx_discovery_cache import hw_key
 from kx_lib import kx_logger
 LOGGER = kx_logger.get_logger(__name__)
 
@@ -15,15 +18,120 @@ LOGGER = kx_logger.get_logger(__name__)
 # LOGGER.setLevel(kx_logger.ERROR)
 # LOGGER.setLevel(kx_logger.DEBUG)
 
-try:
-    import pygatt
-except ImportError:
-    pygatt = None
+
+def _import_pygatt():
+    "pygatt is imported only when BLE_PYGATT connection is opened"
+    try:
+        import pygatt
+    except ImportError:
+        pygatt = None
+    return pygatt
+
+# max amount of received messages stored by KxReaderThread before oldest ones are dropped
+RX_QUEUE_SIZE = 10000
+
+
+class KxReaderThread(threading.Thread):
+    """Background thread which drains pyserial connection to a bounded queue of received messages.
+
+    Received bytes are split to protocol messages right away so that data is read from the OS
+    buffer also when the application is busy processing earlier messages. When the queue is full
+    the oldest message is dropped.
+
+    Attributes:
+        received_frames (int): Amount of messages received.
+        dropped_frames (int): Amount of messages dropped due to full queue.
+        high_water_mark (int): Max amount of messages in queue at the same time.
+    """
+
+    def __init__(self, conn, max_frames=RX_QUEUE_SIZE):
+        threading.Thread.__init__(self, name='KxReaderThread')
+        self.daemon = True
+        self._conn = conn  # pyserial connection instance
+        self._frame_buffer = KxFrameBuffer()
+        self._frames = deque()
+        self._max_frames = max_frames
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self.error = None
+        self.received_frames = 0
+        self.dropped_frames = 0
+        self.high_water_mark = 0
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                data = self._conn.read(max(self._conn.in_waiting, 1))
+            except (serial.SerialException, OSError, ValueError) as exception:
+                if not self._stop_event.is_set():
+                    LOGGER.error('Reader thread stopped: %s' % exception)
+                    self.error = exception
+                break
+
+            if not data:
+                continue
+
+            self._frame_buffer.feed(data)
+            frames = self._frame_buffer.pop_frames()
+            if not frames:
+                continue
+
+            with self._condition:
+                for frame in frames:
+                    if len(self._frames) >= self._max_frames:
+                        self._frames.popleft()
+                        self.dropped_frames += 1
+                    self._frames.append(frame)
+                self.received_frames += len(frames)
+                self.high_water_mark = max(self.high_water_mark, len(self._frames))
+                self._condition.notify()
+
+        with self._condition:
+            self._condition.notify_all()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def clear(self):
+        """Discard all received messages and partially received data."""
+        with self._condition:
+            self._frames.clear()
+            self._frame_buffer.clear()
+
+    def get_frame(self, timeout):
+        """Returns next received message.
+
+        Args:
+            timeout (float): Max time to wait in seconds.
+
+        Raises:
+            ProtocolTimeoutException: No message received during timeout.
+            ProtocolBus2Exception: Reader thread is stopped due to connection error.
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while not self._frames:
+                if self.error is not None:
+                    raise ProtocolBus2Exception('Connection lost: %s' % self.error)
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.is_alive():
+                    raise ProtocolTimeoutException('No data received.')
+                self._condition.wait(remaining)
+
+            return self._frames.popleft()
+
+    def statistics(self):
+        return {
+            'received_frames': self.received_frames,
+            'dropped_frames': self.dropped_frames,
+            'high_water_mark': self.high_water_mark,
+            'queued_frames': len(self._frames)}
 
 
 class KxConnection(object):
     "Base class of all kionix communication protocol (bus2)"
     bus2_configuration = None  # bus configuration blob
+    reader = None  # KxReaderThread instance when threaded receive is used
 
     def flush(self):
         """Discard any data from input buffers."""
@@ -43,6 +151,19 @@ class KxConnection(object):
         """
         raise NotImplementedError()
 
+    def read_available(self, length=1):
+        """Read all data which is already received, but at least length bytes.
+
+        Connections which can not tell how much data is waiting read just length bytes.
+
+        Args:
+            length (int): Minimum amount of bytes to read.
+
+        Raises:
+            ProtocolTimeoutException: The read timed out.
+        """
+        return self.read(length)
+
     def write(self, data):
         """Write data.
 
@@ -74,11 +195,52 @@ class KxPySerial(KxConnection):
 
         return data
 
+    def read_available(self, length=1):
+        """Read all data waiting in the pyserial input buffer with one read call."""
+        return self.read(max(self._conn.in_waiting, length))
+
+    def read_frame(self):
+        """Read next message received by the reader thread."""
+        return self.reader.get_frame(self._read_timeout)
+
+    def start_reader(self, max_frames=RX_QUEUE_SIZE, poll_timeout=0.1):
+        """Start threaded receive mode.
+
+        After this all data is read by KxReaderThread and received messages are
+        consumed with read_frame().
+
+        Args:
+            max_frames (int): Max amount of messages in receive queue.
+            poll_timeout (float): Read timeout used by the reader thread. Defines
+                how fast the thread notices stop_reader().
+        """
+        if self.reader is not None:
+            return
+
+        self._read_timeout = self._conn.timeout
+        self._conn.timeout = poll_timeout
+        self.reader = KxReaderThread(self._conn, max_frames)
+        self.reader.start()
+        LOGGER.debug('Reader thread started.')
+
+    def stop_reader(self):
+        """Stop threaded receive mode. Messages still in receive queue are discarded."""
+        if self.reader is None:
+            return
+
+        self.reader.stop()
+        self.reader.join()
+        LOGGER.debug('Reader thread stopped. %s' % self.reader.statistics())
+        self.reader = None
+        self._conn.timeout = self._read_timeout
+
     def flush(self):
         """Flush data from the pyserial connection."""
         # Flush incoming data
         if self._conn.in_waiting:
             self._conn.reset_input_buffer()
+        if self.reader is not None:
+            self.reader.clear()
 
     def write(self, data):
         """Write data to the pyserial connection."""
@@ -87,6 +249,7 @@ class KxPySerial(KxConnection):
 
     def close(self):
         """Close the pyserial connection."""
+        self.stop_reader()
         self._conn.close()
 
 
@@ -171,58 +334,90 @@ class KxLinuxI2C(KxConnection):
 
 
 class KxLinuxBLE(KxConnection):
+    """BLE connection with pygatt.
+
+    Notifications are received in pygatt thread and collected to a receive buffer.
+    Reads wake up as soon as enough data is received.
+
+    Attributes:
+        timeout (float): Read timeout in seconds.
+        rx_buffer (bytearray): Received bytes not yet read.
+    """
 
     def __init__(self, bus2_configuration):
-        assert pygatt, 'Pygatt not installed.'
+        self._pygatt = _import_pygatt()
+        assert self._pygatt, 'Pygatt not installed.'
 
         # Many devices, e.g. Fitbit, use random addressing - this is required to
         # connect.
-        self.ADDRESS_TYPE = pygatt.BLEAddressType.random
+        self.ADDRESS_TYPE = self._pygatt.BLEAddressType.random
         self.NUS_TX_CHARACTERISTIC = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"
         self.NUS_RX_CHARACTERISTIC = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
 
-        self.rx_buffer = []
+        self.rx_buffer = bytearray()
+        self._rx_condition = threading.Condition()  # notified when data is added to rx_buffer
         timeout = 1
         self.timeout = timeout
         self.device = None
 
     def initialize(self, mac_address):
         LOGGER.info('Establishing BLE connection to %s.' % mac_address)
-        adapter = pygatt.GATTToolBackend()
+        adapter = self._pygatt.GATTToolBackend()
         adapter.start()
         self.device = adapter.connect(mac_address, address_type=self.ADDRESS_TYPE)
         self.device.subscribe(self.NUS_RX_CHARACTERISTIC, self.callback, False)
         LOGGER.info('BLE connection established.')
 
-    def read(self, lenght=1):
-        data = ''
+    def _take(self, length, available):
+        """Wait until length bytes are received and remove them from receive buffer.
 
-        for _ in range(100):
-            if len(self.rx_buffer) >= lenght:
-                break
-            time.sleep(self.timeout / 100.)
+        Args:
+            length (int): Minimum amount of bytes to return.
+            available (bool): Return all received bytes instead of just length bytes.
 
-        if not len(self.rx_buffer) >= lenght:
-            raise ProtocolTimeoutException('No data received.')
+        Raises:
+            ProtocolTimeoutException: The read timed out.
 
-        for _ in range(lenght):
-            data += chr(self.rx_buffer.pop(0))
+        Returns:
+            bytearray: Received bytes.
+        """
+        deadline = time.time() + self.timeout
+        with self._rx_condition:
+            while len(self.rx_buffer) < length:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ProtocolTimeoutException('No data received.')
+                self._rx_condition.wait(remaining)
+
+            if available:
+                length = len(self.rx_buffer)
+            data = self.rx_buffer[:length]
+            del self.rx_buffer[:length]
         return data
 
+    def read(self, length=1):
+        return self._take(length, available=False)
+
+    def read_available(self, length=1):
+        return self._take(length, available=True)
+
     def write(self, data):
         LOGGER.debug(data)
         self.device.char_write(self.NUS_TX_CHARACTERISTIC, bytearray(data), True)
 
     def flush(self):
-        self.rx_buffer = []
+        with self._rx_condition:
+            del self.rx_buffer[:]
 
     def close(self):
         self.flush()
         self.device.disconnect()
 
     def callback(self, handle, value):
-        for i in value:
-            self.rx_buffer.append(i)
+        "pygatt notification handler"
+        with self._rx_condition:
+            self.rx_buffer.extend(value)
+            self._rx_condition.notify_all()
 
 
 class KxComPort(KxPySerial):
@@ -243,6 +438,8 @@ class KxComPort(KxPySerial):
         else:
             raise EvaluationKitException('No hardware IDs found in board config')
 
+        self.hw_keys = {}  # port name -> USB vid:pid:serial_number, filled by get_com_port()
+
     def initialize(self, comport, timeout=2):
         """Initialize the serial connection.
 
@@ -278,6 +475,7 @@ class KxComPort(KxPySerial):
         Returns:
             str: The name of the detected serial device (e.g. 'COM2').
         """
+        from serial.tools import list_ports
         matching_ports = []
         LOGGER.debug('Listing serial ports.')
         for port in list_ports.comports():
@@ -289,8 +487,26 @@ class KxComPort(KxPySerial):
             # matcing port found based in vid and pid?
             if (port.vid, port.pid) in self._valid_vid_pid_pairs:
                 matching_ports.append(port.device)
+                self.hw_keys[port.device] = hw_key(port.vid, port.pid, port.serial_number)
 
         if not matching_ports:
             raise EvaluationKitException('Automatic search found no devices')
 
         return matching_ports
+
+    def get_hw_key(self, comport):
+        """USB identifier of the serial device used as discovery cache key.
+
+        Args:
+            comport (str): Name of the serial device.
+
+        Returns:
+            str: vid:pid:serial_number or None if the device is not an USB device.
+        """
+        if comport not in self.hw_keys:
+            from serial.tools import list_ports
+            for port in list_ports.comports():
+                if port.device == comport:
+                    self.hw_keys[comport] = hw_key(port.vid, port.pid, port.serial_number)
+                    break
+        return self.hw_keys.get(comport)
@@ -0,0 +1,303 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Raw bus2 capture and replay.
+
+KxCaptureConnection records all bytes read from and written to a bus2 connection
+with host timestamps. KxReplayConnection plays the received bytes of a capture back
+so that KxAdapterEvk and StreamConfig.read_data_stream() process them as if the
+board was connected. Replay runs in real time or as fast as the host reads.
+
+File format:
+    magic (8 bytes) + version (uint16 little endian)
+    followed by records: kind (uint8), host time (float64 seconds since epoch),
+    data length (uint16), data.
+
+    Kind is CAPTURE_RX, CAPTURE_TX or CAPTURE_SESSION. Session record starts each
+    connection and its data is json metadata. Sessions are appended to existing file.
+"""
+import json
+import os
+import struct
+import time
+from array import array
+from kx_lib.kx_bus2 import KxConnection
+from kx_lib.kx_configuration_enum import BUS2_REPLAY
+from kx_lib.kx_exception import EvaluationKitException, ProtocolTimeoutException
+from kx_lib import kx_logger
+LOGGER = kx_logger.get_logger(__name__)
+
+# LOGGER.setLevel(kx_logger.DEBUG)
+
+CAPTURE_MAGIC = b'KXBUS2CP'
+CAPTURE_VERSION = 1
+FILE_HEADER = struct.Struct('<8sH')  # magic, version
+RECORD_HEADER = struct.Struct('<BdH')  # kind, host time, data length
+CAPTURE_RX, CAPTURE_TX, CAPTURE_SESSION = range(3)
+MAX_RECORD_DATA = 0xffff
+FILE_BUFFER_SIZE = 64 * 1024
+
+
+def _check_file_header(infile, file_name):
+    header = infile.read(FILE_HEADER.size)
+    if len(header) != FILE_HEADER.size:
+        raise EvaluationKitException('%s is not a bus2 capture file' % file_name)
+    magic, version = FILE_HEADER.unpack(header)
+    if magic != CAPTURE_MAGIC:
+        raise EvaluationKitException('%s is not a bus2 capture file' % file_name)
+    if version != CAPTURE_VERSION:
+        raise EvaluationKitException('Unsupported bus2 capture version %d in %s' % (version, file_name))
+
+
+def _to_bytes(data):
+    "Received data as bytes. BLE_PYGATT on python 3 returns str."
+    if not isinstance(data, (bytes, bytearray, array)):
+        data = bytearray(ord(_char) for _char in data)
+    return bytes(bytearray(data))
+
+
+class CaptureWriter(object):
+    """Appends records of one session to capture file.
+
+    Args:
+        file_name(string): capture file name. New file is created if it does not exist.
+        metadata(dict): stored in the session record
+    """
+
+    def __init__(self, file_name, metadata=None):
+        self.file_name = os.path.expanduser(file_name)
+        new_file = not os.path.isfile(self.file_name) or os.path.getsize(self.file_name) == 0
+        if not new_file:
+            with open(self.file_name, 'rb') as infile:
+                _check_file_header(infile, self.file_name)
+
+        self._file = open(self.file_name, 'ab', FILE_BUFFER_SIZE)
+        if new_file:
+            self._file.write(FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+        self._session_start = self._file.tell()
+
+        session = dict(metadata or {})
+        session['start_time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.write(CAPTURE_SESSION, json.dumps(session, sort_keys=True).encode('utf-8'))
+        LOGGER.debug('Capturing bus2 to %s' % self.file_name)
+
+    def write(self, kind, data, timestamp=None):
+        """Append record.
+
+        Args:
+            kind(int): CAPTURE_RX, CAPTURE_TX or CAPTURE_SESSION
+            data(bytes/bytearray/array.array/str): record data. Empty data is not recorded.
+            timestamp(float): host time. Defaults to current time.
+        """
+        if self._file is None or (not data and kind != CAPTURE_SESSION):
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        data = _to_bytes(data)
+        for offset in range(0, max(len(data), 1), MAX_RECORD_DATA):
+            chunk = data[offset:offset + MAX_RECORD_DATA]
+            self._file.write(RECORD_HEADER.pack(kind, timestamp, len(chunk)))
+            self._file.write(chunk)
+
+    def discard(self):
+        "Remove records of this session from the file and close it"
+        if self._file is None:
+            return
+        self._file.flush()
+        self._file.truncate(self._session_start)
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CaptureReader(object):
+    """Iterates records of capture file as (kind, host time, data).
+
+    Args:
+        file_name(string): capture file name
+    """
+
+    def __init__(self, file_name):
+        self.file_name = os.path.expanduser(file_name)
+        self._file = open(self.file_name, 'rb', FILE_BUFFER_SIZE)
+        _check_file_header(self._file, self.file_name)
+
+    def __iter__(self):
+        while True:
+            header = self._file.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) == RECORD_HEADER.size:
+                kind, timestamp, length = RECORD_HEADER.unpack(header)
+                data = self._file.read(length)
+                if len(data) == length:
+                    yield kind, timestamp, data
+                    continue
+            # capture was not closed properly
+            LOGGER.warning('Truncated record at the end of %s' % self.file_name)
+            return
+
+    def sessions(self):
+        "Metadata of all sessions in the file"
+        return [json.loads(data.decode('utf-8')) for kind, _, data in self if kind == CAPTURE_SESSION]
+
+    def close(self):
+        self._file.close()
+
+
+class KxCaptureConnection(KxConnection):
+    """Records bytes passing through bus2 connection.
+
+    Attributes which are not defined here are read from the wrapped connection.
+
+    Args:
+        connection(KxConnection): opened bus2 connection
+        file_name(string): capture file name
+        metadata(dict): stored in the session record
+    """
+
+    def __init__(self, connection, file_name, metadata=None):
+        self.connection = connection
+        self.bus2_configuration = connection.bus2_configuration
+        self.writer = CaptureWriter(file_name, metadata)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    @property
+    def reader(self):
+        return self.connection.reader
+
+    def read(self, length=1):
+        data = self.connection.read(length)
+        self.writer.write(CAPTURE_RX, data)
+        return data
+
+    def read_available(self, length=1):
+        data = self.connection.read_available(length)
+        self.writer.write(CAPTURE_RX, data)
+        return data
+
+    def read_frame(self):
+        "Read message received by reader thread. Host time is when the message was taken from the queue."
+        data = self.connection.read_frame()
+        self.writer.write(CAPTURE_RX, data)
+        return data
+
+    def write(self, data):
+        self.writer.write(CAPTURE_TX, data)
+        self.connection.write(data)
+
+    def flush(self):
+        self.connection.flush()
+
+    def discard(self):
+        "Drop the capture of this connection, e.g. when other than expected board was found"
+        self.writer.discard()
+
+    def close(self):
+        self.connection.close()
+        self.writer.close()
+
+
+class KxReplayConnection(KxConnection):
+    """Plays back received bytes of one capture session.
+
+    Received bytes which were captured after a request are given only after the host
+    has written a request, so responses do not arrive earlier than from the board.
+    Content of written requests is not checked. ProtocolTimeoutException is raised when
+    the host reads data which the board sent only after a request not yet written, and
+    when the capture has no more data.
+
+    Args:
+        file_name(string): capture file name
+        speed(float): 1.0 is real time, 2.0 double speed etc. 0 replays as fast as data is read.
+        session(int): index of capture session to replay
+
+    Attributes:
+        metadata(dict): metadata of the replayed session
+    """
+
+    def __init__(self, file_name, speed=0.0, session=0):
+        self.bus2_configuration = {'connection': BUS2_REPLAY}
+        self.speed = speed
+        self.metadata = None
+        self._session_time = None
+        self._buffer = bytearray()
+        self._writes = 0  # requests written by the host and not yet matched with captured requests
+        self._capture = CaptureReader(file_name)
+        self._records = self._session_records(session)
+        self._pending = next(self._records, None)  # next record not yet replayed
+        if self.metadata is None:
+            self._capture.close()
+            raise EvaluationKitException('Session %d not found from %s' % (session, file_name))
+        self._start = (time.time(), self._session_time)  # host time and capture time matching to each other
+        LOGGER.info('Replaying %s session %d captured %s' % (file_name, session, self.metadata.get('start_time')))
+
+    def _session_records(self, session):
+        index = -1
+        for kind, timestamp, data in self._capture:
+            if kind == CAPTURE_SESSION:
+                index += 1
+                if index > session:
+                    return
+                if index == session:
+                    self.metadata = json.loads(data.decode('utf-8'))
+                    self._session_time = timestamp
+            elif index == session:
+                yield kind, timestamp, data
+
+    def _replay_time(self, timestamp):
+        "Host time when record captured at timestamp is due"
+        host_start, capture_start = self._start
+        return host_start + (timestamp - capture_start) / self.speed
+
+    def _fill(self, length):
+        """Move received records to buffer until it has length bytes. In real time also
+        records already due are moved."""
+        while self._pending is not None:
+            kind, timestamp, data = self._pending
+            if kind == CAPTURE_TX:
+                if not self._writes:
+                    break  # board did not send more before this request
+                self._writes -= 1
+                if self.speed > 0:
+                    # host may be slower than when captured, pace following data from this request
+                    self._start = (max(time.time(), self._replay_time(timestamp)), timestamp)
+
+            elif kind == CAPTURE_RX:
+                if len(self._buffer) >= length and (self.speed <= 0 or time.time() < self._replay_time(timestamp)):
+                    break
+                if self.speed > 0:
+                    delay = self._replay_time(timestamp) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._buffer.extend(data)
+
+            self._pending = next(self._records, None)
+
+    def read(self, length=1):
+        self._fill(length)
+        if len(self._buffer) < length:
+            if self._pending is None:
+                raise ProtocolTimeoutException('End of bus2 capture reached.')
+            raise ProtocolTimeoutException('No data received.')
+        data = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        return data
+
+    def read_available(self, length=1):
+        self._fill(length)
+        return self.read(max(length, len(self._buffer)))
+
+    def write(self, data):
+        self._writes += 1
+
+    def flush(self):
+        pass  # bytes discarded by flush were not recorded
+
+    def close(self):
+        self._capture.close()
@@ -23,7 +23,9 @@ class CfgSchema(dict):
             "BLE_PYGATT",
             "USB_SERIAL",
             "USB_AARDVARK",
-            "BLE"
+            "BLE",
+            "EMULATOR",
+            "REPLAY"
         ]
     }
 
@@ -43,6 +45,77 @@ class CfgSchema(dict):
         "description": "Mac address for bluetooth connection. Full address (or first bytes with windows)"
     }
 
+    discovery_cache = {
+        "type": ["string", "null"],
+        "description": "File where found evaluation boards are cached for faster connection. Empty disables the cache",
+        "default": None
+    }
+
+    emulator_odr = {
+        "type": ["number", "null"],
+        "description": "Interrupt rate of emulated firmware in Hz. 0 = as fast as possible, empty = odr setting",
+        "default": None
+    }
+
+    emulator_corrupt_rate = {
+        "type": "number",
+        "description": "Probability of corrupting one byte of emulated stream indication",
+        "default": 0.0
+    }
+
+    emulator_drop_rate = {
+        "type": "number",
+        "description": "Probability of dropping emulated stream indication",
+        "default": 0.0
+    }
+
+    bus2_capture = {
+        "type": ["string", "null"],
+        "description": "File where raw bus2 traffic is appended. Empty = no capture",
+        "default": None
+    }
+
+    replay_file = {
+        "type": ["string", "null"],
+        "description": "Bus2 capture file played back with bus2=REPLAY",
+        "default": None
+    }
+
+    replay_speed = {
+        "type": "number",
+        "description": "Replay speed. 1.0 = real time, 0 = as fast as possible",
+        "default": 0
+    }
+
+    replay_session = {
+        "type": "integer",
+        "description": "Index of capture session to replay",
+        "default": 0
+    }
+
+    threaded_receive = {
+        "type": "boolean",
+        "description": "Receive data from serial port in background thread",
+        "default": False
+    }
+
+    message_fifo_policy = {
+        "type": "string",
+        "description": "What to do when message FIFO is full",
+        "default": "error",
+        "enum": [
+            "error",
+            "drop_oldest",
+            "spill"
+        ]
+    }
+
+    message_fifo_size = {
+        "type": "integer",
+        "description": "Max amount of unhandled messages stored in memory",
+        "default": 1000
+    }
+
     logging_level = {
         "type": "string",
         "description": "Global debug logging settings",
@@ -62,6 +135,8 @@ class CfgSchema(dict):
         "enum": [
             "ADAPTER_GPIO1_INT",
             "ADAPTER_GPIO2_INT",
+            "MACRO_GPIO1_INT",
+            "MACRO_GPIO2_INT",
             "REG_POLL",
             "TIMER_POLL"
         ]
@@ -80,6 +155,8 @@ class CfgSchema(dict):
         "enum": [
             "ADAPTER_GPIO1_INT",
             "ADAPTER_GPIO2_INT",
+            "MACRO_GPIO1_INT",
+            "MACRO_GPIO2_INT",
             "REG_POLL",
             "TIMER_POLL"
         ]
@@ -121,10 +198,54 @@ class CfgSchema(dict):
 
     filename = {
         "type": ["string", "null"],
-        "description": "File name with or without extension. If no extension is given .csv is used",
+        "description": "File name with or without extension. If no extension is given .csv or .bin is used",
         "default": None,
     }
 
+    register_shadow = {
+        "type": "boolean",
+        "description": "Cache sensor configuration registers to avoid reads in read-modify-write operations",
+        "default": False
+    }
+
+    log_format = {
+        "type": "string",
+        "description": "Log file format",
+        "default": "csv",
+        "enum": [
+            "csv",
+            "binary"
+        ]
+    }
+
+    stream_timestamp = {
+        "type": "string",
+        "description": "Time of stream samples: host time, firmware timestamp or both",
+        "default": "host",
+        "enum": [
+            "host",
+            "device",
+            "device_host"
+        ]
+    }
+
+    stream_packet_count = {
+        "type": "integer",
+        "description": "Packet counter bits added to stream indications, 0 disables",
+        "default": 0,
+        "enum": [
+            0,
+            8,
+            16
+        ]
+    }
+
+    stream_gap_rows = {
+        "type": "boolean",
+        "description": "Write comment row to log where stream packets were lost",
+        "default": False
+    }
+
     def __init__(self, required=None):
         if required is None:
             required = []
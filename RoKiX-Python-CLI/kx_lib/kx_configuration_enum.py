@@ -51,12 +51,21 @@ BUS2_SOCKET = 'SOCKET'
 BUS2_USB_SERIAL = 'USB_SERIAL'
 BUS2_USB_AARDVARK = 'USB_AARDVARK'
 BLE_PYGATT = 'BLE_PYGATT'
+BUS2_EMULATOR = 'EMULATOR'  # in-process firmware emulation, see kx_emulator.py
+BUS2_REPLAY = 'REPLAY'  # playback of bus2 capture, see kx_capture.py
 
 ADAPTER_GPIO1_INT = 'ADAPTER_GPIO1_INT'
 ADAPTER_GPIO2_INT = 'ADAPTER_GPIO2_INT'
+MACRO_GPIO1_INT = 'MACRO_GPIO1_INT'
+MACRO_GPIO2_INT = 'MACRO_GPIO2_INT'
 TIMER_POLL = 'TIMER_POLL'
 REG_POLL = 'REG_POLL'
 
+# stream_timestamp setting: time of logged stream samples
+STREAM_TIMESTAMP_HOST = 'host'  # host time when the sample is processed
+STREAM_TIMESTAMP_DEVICE = 'device'  # firmware timestamp taken when macro triggers
+STREAM_TIMESTAMP_DEVICE_HOST = 'device_host'  # firmware timestamp followed by host time
+
 CFG_SAD = 'SAD'
 CFG_CS = 'cs'
 CFG_NAME = 'name'
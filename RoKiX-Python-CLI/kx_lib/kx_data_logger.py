@@ -1,18 +1,18 @@
 # 
 # Copyright 2020 Rohm Semiconductor
 #
-import os
-import time
 import struct
 import types
 from array import array
-import traceback
 from six import string_types
 
 
 from kx_lib.kx_configuration_enum import TIMER_POLL, REG_POLL
 from kx_lib.kx_util import get_datalogger_config, evkit_config, get_timer, get_log_file_name
 from kx_lib.kx_board import ConnectionManager
+from kx_lib.kx_exception import EvaluationKitException
+from kx_lib.kx_log_writer import DELIMITER, NEW_LINE, LOG_FORMAT_CSV, LOG_WRITERS, LOG_FILE_EXTENSIONS, \
+    start_time_str, end_time_str, timenow_str, timestamp_header, timestamp_format  # pylint: disable=unused-import
 from kx_lib import kx_logger
 LOGGER = kx_logger.get_logger(__name__)
 # LOGGER.setLevel(kx_logger.DEBUG)
@@ -20,11 +20,12 @@ LOGGER = kx_logger.get_logger(__name__)
 
 class DataloggerBase(object):
 
-    def __init__(self, sensors=None, kwargs_parser=get_datalogger_config):
+    def __init__(self, sensors=None, kwargs_parser=get_datalogger_config, connection_manager=None):
         """
             sensors : list of sensor objects to be initialized. (Not instances!)
             odr : total ODR of all sensor (ODR is needed here to determine board power saving mode)
             args : global parameters
+            connection_manager : already opened ConnectionManager. If None then new connection is opened.
         """
 
         # override .cfg parameters in application if needed
@@ -37,9 +38,11 @@ class DataloggerBase(object):
         self.sensors = []
         self.sensor = None
 
-        # ODR is needed here to determine board power saving mode
-        self.connection_manager = ConnectionManager(
-            odr=evkit_config.odr)
+        if connection_manager is None:
+            # ODR is needed here to determine board power saving mode
+            connection_manager = ConnectionManager(
+                odr=evkit_config.odr)
+        self.connection_manager = connection_manager
         self.stream = None
 
         # add sensors if sensor list given
@@ -58,6 +61,8 @@ class DataloggerBase(object):
     def add_sensor(self, sensor):
         self.sensors.append(sensor)
         self.connection_manager.add_sensor(sensor)
+        if evkit_config.get('register_shadow', False):
+            sensor.enable_register_shadow()
 
     def enable_data_logging(self, **kwargs):
         raise NotImplementedError()
@@ -107,6 +112,7 @@ class DataloggerBase(object):
             pass
 
         finally:
+            sensor.stop_macro_poll()
             dl.stop()
 
     def read_with_stream(self, stream_class, pin_index=None, reader_arguments={}):
@@ -192,6 +198,7 @@ class SingleChannelEventReader(SingleChannelReader):
             pass
 
         finally:
+            sensor.stop_macro_poll()
             dl.stop()
 
     def read_with_stream(self, stream_class, pin_index=None, reader_arguments={}):
@@ -244,80 +251,159 @@ class MultiChannelReader(SingleChannelReader):
 
 TIMING = get_timer()
 
-DELIMITER = ';\t'
-NEW_LINE = '\n'
-
-
-def timenow_str():
-    return time.strftime('%Y-%m-%d %H:%M:%S:000')
-
-
-def start_time_str():
-    caller = 'NA'
-    try:
-        caller = os.path.split(traceback.extract_stack()[0][0])[1]
-    except BaseException:
-        caller = 'Error'
-    return '# Log File Format Version = 1.0\n# Stream Configuration File = {}\n# Start time = {}'.format(caller, timenow_str())
-
-
-def end_time_str():
-    return '# End time = ' + timenow_str()
-
 
 class SensorDataLogger(object):
     def __init__(self,
                  console=True,
                  log_file_name=None,
-                 additional_info=None):
+                 additional_info=None,
+                 log_format=None,
+                 host_timestamp=False):
+        """Writes sensor data to console and log file.
+
+        Args:
+            console(bool): print values to console
+            log_file_name(string/function/None): log file name or function which generates it.
+                If None then name is generated from rokix_settings.cfg.
+            additional_info(dict): metadata written to the log, e.g. board_id, firmware_id, odr.
+            log_format(string): LOG_FORMAT_CSV or LOG_FORMAT_BINARY. If None then log_format setting is used.
+            host_timestamp(bool): log host time in addition to device timestamps given to feed_values()
+        """
         self.console = console
-        assert additional_info is None, 'Not implemented'
         self.count = 0
         self.channels = []
-        self.file_handle = None
+        self.writer = None
+        self.host_timestamp = host_timestamp
+        self._time_fmt = timestamp_format(host_timestamp)
+
+        if log_format is None:
+            log_format = evkit_config.get('log_format', LOG_FORMAT_CSV)
+        if log_format not in LOG_WRITERS:
+            raise EvaluationKitException('Unknown log format %s' % log_format)
+
         # create file object form string or function which generates file name
         if log_file_name is None:
-            log_file_name = get_log_file_name()
-        if isinstance(log_file_name, string_types):
-            self.file_handle = open(log_file_name, 'w')
+            log_file_name = get_log_file_name(LOG_FILE_EXTENSIONS[log_format])
 
         # log_file_name is types.FunctionType if providing function which generates file name
         elif isinstance(log_file_name, types.FunctionType):
-            self.file_handle = open(log_file_name(), 'w')
+            log_file_name = log_file_name()
+
+        if isinstance(log_file_name, string_types):
+            self.writer = LOG_WRITERS[log_format](log_file_name, additional_info, host_timestamp)
+
+    @property
+    def needs_raw(self):
+        "True if log writer stores raw indication payloads"
+        return self.writer is not None and not self.writer.text_format
 
     def start(self):
         TIMING.reset()
-        start_msg = start_time_str()
-        for channel in self.channels:
-            labels = channel[0]
-            start_msg += NEW_LINE + '# timestamp%s%s' % (DELIMITER, labels.replace('!', DELIMITER))
         if self.console is True:
+            start_msg = start_time_str()
+            for channel in self.channels:
+                labels = channel[0]
+                start_msg += NEW_LINE + '%s%s%s' % (timestamp_header(self.host_timestamp), DELIMITER, labels.replace('!', DELIMITER))
             print(start_msg)
-        if self.file_handle is not None:
-            self.file_handle.write(start_msg + NEW_LINE)
+        if self.writer is not None:
+            self.writer.start(self.channels)
 
     def stop(self):
         if self.console is True:
             print(end_time_str())
 
-        if self.file_handle is not None:
-            self.file_handle.write(end_time_str())
-            self.file_handle.close()
+        if self.writer is not None:
+            self.writer.stop()
 
     def add_channel(self,
                     channel_dimension_labels,
                     channel_number=10,
-                    channel_formatter=None):
-
+                    channel_formatter=None,
+                    fmt=None,
+                    axis_map=None):
+        """Add channel definition.
+
+        Args:
+            channel_dimension_labels(string): channel names separated with ! mark
+            channel_number(int): channel number, first value of the channel data
+            channel_formatter: not used
+            fmt(string): struct format of raw payloads given to feed_values()
+            axis_map(list): axis map which is not yet applied to raw payloads
+        """
         self.channels.append((channel_dimension_labels,
                               channel_number,
-                              channel_formatter))
+                              channel_formatter,
+                              fmt,
+                              axis_map))
 
-    def feed_values(self, data):
+    def feed_values(self, data, raw=None, timestamp=None):
+        """Log one sample.
+
+        Args:
+            data(tuple): decoded values, first value is channel number
+            raw(array): raw indication payload if available
+            timestamp(float): device timestamp in seconds. If None then host time is used.
+        """
         self.count += 1
         now = TIMING.time_elapsed()
-        data = '{:.6f}{}'.format(now, DELIMITER) + DELIMITER.join('{:d}'.format(t) for t in data)
+        if timestamp is None:
+            timestamp = now
+        if self.console is True or (self.writer is not None and self.writer.text_format):
+            line = self._time_fmt.format(timestamp, now) + DELIMITER.join('{:d}'.format(t) for t in data)
+            if self.console is True:
+                print(line)
+            if self.writer is not None and self.writer.text_format:
+                self.writer.write_line(line)
+                return
+        if self.writer is not None:
+            self.writer.write_values(timestamp, data, raw, now)
+
+    def feed_comment(self, text):
+        """Write comment line to console and CSV log. Binary logs do not have comments.
+
+        Args:
+            text(string): comment without # mark
+        """
+        line = '# ' + text
         if self.console is True:
-            print(data)
-        if self.file_handle is not None:
-            self.file_handle.write(data + NEW_LINE)
+            print(line)
+        if self.writer is not None and self.writer.text_format:
+            self.writer.write_line(line)
+
+    def feed_gap(self, channel, lost):
+        """Write sentinel row for samples lost before the next sample of the channel.
+        Row is a comment so that readers of CSV logs skip it.
+
+        Args:
+            channel(int): channel number
+            lost(int): amount of lost samples
+        """
+        self.feed_comment('gap' + DELIMITER + '{:.6f}'.format(TIMING.time_elapsed()) + DELIMITER +
+                          '{:d}'.format(channel) + DELIMITER + 'lost = {:d}'.format(lost))
+
+    def feed_batch(self, values, timestamps, raw=None, host_timestamps=None):
+        """Log batch of samples.
+
+        Args:
+            values(numpy.ndarray): samples as (N, channels) array
+            timestamps(numpy.ndarray): N timestamps of samples
+            raw(list): N raw payloads if available
+            host_timestamps(numpy.ndarray): N host timestamps. Needed if host_timestamp is enabled.
+        """
+        if not len(values):
+            return
+        self.count += len(values)
+        time_columns = [timestamps.tolist()]
+        if self.host_timestamp:
+            time_columns.append(host_timestamps.tolist())
+        if self.console is True or (self.writer is not None and self.writer.text_format):
+            value_fmt = '%d' if values.dtype.kind in 'biu' else '%g'
+            row_fmt = DELIMITER.join(['%.6f'] * len(time_columns) + [value_fmt] * values.shape[1])
+            lines = NEW_LINE.join(row_fmt % row for row in zip(*(time_columns + values.T.tolist())))
+            if self.console is True:
+                print(lines)
+            if self.writer is not None and self.writer.text_format:
+                self.writer.write_line(lines)
+                return
+        if self.writer is not None:
+            self.writer.write_batch(time_columns[0], values.tolist(), raw, time_columns[-1])
@@ -2,15 +2,17 @@
 # Copyright 2020 Rohm Semiconductor
 #
 import struct
-from kx_lib.kx_util import DelayedKeyboardInterrupt
+from kx_lib.kx_util import DelayedKeyboardInterrupt, evkit_config, get_timer
 from kx_lib.kx_sensor_base import AxisMapper
 from kx_lib.kx_exception import ProtocolBus1Exception, EvaluationKitException, ProtocolTimeoutException
 from kx_lib import kx_logger
 from kx_lib.kx_configuration_enum import BUS1_I2C, BUS1_SPI, BUS1_ADC, BUS1_ADC_SAR, BUS1_ADC_DELTA_SIGMA, BUS1_GPIO, \
     CFG_SAD, CFG_CS, CFG_TARGET, CFG_ADC_RESOLUTION, CFG_SPI_PROTOCOL, \
     CFG_POLARITY, EVKIT_GPIO_PIN_SENSE_HIGH, EVKIT_GPIO_PIN_SENSE_LOW, \
-    CFG_PULLUP, EVKIT_GPIO_PIN_NOPULL, EVKIT_GPIO_PIN_PULLDOWN, EVKIT_GPIO_PIN_PULLUP, CFG_AXIS_MAP
-from kx_lib.kx_data_logger import SensorDataLogger
+    CFG_PULLUP, EVKIT_GPIO_PIN_NOPULL, EVKIT_GPIO_PIN_PULLDOWN, EVKIT_GPIO_PIN_PULLUP, CFG_AXIS_MAP, \
+    MAX_PACKET_SIZE, STREAM_TIMESTAMP_HOST, STREAM_TIMESTAMP_DEVICE_HOST
+from kx_lib.kx_data_logger import SensorDataLogger, TIMING
+from kx_lib.kx_log_writer import struct_format_to_dtype
 LOGGER = kx_logger.get_logger(__name__)
 
 # LOGGER.setLevel(kx_logger.DEBUG)
@@ -24,6 +26,118 @@ class ExtraData(object):
     fmt_packet_count_8 = 'B'
 
 
+# struct formats of little endian firmware counters by length in bytes
+COUNTER_FORMATS = {1: '<B', 2: '<H', 4: '<I'}
+
+
+class DeviceClock(object):
+    """Converts firmware timestamps of stream indications to seconds from the first timestamp.
+
+    Timestamp counter rolls over. Counter value which is more than half of the counter
+    range smaller than the previous one is taken as rollover. Slightly older timestamp,
+    e.g. from other macro, is converted without changing the rollover state.
+
+    Args:
+        tick(float): seconds per counter unit
+        length(int): counter bytes
+
+    Attributes:
+        rollovers(int): rollovers found
+    """
+
+    def __init__(self, tick, length=4):
+        self.tick = tick
+        self.modulo = 1 << (8 * length)
+        self.rollovers = 0
+        self._struct = struct.Struct(COUNTER_FORMATS[length])
+        self._start = None  # first counter value
+        self._last = None  # latest counter value
+        self._base = 0  # counter units of earlier rollovers
+
+    def seconds(self, resp, offset):
+        """Device time of an indication.
+
+        Args:
+            resp(array): indication payload
+            offset(int): offset of the timestamp in payload
+
+        Returns:
+            float: seconds from the first timestamp
+        """
+        counter = self._struct.unpack_from(resp, offset)[0]
+        if self._last is None:
+            self._start = counter
+        elif self._last - counter > self.modulo >> 1:
+            self._base += self.modulo
+            self.rollovers += 1
+        elif counter - self._last > self.modulo >> 1:
+            # taken before the latest rollover
+            return (counter + self._base - self.modulo - self._start) * self.tick
+        self._last = counter
+        return (counter + self._base - self._start) * self.tick
+
+
+class PacketCounter(object):
+    """Detects lost indications of one stream macro from firmware packet counter.
+
+    Firmware increments the counter of the macro for each indication and the counter
+    wraps around. First received value is the reference, so indications lost before it
+    are not detected. Loss of a full counter range or more at once is not detected either.
+    Indication repeating the previous counter value is counted as duplicate, not as loss.
+
+    Args:
+        length(int): counter bytes
+
+    Attributes:
+        received(int): indications received
+        lost(int): indications lost
+        gaps(int): places where indications were lost
+        wraps(int): counter wraparounds
+        duplicates(int): indications with the same counter value as the previous one
+    """
+
+    def __init__(self, length):
+        self.modulo = 1 << (8 * length)
+        self.received = 0
+        self.lost = 0
+        self.gaps = 0
+        self.wraps = 0
+        self.duplicates = 0
+        self._struct = struct.Struct(COUNTER_FORMATS[length])
+        self._last = None  # latest counter value
+
+    def update(self, resp, offset):
+        """Check counter of received indication.
+
+        Args:
+            resp(array): indication payload
+            offset(int): offset of the counter in payload
+
+        Returns:
+            int: indications lost before this one
+        """
+        counter = self._struct.unpack_from(resp, offset)[0]
+        lost = 0
+        if counter == self._last:
+            self.duplicates += 1
+        elif self._last is not None:
+            lost = (counter - self._last - 1) % self.modulo
+            if counter <= self._last:
+                self.wraps += 1
+            if lost:
+                self.lost += lost
+                self.gaps += 1
+        self._last = counter
+        self.received += 1
+        return lost
+
+    @property
+    def loss_ratio(self):
+        "Lost indications per sent indications"
+        sent = self.received + self.lost
+        return float(self.lost) / sent if sent else 0.0
+
+
 class RequestMessageDefinition(object):
     def __init__(self, sensor, fmt, hdr, reg=None, pin_index=None, timer=None):
         """Container for data needed for creating macro request message and parsing indication messages
@@ -55,21 +169,128 @@ class RequestMessageDefinition(object):
             if timer is not None and reg is not None:
                 raise EvaluationKitException('timer cannot ber used together with gpio interrupt')
 
-        self.msg_fmt = fmt
-        self.msg_hdr = hdr
+        self.init_payload(fmt, hdr)
         self.sensor = sensor
+        self.target = sensor.resource.get(CFG_TARGET)  # bus1 target of appended actions
         self.reg = reg
-        self.msg_size = struct.calcsize(self.msg_fmt)
         self.msg_req = []  # protocol v1 messages generated by this request
         self.timer = timer
         self.axis_mapper = AxisMapper(channel_header=hdr, axis_map=sensor.resource[CFG_AXIS_MAP])
+        self.compile_decoder()
+
+    def init_payload(self, fmt, hdr):
+        """Set payload layout of indication which has no appended data yet.
+
+        Args:
+            fmt(string): formatter for struct.unpack how to interpret binary data
+            hdr(string): Header row for log, dimensions separated with ! mark.
+        """
+        self.msg_fmt = fmt
+        self.msg_hdr = hdr
+        self.msg_size = struct.calcsize(self.msg_fmt)
+        self.ind_size = self.msg_size  # indication payload size with data appended by StreamConfig
+        self.timestamp_offset = None  # offset of firmware timestamp in indication payload
+        self.packet_count_offset = None  # offset of firmware packet counter in indication payload
+
+    def compile_decoder(self):
+        """Precompile struct and axis mapping of msg_fmt and axis_mapper for decode()."""
+        self.msg_struct = struct.Struct(self.msg_fmt)
+        self.msg_dtype = None  # compiled on first decode_batch()
+        self.map_values = self.axis_mapper.mapping(len(self.msg_struct.unpack_from(bytearray(self.msg_size))))
+
+    def decode(self, resp):
+        """Unpack indication payload and map xyz axis.
+
+        Args:
+            resp(array): indication payload, length must be msg_size.
+
+        Returns:
+            tuple of values
+        """
+        return self.map_values(self.msg_struct.unpack_from(resp))
+
+    def decode_batch(self, buf, count):
+        """Unpack multiple indication payloads and map xyz axis.
+
+        Args:
+            buf(bytearray): count payloads of msg_size bytes
+            count(int): number of payloads in buf
+
+        Returns:
+            numpy.ndarray: (count, channels) array of values
+        """
+        import numpy
+        if self.msg_dtype is None:
+            self.msg_dtype = struct_format_to_dtype(self.msg_fmt)
+            # negation needs signed type which is wide enough also for -(-32768) and unsigned values
+            self.batch_value_dtype = numpy.result_type(numpy.int32, *[self.msg_dtype[name] for name in self.msg_dtype.names])
+
+        records = numpy.frombuffer(buf, dtype=self.msg_dtype, count=count)
+        values = numpy.empty((count, len(self.msg_dtype.names)), dtype=self.batch_value_dtype)
+        for column, name in enumerate(self.msg_dtype.names):
+            values[:, column] = records[name]
+        return self.axis_mapper.map_xyz_axis_batch(values)
 
     def __str__(self):
         return 'RequestMessageDefinition %s' % self.msg_hdr
 
 
+class StreamBatch(object):
+    "Collects raw indication payloads of one data stream for batched decoding"
+
+    def __init__(self, request, size):
+        self.request = request
+        self.size = size
+        self.count = 0
+        self.buffer = bytearray(size * request.msg_size)
+        import numpy
+        self.timestamps = numpy.empty(size)
+        self.host_timestamps = numpy.empty(size)
+
+    def append(self, resp, timestamp, host_timestamp=None):
+        """Store payload. Data appended after msg_size bytes is not stored. Returns True when batch is full."""
+        size = self.request.msg_size
+        offset = self.count * size
+        self.buffer[offset:offset + size] = resp if len(resp) == size else memoryview(resp)[:size]
+        self.timestamps[self.count] = timestamp
+        self.host_timestamps[self.count] = timestamp if host_timestamp is None else host_timestamp
+        self.count += 1
+        return self.count == self.size
+
+    def pop(self, keep_raw=False):
+        """Decode stored payloads and empty the batch.
+
+        Args:
+            keep_raw(bool): return also list of raw payloads
+
+        Returns:
+            tuple: (N, channels) array of values, array of N timestamps, raw payloads or None
+                and array of N host timestamps
+        """
+        values = self.request.decode_batch(self.buffer, self.count)
+        timestamps = self.timestamps[:self.count].copy()
+        host_timestamps = self.host_timestamps[:self.count].copy()
+        payloads = None
+        if keep_raw:
+            size = self.request.msg_size
+            payloads = [self.buffer[ind * size:(ind + 1) * size] for ind in range(self.count)]
+        self.count = 0
+        return values, timestamps, payloads, host_timestamps
+
+
 class StreamConfig(object):
-    def __init__(self, sensor=None, stream_type='continuous'):
+    def __init__(self, sensor=None, stream_type='continuous', timestamp=None, packet_count=None):
+        """Data streams of sensor.
+
+        Args:
+            sensor(SensorDriver): sensor driver instance
+            stream_type(string): not used
+            timestamp(string): STREAM_TIMESTAMP_x. If None then stream_timestamp setting is used.
+            packet_count(int): packet counter bits 0, 8 or 16. If None then stream_packet_count setting is used.
+
+        Attributes:
+            packet_counters(dict): {macro_id:PacketCounter} running loss statistics of streams
+        """
         self.stream_type = stream_type
 
         # if sensor not defined here then must be defined on define_request_message()
@@ -108,8 +329,44 @@ class StreamConfig(object):
             EVKIT_GPIO_PIN_PULLUP: protocol.EVKIT_GPIO_PIN_PULLUP
         }
 
+        self.init_appended_data(timestamp, packet_count)
+
 #    def add_channel(self,[dim_list]):
 
+    def init_appended_data(self, timestamp=None, packet_count=None):
+        """Select data which is appended to indications of all macros when streaming starts.
+
+        Args:
+            timestamp(string): STREAM_TIMESTAMP_x. If None then stream_timestamp setting is used.
+            packet_count(int): packet counter bits 0, 8 or 16. If None then stream_packet_count setting is used.
+        """
+        protocol = self.adapter.protocol
+
+        # firmware timestamp
+        if timestamp is None:
+            timestamp = evkit_config.get('stream_timestamp', STREAM_TIMESTAMP_HOST)
+        self.device_clock = None
+        self.host_timestamp = timestamp == STREAM_TIMESTAMP_DEVICE_HOST
+        if timestamp != STREAM_TIMESTAMP_HOST:
+            if self.adapter.engine.version != 2:
+                raise EvaluationKitException('Device timestamps need firmware protocol version 2.')
+            self.timestamp_scale = protocol.EVKIT_TIME_SCALE_US
+            self.device_clock = DeviceClock(protocol.TIME_SCALE_SECONDS[self.timestamp_scale], protocol.TIMESTAMP_LENGTH)
+
+        # packet counter
+        if packet_count is None:
+            packet_count = evkit_config.get('stream_packet_count', 0)
+        self.packet_count_width = None  # EVKIT_BITWIDTH_x
+        self.packet_counters = {}
+        self.gap_rows = evkit_config.get('stream_gap_rows', False)
+        if packet_count:
+            if self.adapter.engine.version != 2:
+                raise EvaluationKitException('Packet counters need firmware protocol version 2.')
+            bitwidths = {8: protocol.EVKIT_BITWIDTH_8, 16: protocol.EVKIT_BITWIDTH_16}
+            if packet_count not in bitwidths:
+                raise EvaluationKitException('Unsupported packet counter width %s' % packet_count)
+            self.packet_count_width = bitwidths[packet_count]
+
     def _define_request_message_v2(self, sensor=None, fmt=None, hdr=None, reg=None, pin_index=None, timer=None):
         """Construct stream request message
 
@@ -346,9 +603,55 @@ class StreamConfig(object):
 
         LOGGER.debug("<Disable interrupt request")
 
+    def _append_action(self, macro_id, action, identifier, length):
+        """Append action which adds data to the end of indication of the macro.
+
+        Args:
+            macro_id(int): macro which sends one indication of ind_size bytes
+            action(int): EVKIT_MACRO_ACTION_x
+            identifier(int): action identifier
+            length(int): bytes the action adds
+
+        Returns:
+            int: offset of the action data in indication payload
+        """
+        protocol = self.adapter.protocol
+        message = self.msg_ind_dict[macro_id]
+        # indication is length byte followed by payload which starts with macro id
+        if 1 + message.ind_size + length > MAX_PACKET_SIZE:
+            raise EvaluationKitException('%d bytes more do not fit to indication of %s' % (length, message))
+
+        req = protocol.add_macro_action_req(
+            macro_id,
+            action=action,
+            target=message.target,
+            identifier=identifier,
+            append=True)
+        self.adapter.send_message(req)
+        self.adapter.receive_message(wait_for_message=protocol.EVKIT_MSG_ADD_MACRO_ACTION_RESP)
+        message.msg_req.append(req)
+        offset = message.ind_size
+        message.ind_size += length
+        return offset
+
+    def _add_stream_actions(self, macro_id):
+        "Append packet counter and firmware timestamp to indication of the macro if enabled"
+        protocol = self.adapter.protocol
+        message = self.msg_ind_dict[macro_id]
+        if self.packet_count_width is not None and message.packet_count_offset is None:
+            length = protocol.PKT_COUNT_LENGTH[self.packet_count_width]
+            message.packet_count_offset = self._append_action(
+                macro_id, protocol.EVKIT_MACRO_ACTION_PKT_COUNT, self.packet_count_width, length)
+            self.packet_counters[macro_id] = PacketCounter(length)
+
+        if self.device_clock is not None and message.timestamp_offset is None:
+            message.timestamp_offset = self._append_action(
+                macro_id, protocol.EVKIT_MACRO_ACTION_TIMESTAMP, self.timestamp_scale, protocol.TIMESTAMP_LENGTH)
+
     def _start_streaming_v2(self):
         LOGGER.debug(">_start_streaming")
         for macro_id in self.macro_id_list:
+            self._add_stream_actions(macro_id)
             req = self.adapter.protocol.start_macro_action_req(macro_id)
             LOGGER.debug(req)
             self.adapter.send_message(req)
@@ -379,13 +682,50 @@ class StreamConfig(object):
 
         LOGGER.debug("<stop streaming")
 
+    def decode_appended(self, macro_id, resp):
+        """Decode packet counter and firmware timestamp appended to stream indication.
+
+        Args:
+            macro_id(int): macro which sent the indication
+            resp(array): indication payload of ind_size bytes
+
+        Returns:
+            tuple: (indications lost before this one, device time in seconds or None)
+        """
+        message = self.msg_ind_dict[macro_id]
+        lost = 0
+        if message.packet_count_offset is not None:
+            lost = self.packet_counters[macro_id].update(resp, message.packet_count_offset)
+        device_time = None
+        if message.timestamp_offset is not None:
+            device_time = self.device_clock.seconds(resp, message.timestamp_offset)
+        return lost, device_time
+
+    def start_streaming(self):
+        "Subscribe requested data streams from FW"
+        self._start_streaming()
+
+    def stop_streaming(self):
+        "Unsubscribe requested data streams from FW"
+        self._stop_streaming()
+
+    def get_log_metadata(self):
+        "Board information stored to data logs"
+        return {
+            'board_id': self.adapter.board_id,
+            'firmware_id': self.adapter.firmware_id,
+            'protocol_version': self.adapter.fw_protocol_version,
+            'odr': evkit_config.get('odr')
+        }
+
     def read_data_stream(self,
                          loop=None,
                          console=True,
                          log_file_name=None,
                          callback=None,
                          max_timeout_count=1,
-                         additional_info=None):
+                         additional_info=None,
+                         batch=None):
         """Main loop for reading stream data after data streams are activated.
 
         Args:
@@ -394,22 +734,37 @@ class StreamConfig(object):
             log_file_name(string/None): Log file to write. (defaults to None)
             callback(function): function to call after new data is received.
             max_timeout_count(int/None): break after bus2 time out count is reached. If None then loop forever regardless timeouts
-            additional_info(string): info passed to SensorDataLogger instance
+            additional_info(dict): metadata passed to SensorDataLogger instance. Defaults to get_log_metadata()
+            batch(int/None): decode data in batches of given size with numpy. Callback
+                receives (batch, channels) numpy array instead of single sample. (defaults to None)
 
         """
         count = 0  # count of received data samples
         timeout_count = 0  # how many successive timeouts received
+        batches = {}  # {macro_id:StreamBatch}
+
+        if batch is not None:
+            try:
+                import numpy  # pylint: disable=unused-import
+            except ImportError:
+                raise EvaluationKitException('numpy is needed for batch decoding.')
+
+        if additional_info is None:
+            additional_info = self.get_log_metadata()
 
         self.data_logger = SensorDataLogger(console=console,
                                             log_file_name=log_file_name,
-                                            additional_info=additional_info)
+                                            additional_info=additional_info,
+                                            host_timestamp=self.host_timestamp)
+        keep_raw = self.data_logger.needs_raw
 
         # subscribe sensor data from FW
         self._start_streaming()
         # On FW1 channels are known only after that _start_streaming()
         # print out header text, replace text "ch" with channel number
         for channel, request in iter(self.msg_ind_dict.items()):
-            self.data_logger.add_channel(request.msg_hdr, channel)
+            self.data_logger.add_channel(request.msg_hdr, channel,
+                                         fmt=request.msg_fmt, axis_map=request.axis_mapper.axis_map)
 
         self.data_logger.start()
 
@@ -438,16 +793,40 @@ class StreamConfig(object):
                 # find correct message type to get information how message is interpreted
                 received_messsage_type = self.msg_ind_dict[macro_index]
 
-                if len(resp) != received_messsage_type.msg_size:
-                    LOGGER.error("Length of received message was wrong (%d). Expected (%d)" % (len(resp), received_messsage_type.msg_size))
+                if len(resp) != received_messsage_type.ind_size:
+                    LOGGER.error("Length of received message was wrong (%d). Expected (%d)" % (len(resp), received_messsage_type.ind_size))
+                    continue
+
+                lost, device_time = self.decode_appended(macro_index, resp)
+                if lost and self.gap_rows:
+                    # samples received before the gap are logged first
+                    stream_batch = batches.get(macro_index)
+                    if stream_batch is not None and stream_batch.count:
+                        data, timestamps, payloads, host_timestamps = stream_batch.pop(keep_raw)
+                        self.data_logger.feed_batch(data, timestamps, payloads, host_timestamps)
+                        if callback is not None and callback(data) is False:
+                            break
+                    self.data_logger.feed_gap(macro_index, lost)
+
+                if batch is not None:
+                    count += 1
+                    if macro_index not in batches:
+                        batches[macro_index] = StreamBatch(received_messsage_type, batch)
+
+                    now = TIMING.time_elapsed()
+                    if not batches[macro_index].append(resp, now if device_time is None else device_time, now):
+                        continue
+
+                    data, timestamps, payloads, host_timestamps = batches[macro_index].pop(keep_raw)
+                    self.data_logger.feed_batch(data, timestamps, payloads, host_timestamps)
+
                 else:
-                    fmt = self.msg_ind_dict[macro_index].msg_fmt
-                    # unpack the raw data
-                    data = struct.unpack(fmt, resp)
-                    # rotate if 3d data
-                    data = self.msg_ind_dict[macro_index].axis_mapper.map_xyz_axis(data)
-                    # log the data
-                    self.data_logger.feed_values(data)
+                    # unpack the raw data and rotate if 3d data
+                    data = received_messsage_type.decode(resp)
+                    # log the data, raw payload without appended packet counter and timestamp
+                    if received_messsage_type.ind_size != received_messsage_type.msg_size:
+                        resp = resp[:received_messsage_type.msg_size] if keep_raw else None
+                    self.data_logger.feed_values(data, resp, device_time)
 
                     count += 1
 
@@ -466,7 +845,72 @@ class StreamConfig(object):
             # unsibscribe data from FW
             self._stop_streaming()
 
+            # log partially filled batches
+            for stream_batch in batches.values():
+                if stream_batch.count:
+                    data, timestamps, payloads, host_timestamps = stream_batch.pop(keep_raw)
+                    self.data_logger.feed_batch(data, timestamps, payloads, host_timestamps)
+                    if callback is not None:
+                        callback(data)
+
+            for macro_id, counter in sorted(self.packet_counters.items()):
+                self.data_logger.feed_comment('Packets of channel %d: received %d, lost %d, gaps %d, wraps %d, duplicates %d' %
+                                              (macro_id, counter.received, counter.lost, counter.gaps, counter.wraps,
+                                               counter.duplicates))
+                if counter.lost:
+                    LOGGER.warning('Channel %d lost %d packets (%.2f%%) in %d gaps.' %
+                                   (macro_id, counter.lost, 100 * counter.loss_ratio, counter.gaps))
+
             self.data_logger.stop()
 
             if count == 0:
                 LOGGER.error("No stream data received.")
+
+            reader = getattr(self.adapter.bus2, 'reader', None)
+            if reader is not None and reader.dropped_frames:
+                LOGGER.warning("Receive queue overflow. %d messages dropped." % reader.dropped_frames)
+
+
+class MacroPoller(object):
+    """Waits sensor interrupt with evaluation board firmware macro instead of polling GPIO line state.
+
+    Macro reads the registers when interrupt line activates and sends them in indication message.
+    Host does no bus transactions while waiting.
+
+    Args:
+        sensor(SensorDriver): sensor driver instance
+        pin_index(int): sensor's logical interrupt pin
+        reg(int): first register to read
+        length(int): amount of registers to read
+    """
+
+    def __init__(self, sensor, pin_index, reg, length):
+        self.reg = reg
+        self._timing = get_timer()
+        self.stream_config = StreamConfig(sensor, timestamp=STREAM_TIMESTAMP_HOST, packet_count=0)
+        self.adapter = self.stream_config.adapter
+        self.stream_config.define_request_message(fmt='B' * (length + 1), hdr='ch!data', reg=reg, pin_index=pin_index)
+        self.stream_config.start_streaming()
+        # macro id is known after start_streaming() on FW1
+        self.macro_id = list(self.stream_config.msg_ind_dict)[0]
+
+    def wait(self, timeout=5.0):
+        """Wait for macro indication.
+
+        Args:
+            timeout(float): timeout in seconds. If 0 or None then wait forever.
+
+        Returns:
+            array: register values read by the macro
+        """
+        self._timing.reset()
+        while True:
+            try:
+                _, resp = self.adapter.receive_message(wait_for_message=self.macro_id)
+                return resp[1:]
+            except ProtocolTimeoutException:
+                if timeout and self._timing.time_elapsed() > timeout:
+                    raise ProtocolTimeoutException('No interrupts received. Please check interrupt line connections and sensor configuration.')
+
+    def stop(self):
+        self.stream_config.stop_streaming()
@@ -0,0 +1,118 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Persistent cache of discovered evaluation boards.
+
+Boards are identified by USB VID/PID and serial number of the serial port. Cache entry
+remembers which port the board was found from and what the board reported in connection
+handshake so that later connections can open the right port first and skip info queries.
+"""
+import json
+import os
+from kx_lib import kx_logger
+LOGGER = kx_logger.get_logger(__name__)
+
+# LOGGER.setLevel(kx_logger.DEBUG)
+
+CACHE_VERSION = 1
+
+
+def hw_key(vid, pid, serial_number):
+    "Cache key of USB serial device. None if device does not have USB identifiers."
+    if vid is None or pid is None:
+        return None
+    return '%04x:%04x:%s' % (vid, pid, serial_number or '')
+
+
+class DiscoveryCache(object):
+    """Board discovery results stored in json file.
+
+    Entry of each board has keys port, board_id, dev_id, firmware_id and protocol_version.
+
+    Args:
+        file_name(string): cache file name. If None then cache is kept only in memory.
+    """
+
+    def __init__(self, file_name=None):
+        self.file_name = os.path.expanduser(file_name) if file_name else None
+        self.boards = {}
+        self.load()
+
+    def load(self):
+        if self.file_name is None or not os.path.isfile(self.file_name):
+            return
+        try:
+            with open(self.file_name, 'r') as infile:
+                content = json.load(infile)
+        except (IOError, ValueError) as exception:
+            LOGGER.warning('Discarding discovery cache %s: %s' % (self.file_name, exception))
+            return
+
+        if content.get('version') == CACHE_VERSION:
+            self.boards = content.get('boards', {})
+
+    def save(self):
+        if self.file_name is None:
+            return
+        try:
+            with open(self.file_name, 'w') as outfile:
+                json.dump({'version': CACHE_VERSION, 'boards': self.boards}, outfile, indent=4, sort_keys=True)
+        except IOError as exception:
+            LOGGER.warning('Cannot write discovery cache %s: %s' % (self.file_name, exception))
+
+    def lookup(self, key, board_id=None):
+        """Cached entry of the board.
+
+        Args:
+            key(string): hw_key() of the serial port
+            board_id(int): if given then entry is returned only if it has the same board_id
+
+        Returns:
+            dict: cache entry or None
+        """
+        entry = self.boards.get(key) if key else None
+        if entry is None or (board_id is not None and entry.get('board_id') != board_id):
+            return None
+        return entry
+
+    def update(self, key, port, adapter):
+        """Store handshake results of connected board and write the cache file.
+
+        Args:
+            key(string): hw_key() of the serial port
+            port(string): serial port name
+            adapter(KxAdapterEvk): connected adapter
+        """
+        if not key:
+            return
+        entry = {
+            'port': port,
+            'board_id': adapter.board_id,
+            'dev_id': adapter.dev_id,
+            'firmware_id': adapter.firmware_id,
+            'protocol_version': adapter.fw_protocol_version}
+        if self.boards.get(key) != entry:
+            self.boards[key] = entry
+            self.save()
+
+    def order_ports(self, ports, keys, board_id):
+        """Sort ports so that ports where the board was found earlier are tried first
+        and ports known to have other boards are tried last.
+
+        Args:
+            ports(list): serial port names
+            keys(dict): serial port name -> hw_key()
+            board_id(int): expected board id
+
+        Returns:
+            list: ports in connection order
+        """
+        def rank(port):
+            entry = self.lookup(keys.get(port))
+            if entry is None:
+                return 2
+            if entry.get('board_id') != board_id:
+                return 3
+            return 0 if entry.get('port') == port else 1
+
+        return sorted(ports, key=rank)
@@ -0,0 +1,516 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""In-process emulation of RoKiX firmware with protocol version 2.0.
+
+KxEmulator is a bus2 connection which answers protocol requests itself, so KxAdapterEvk,
+ProtocolEngine2 and StreamConfig can be run and benchmarked without a board. Sensors are
+register files seeded from the register definitions of sensor drivers. Interrupt macros
+trigger at configurable rate, timer macros at their own rate. Indications can be corrupted
+or dropped to exercise error handling.
+
+Output registers get synthetic samples; sensor functions like the sample buffer are not emulated.
+"""
+import importlib
+import math
+import random
+import struct
+import sys
+import time
+from kx_lib import kx_protocol_2_x as protocol
+from kx_lib.kx_bus2 import KxConnection
+from kx_lib.kx_configuration_enum import MAX_PACKET_SIZE, CFG_CONFIGURATION, CFG_TARGET, CFG_SAD, CFG_CS, CFG_POLARITY
+from kx_lib.kx_exception import ProtocolTimeoutException
+from kx_lib import kx_logger
+LOGGER = kx_logger.get_logger(__name__)
+
+# LOGGER.setLevel(kx_logger.DEBUG)
+
+# part name -> (register definition module, register name prefix)
+EMULATED_PARTS = {
+    'KX132-1211': ('kx132.kx132_1211_registers', 'KX132_1211_'),
+    'KX134-1211': ('kx134.kx134_1211_registers', 'KX134_1211_'),
+    'KXTJ3': ('kxtj3.kxtj3_registers', 'KXTJ3_'),
+}
+
+# (response register, control register, control bit) names of communication self test
+SELF_TEST_NAMES = [('COTR', 'CNTL2', 'CNTL2_COTC'),
+                   ('DCST_RESP', 'CTRL_REG2', 'CTRL_REG2_DCST')]
+
+SPI_TARGETS = [protocol.EVKIT_BUS1_TARGET_SPI0, protocol.EVKIT_BUS1_TARGET_SPI1, protocol.EVKIT_BUS1_TARGET_SPI2]
+IND_PAYLOAD_SIZE = MAX_PACKET_SIZE - 2  # indication header is length and macro id
+MAX_MACROS = 8
+SAMPLE_PERIOD = 100  # samples in one period of synthetic signal
+SAMPLE_AMPLITUDE = 8192
+FULL_SPEED_TRIGGERS = 32  # triggers per running macro generated at once without rate limit
+MAX_BURST = 1000  # max triggers generated at once when host has not read in time
+
+DEV_ID = [0x52, 0x4f, 0x4b, 0x49, 0x58, 0x00]
+FIRMWARE_ID = [0xe0, 0x1a, 0x70, 0x00]
+
+
+def synthetic_samples(period=SAMPLE_PERIOD, amplitude=SAMPLE_AMPLITUDE):
+    "One period of xyz samples packed as little endian 16 bit values"
+    samples = []
+    for index in range(period):
+        angle = 2 * math.pi * index / period
+        samples.append(struct.pack('<hhh', int(amplitude * math.sin(angle)),
+                                   int(amplitude * math.cos(angle)), amplitude))
+    return samples
+
+
+class EmulatedSensor(object):
+    """Register file of an emulated sensor.
+
+    Args:
+        name(string): part name
+        reset_values(dict): register address -> value after reset
+        sample_registers(list): start addresses of xyz output registers updated by next_sample()
+        status(tuple): (register, bit) of data ready. Set by next_sample() and cleared when output
+            registers are read. Reading the status when it is clear makes next sample, so polling
+            the status gets new data without delay.
+        self_test(tuple): (response register, control register, control bit, value before, value after)
+    """
+
+    def __init__(self, name, reset_values=None, sample_registers=(), status=None, self_test=None):
+        self.name = name
+        self.sample_registers = list(sample_registers)
+        self.status = status
+        self.self_test = self_test
+        self.samples = 0
+        self._sample_data = synthetic_samples()
+        self.registers = bytearray(256)
+        for address, value in (reset_values or {}).items():
+            self.registers[address] = value
+
+    def read(self, register, length):
+        end = register + length
+        if self.status is not None:
+            status_register, bit = self.status
+            if register <= status_register < end and not self.registers[status_register] & bit:
+                self.next_sample()
+            elif any(register < t + 6 and t < end for t in self.sample_registers):
+                self.registers[status_register] &= ~bit
+
+        data = self.registers[register:end]
+        data += bytearray(length - len(data))
+        if self.self_test is not None:
+            response, _, _, before, _ = self.self_test
+            if register <= response < end:
+                self.registers[response] = before
+        return data
+
+    def write(self, register, values):
+        for offset, value in enumerate(values):
+            address = (register + offset) & 0xff
+            self.registers[address] = value
+            if self.self_test is not None:
+                response, control, bit, _, after = self.self_test
+                if address == control and value & bit:
+                    self.registers[response] = after
+
+    def next_sample(self):
+        "Update output registers with next synthetic sample"
+        data = self._sample_data[self.samples % len(self._sample_data)]
+        self.samples += 1
+        for register in self.sample_registers:
+            self.registers[register:register + len(data)] = data
+        if self.status is not None:
+            register, bit = self.status
+            self.registers[register] |= bit
+
+
+def kionix_sensor(part_name):
+    """Emulated sensor seeded from register definitions of the part.
+
+    Args:
+        part_name(string): key of EMULATED_PARTS
+
+    Returns:
+        EmulatedSensor: sensor with WHO_AM_I, self test, output and data ready registers
+    """
+    module_name, prefix = EMULATED_PARTS[part_name]
+    definitions = importlib.import_module(module_name)
+    registers = definitions.registers().__dict__
+    bits = definitions.bits().__dict__
+
+    def register(name):
+        return registers.get(prefix + name)
+
+    def bit(name):
+        return bits.get(prefix + name)
+
+    reset_values = {}
+    for wai_name in ['WHO_AM_I_WAI_ID', 'WHO_AM_I_WIA_ID']:
+        if bit(wai_name) is not None:
+            reset_values[register('WHO_AM_I')] = bit(wai_name)
+
+    self_test = None
+    for response, control, control_bit in SELF_TEST_NAMES:
+        values = [register(response), register(control), bit(control_bit),
+                  bit(response + '_DCSTR_BEFORE'), bit(response + '_DCSTR_AFTER')]
+        if None not in values:
+            self_test = tuple(values)
+            reset_values[self_test[0]] = self_test[3]
+
+    status = None
+    for status_name in ['INS2', 'INT_SOURCE1']:
+        if register(status_name) is not None and bit(status_name + '_DRDY') is not None:
+            status = (register(status_name), bit(status_name + '_DRDY'))
+            break
+
+    sample_registers = [t for t in [register('XOUT_L'), register('XADP_L')] if t is not None]
+    return EmulatedSensor(part_name, reset_values, sample_registers, status, self_test)
+
+
+class EmulatedMacro(object):
+    "Macro created with EVKIT_MSG_CREATE_MACRO_REQ"
+
+    def __init__(self, macro_id, period=None):
+        self.macro_id = macro_id
+        self.period = period  # seconds between triggers of timer macro, None for interrupt macro
+        self.actions = []  # (action, append, discard, run_count, target, identifier, parameters)
+        self.running = False
+        self.start_time = None
+        self.triggers = 0
+        self.packet_count = 0
+
+
+class KxEmulator(KxConnection):
+    """bus2 connection to emulated firmware.
+
+    Args:
+        board_id(int): board id reported in version response
+        parts(dict): (bus1 target, SAD or CS) -> list of part names which may be found there
+        rate(float): trigger rate of interrupt macros in Hz. None or 0 triggers them as fast as
+            the host reads. Timer macros trigger at their own period.
+        corrupt_rate(float): probability of changing one payload byte of an indication
+        drop_rate(float): probability of dropping an indication
+        seed(int): seed of corruptions and drops
+        interrupt_level(int): state of input pins. Interrupt lines are always active so that
+            polling them gets new data without delay.
+
+    Attributes:
+        indications(int): indications sent
+        corrupted(int): indications corrupted
+        dropped(int): indications dropped
+    """
+
+    def __init__(self, board_id, parts, rate=None, corrupt_rate=0.0, drop_rate=0.0, seed=0, interrupt_level=0):
+        self.board_id = board_id
+        self.interrupt_level = interrupt_level
+        self.parts = parts
+        self.rate = rate or None
+        self.corrupt_rate = corrupt_rate
+        self.drop_rate = drop_rate
+        self.timeout = 1.0
+        self.sensors = {}  # (target, identifier) -> EmulatedSensor
+        self.macros = {}  # macro_id -> EmulatedMacro
+        self.gpio_state = {}  # pin -> state of output pin
+        self.indications = 0
+        self.corrupted = 0
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self._rx_buffer = bytearray()  # host to emulator
+        self._tx_buffer = bytearray()  # emulator to host
+        self._start_time = time.time()
+
+    @classmethod
+    def from_board_config(cls, board_config, **kwargs):
+        "Emulator of board described in board configuration. kwargs are passed to KxEmulator."
+        parts = {}
+        bus1 = board_config[CFG_CONFIGURATION]['bus1']
+        if bus1.get('sensor_defaults', {}).get(CFG_POLARITY) == 'EVKIT_GPIO_PIN_SENSE_HIGH':
+            kwargs.setdefault('interrupt_level', 1)
+        for target in bus1['targets']:
+            for part_name, resource in target.get('parts', {}).items():
+                identifier = resource.get(CFG_SAD, resource.get(CFG_CS))
+                if part_name in EMULATED_PARTS and identifier is not None:
+                    parts.setdefault((target[CFG_TARGET], identifier), []).append(part_name)
+        return cls(board_config[CFG_CONFIGURATION]['board_id'], parts, **kwargs)
+
+    #
+    # KxConnection interface
+    #
+
+    def write(self, data):
+        self._rx_buffer.extend(bytearray(data))
+        while len(self._rx_buffer) >= 2 and len(self._rx_buffer) >= self._rx_buffer[0]:
+            length = self._rx_buffer[0]
+            message = self._rx_buffer[:length]
+            del self._rx_buffer[:length]
+            self._handle_request(message)
+
+    def read(self, length=1):
+        while len(self._tx_buffer) < length:
+            self._generate_indications()
+        data = self._tx_buffer[:length]
+        del self._tx_buffer[:length]
+        return data
+
+    def read_available(self, length=1):
+        while len(self._tx_buffer) < length:
+            self._generate_indications()
+        data = self._tx_buffer
+        self._tx_buffer = bytearray()
+        return data
+
+    def flush(self):
+        self._tx_buffer = bytearray()
+
+    def close(self):
+        self.macros = {}
+        self.flush()
+
+    #
+    # requests
+    #
+
+    def _send(self, message_type, payload=()):
+        self._tx_buffer.extend(bytearray([len(payload) + 2, message_type]))
+        self._tx_buffer.extend(bytearray(payload))
+
+    def _respond(self, message_type, payload=(), status=protocol.EVKIT_SUCCESS):
+        self._send(message_type, [status] + list(payload))
+
+    def _sensor(self, target, identifier):
+        "Emulated sensor at bus1 address or None"
+        key = (target, identifier)
+        if key not in self.sensors:
+            candidates = self.parts.get(key)
+            if not candidates:
+                return None
+            # prefer part whose driver is in use
+            imported = [t for t in candidates if EMULATED_PARTS[t][0] in sys.modules]
+            self.sensors[key] = kionix_sensor((imported or candidates)[0])
+            LOGGER.debug('Emulating %s at %s' % (self.sensors[key].name, key))
+        return self.sensors[key]
+
+    def _register(self, target, register):
+        "Register address without SPI read bit"
+        return register & 0x7f if target in SPI_TARGETS else register
+
+    def _handle_request(self, message):
+        message_type = message[1]
+        payload = message[2:]
+
+        if message_type == protocol.EVKIT_MSG_VERSION_REQ:
+            self._respond(protocol.EVKIT_MSG_VERSION_RESP, [protocol.EVKIT_PROTOCOL_VERSION_MAJOR,
+                                                           protocol.EVKIT_PROTOCOL_VERSION_MINOR,
+                                                           self.board_id])
+
+        elif message_type == protocol.EVKIT_MSG_DEV_INFO_REQ:
+            info = {protocol.EVKIT_DEV_ID: DEV_ID,
+                    protocol.EVKIT_FW_SW_VER: FIRMWARE_ID,
+                    protocol.EVKIT_FW_BL_SW_VER: FIRMWARE_ID}.get(payload[0])
+            if info is None:
+                self._respond(protocol.EVKIT_MSG_DEV_INFO_RESP, status=protocol.EVKIT_ERR_INVALID_PARAM)
+            else:
+                self._respond(protocol.EVKIT_MSG_DEV_INFO_RESP, info)
+
+        elif message_type == protocol.EVKIT_MSG_READ_REQ:
+            target, identifier, register, length = payload[:4]
+            sensor = self._sensor(target, identifier)
+            if sensor is None:
+                self._respond(protocol.EVKIT_MSG_READ_RESP, status=protocol.EVKIT_ERR_BUS1)
+            else:
+                self._respond(protocol.EVKIT_MSG_READ_RESP, sensor.read(self._register(target, register), length))
+
+        elif message_type == protocol.EVKIT_MSG_WRITE_REQ:
+            target, identifier, register = payload[:3]
+            sensor = self._sensor(target, identifier)
+            if sensor is None:
+                self._respond(protocol.EVKIT_MSG_WRITE_RESP, status=protocol.EVKIT_ERR_BUS1)
+            else:
+                sensor.write(self._register(target, register), payload[3:])
+                self._respond(protocol.EVKIT_MSG_WRITE_RESP)
+
+        elif message_type == protocol.EVKIT_MSG_GPIO_STATE_REQ:
+            state = self.gpio_state.get(payload[0], self.interrupt_level)
+            self._respond(protocol.EVKIT_MSG_GPIO_STATE_RESP, [payload[0], protocol.EVKIT_GPIO_PIN_SENSE_HIGH if state
+                                                               else protocol.EVKIT_GPIO_PIN_SENSE_LOW])
+
+        elif message_type == protocol.EVKIT_MSG_GPIO_CONFIG_REQ:
+            gpio_pin, direction, _, position = payload[:4]
+            if direction == protocol.EVKIT_GPIO_PIN_OUTPUT:
+                self.gpio_state[gpio_pin] = 1 if position == protocol.EVKIT_GPIO_PIN_DRIVEHIGH else 0
+            else:
+                self.gpio_state.pop(gpio_pin, None)
+            self._respond(protocol.EVKIT_MSG_GPIO_CONFIG_RESP, [gpio_pin])
+
+        elif message_type == protocol.EVKIT_MSG_CREATE_MACRO_REQ:
+            self._create_macro(payload)
+
+        elif message_type == protocol.EVKIT_MSG_ADD_MACRO_ACTION_REQ:
+            self._add_macro_action(payload)
+
+        elif message_type in [protocol.EVKIT_MSG_START_MACRO_REQ, protocol.EVKIT_MSG_STOP_MACRO_REQ,
+                              protocol.EVKIT_MSG_REMOVE_MACRO_REQ]:
+            self._control_macro(message_type, payload[0])
+
+        elif message_type == protocol.EVKIT_MSG_RESET_REQ:
+            self.macros = {}  # no response to reset
+
+        elif message_type in [protocol.EVKIT_MSG_CONFIGURE_REQ, protocol.EVKIT_MSG_SELFTEST_REQ]:
+            self._respond(message_type + 1)
+
+        else:
+            LOGGER.debug('Request 0x%02x not emulated' % message_type)
+            self._respond(message_type + 1, status=protocol.EVKIT_ERR_FEAT_UNSUPPORTED)
+
+    def _create_macro(self, payload):
+        if len(self.macros) >= MAX_MACROS:
+            self._respond(protocol.EVKIT_MSG_CREATE_MACRO_RESP, status=protocol.EVKIT_ERR_OUT_OF_MACROS)
+            return
+
+        macro_id = protocol.EVKIT_MSG_MACRO_IND_BASE
+        while macro_id in self.macros:
+            macro_id += 1
+
+        period = None
+        if payload[0] == protocol.EVKIT_MACRO_TYPE_POLL:
+            timer_value, = struct.unpack_from('<H', payload, 2)
+            period = protocol.TIME_SCALE_SECONDS[payload[1]] * timer_value
+
+        self.macros[macro_id] = EmulatedMacro(macro_id, period)
+        self._respond(protocol.EVKIT_MSG_CREATE_MACRO_RESP, [macro_id])
+
+    def _add_macro_action(self, payload):
+        macro = self.macros.get(payload[0])
+        if macro is None:
+            self._respond(protocol.EVKIT_MSG_ADD_MACRO_ACTION_RESP, status=protocol.EVKIT_ERR_INVALID_PARAM)
+            return
+
+        flags = payload[1]
+        macro.actions.append((flags & protocol.EVKIT_MACRO_ACTION_ACTION_MASK,
+                              bool(flags & protocol.EVKIT_MACRO_ACTION_APPEND_MASK),
+                              bool(flags & protocol.EVKIT_MACRO_ACTION_DISCARD_MASK),
+                              payload[2], payload[3], payload[4], payload[5:]))
+        self._respond(protocol.EVKIT_MSG_ADD_MACRO_ACTION_RESP)
+
+    def _control_macro(self, message_type, macro_id):
+        if macro_id == protocol.EVKIT_MACRO_APPLY_ACTION_ALL:
+            macros = list(self.macros.values())
+        else:
+            macros = [self.macros[macro_id]] if macro_id in self.macros else []
+
+        for macro in macros:
+            if message_type == protocol.EVKIT_MSG_START_MACRO_REQ:
+                macro.running = True
+                macro.start_time = time.time()
+                macro.triggers = 0
+            elif message_type == protocol.EVKIT_MSG_STOP_MACRO_REQ:
+                macro.running = False
+            else:
+                del self.macros[macro.macro_id]
+
+        self._respond(message_type + 1)
+
+    #
+    # macro execution
+    #
+
+    def _run_action(self, macro, action):
+        "Payload of one action run"
+        action_type, _, _, _, target, identifier, parameters = action
+
+        if action_type == protocol.EVKIT_MACRO_ACTION_READ:
+            sensor = self._sensor(target, identifier)
+            length = parameters[1]
+            if sensor is None:
+                return bytearray(length)
+            return sensor.read(self._register(target, parameters[0]), length)
+
+        elif action_type == protocol.EVKIT_MACRO_ACTION_WRITE:
+            sensor = self._sensor(target, identifier)
+            if sensor is not None:
+                sensor.write(self._register(target, parameters[0]), parameters[1:])
+
+        elif action_type == protocol.EVKIT_MACRO_ACTION_PKT_COUNT:
+            length = protocol.PKT_COUNT_LENGTH[identifier]
+            macro.packet_count += 1
+            value = macro.packet_count % (1 << (8 * length))
+            return bytearray(struct.pack('<I', value)[:length])
+
+        elif action_type == protocol.EVKIT_MACRO_ACTION_TIMESTAMP:
+            # scheduled time of the trigger, as the firmware timer would give
+            trigger_time = self._next_trigger_time(macro) if self._has_period(macro) else time.time()
+            ticks = int((trigger_time - self._start_time) / protocol.TIME_SCALE_SECONDS[identifier])
+            return bytearray(struct.pack('<I', ticks & 0xffffffff))
+
+        elif action_type == protocol.EVKIT_MACRO_ACTION_GPIO_READ:
+            return bytearray([self.gpio_state.get(identifier, self.interrupt_level)])
+
+        return bytearray()
+
+    def _trigger(self, macro):
+        "Run actions of the macro once and send resulting indications"
+        for sensor in set(self._sensor(action[4], action[5]) for action in macro.actions
+                          if action[0] == protocol.EVKIT_MACRO_ACTION_READ):
+            if sensor is not None:
+                sensor.next_sample()
+
+        packets = []
+        for action in macro.actions:
+            append, discard, run_count = action[1:4]
+            for _ in range(run_count):
+                data = self._run_action(macro, action)
+                if discard or not data:
+                    continue
+                if append and packets and len(packets[-1]) + len(data) <= IND_PAYLOAD_SIZE:
+                    packets[-1].extend(data)
+                else:
+                    packets.append(bytearray(data[:IND_PAYLOAD_SIZE]))
+
+        macro.triggers += 1
+        for packet in packets:
+            if self.drop_rate and self._random.random() < self.drop_rate:
+                self.dropped += 1
+                continue
+            if self.corrupt_rate and self._random.random() < self.corrupt_rate:
+                packet[self._random.randrange(len(packet))] ^= 1 << self._random.randrange(8)
+                self.corrupted += 1
+            self._send(macro.macro_id, packet)
+            self.indications += 1
+
+    def _due_triggers(self, macro, now):
+        "Amount of triggers of the macro which are due"
+        period = macro.period if macro.period is not None else (1.0 / self.rate if self.rate else None)
+        if period is None:
+            return FULL_SPEED_TRIGGERS
+        due = int((now - macro.start_time) / period) + 1 - macro.triggers
+        if due > MAX_BURST:
+            # host has not read in time, triggers beyond burst limit are lost
+            macro.triggers += due - MAX_BURST
+            due = MAX_BURST
+        return max(0, due)
+
+    def _has_period(self, macro):
+        return macro.period is not None or bool(self.rate)
+
+    def _next_trigger_time(self, macro):
+        period = macro.period if macro.period is not None else (1.0 / self.rate if self.rate else 0)
+        return macro.start_time + macro.triggers * period
+
+    def _generate_indications(self):
+        "Run due macro triggers. Waits for next trigger or raises timeout if nothing is due."
+        deadline = time.time() + self.timeout
+        while True:
+            running = [t for t in sorted(self.macros.values(), key=lambda macro: macro.macro_id) if t.running]
+            if not running:
+                raise ProtocolTimeoutException('No data received.')
+
+            now = time.time()
+            generated = False
+            for macro in running:
+                for _ in range(self._due_triggers(macro, now)):
+                    self._trigger(macro)
+                    generated = True
+            if generated and self._tx_buffer:
+                return
+
+            now = time.time()
+            if now >= deadline:
+                raise ProtocolTimeoutException('No data received.')
+            next_time = min(self._next_trigger_time(macro) for macro in running)
+            time.sleep(max(0, min(next_time, deadline) - now))
@@ -32,3 +32,16 @@ class ProtocolBus1Exception(ProtocolException):
 
 class ProtocolBus2Exception(ProtocolException):
     pass
+
+
+class ProtocolPipelineException(ProtocolException):
+    """Exception for failed requests of pipelined request sequence.
+
+    Args:
+        msg (str, optional): a free-form message; shown in tracebacks
+        errors (list, optional): (request index, ProtocolException) of each failed request
+    """
+
+    def __init__(self, msg='', errors=None):
+        ProtocolException.__init__(self, msg)
+        self.errors = errors or []
@@ -0,0 +1,277 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Sample buffer (FIFO) streaming for KX132 and KX134.
+
+Watermark interrupt triggers a macro which reads the buffer level and drains watermark
+amount of samples packed to as few indication messages as the packet size allows.
+Buffer level is used to detect overflows and to estimate amount of lost samples.
+"""
+import math
+from kx_lib.kx_configuration_enum import MAX_PACKET_SIZE, CFG_POLARITY, CFG_PULLUP, CFG_SAD, CFG_TARGET, \
+    STREAM_TIMESTAMP_HOST
+from kx_lib.kx_data_logger import SensorDataLogger, TIMING
+from kx_lib.kx_data_stream import StreamConfig, RequestMessageDefinition
+from kx_lib.kx_exception import EvaluationKitException, ProtocolBus1Exception, ProtocolTimeoutException
+from kx_lib.kx_util import DelayedKeyboardInterrupt, evkit_config, get_drdy_pin_index
+from kx_lib import kx_logger
+LOGGER = kx_logger.get_logger(__name__)
+
+# LOGGER.setLevel(kx_logger.DEBUG)
+
+IND_HEADER_LENGTH = 2  # length and message type bytes of indication message
+BUF_STATUS_LENGTH = 2  # BUF_STATUS_1 and BUF_STATUS_2
+BUF_STATUS_2_SMP_LEV_H_MASK = 0x03
+FIFO_CAPACITY_16BIT = 86  # samples in buffer with BRES = 1
+FIFO_CAPACITY_8BIT = 171  # samples in buffer with BRES = 0
+MAX_TRIGGER_RATE = 50  # Hz, watermark is increased to keep interrupt rate below this
+DEFAULT_LINK_BANDWIDTH = 10000  # bytes/s, used when bus2 does not tell its baud rate e.g. BLE
+
+
+def samples_per_packet(sample_size):
+    "Amount of buffer samples fitting in one indication message"
+    return (MAX_PACKET_SIZE - IND_HEADER_LENGTH) // sample_size
+
+
+def link_bandwidth(bus2_configuration):
+    """Link throughput in bytes/s estimated from serial port baud rate.
+
+    Baud rate is taken from the configuration, not from the bus2 connection object which
+    can be wrapped e.g. by KxCaptureConnection.
+
+    Args:
+        bus2_configuration(dict): selected bus2 connection of board configuration,
+            ConnectionManager.bus2_configuration
+
+    Returns:
+        float: bytes/s
+    """
+    baudrate = (bus2_configuration or {}).get('baud_rate')
+    return baudrate / 10.0 if baudrate else DEFAULT_LINK_BANDWIDTH
+
+
+def fifo_watermark(odr, sample_size, capacity, bandwidth=None):
+    """Watermark level for draining the sample buffer with full indication messages.
+
+    Watermark is multiple of samples fitting in one indication. It is big enough to keep
+    interrupt rate below MAX_TRIGGER_RATE and at most half of the buffer so that samples
+    arriving during the drain do not fill the buffer.
+
+    Args:
+        odr(float): output data rate in Hz
+        sample_size(int): bytes per buffer sample
+        capacity(int): buffer size in samples
+        bandwidth(float): link throughput in bytes/s. Warning is logged if ODR needs more.
+
+    Returns:
+        int: watermark level in samples
+    """
+    per_packet = samples_per_packet(sample_size)
+    packets = max(1, int(math.ceil(float(odr) / (MAX_TRIGGER_RATE * per_packet))))
+    packets = min(packets, (capacity // 2) // per_packet)
+    watermark = packets * per_packet
+
+    if bandwidth:
+        needed = float(odr) / per_packet * MAX_PACKET_SIZE + \
+            float(odr) / watermark * (IND_HEADER_LENGTH + BUF_STATUS_LENGTH)
+        if needed > bandwidth:
+            LOGGER.warning('ODR %g Hz needs %d bytes/s but link provides %d bytes/s. Samples will be lost.' %
+                           (odr, needed, bandwidth))
+
+    LOGGER.debug('Watermark %d samples for ODR %g Hz' % (watermark, odr))
+    return watermark
+
+
+class FifoStreamConfig(StreamConfig):
+    """Drains the sample buffer with a macro triggered by watermark interrupt.
+
+    Sensor specific class defines the buffer registers. Watermark level is read from the sensor.
+
+    Attributes:
+        triggers(int): watermark interrupts received
+        samples(int): samples received
+        overflows(int): interrupts where buffer was full
+        lost_samples(int): estimate of samples lost due to overflows or cleared buffer
+    """
+    hdr = "ch!ax!ay!az"
+    reg_buf_cntl1 = None  # define in sensor specific class
+    reg_buf_status_1 = None
+    reg_buf_read = None
+
+    def __init__(self, sensors, pin_index=None, timer=None):
+        if evkit_config.get('stream_timestamp', STREAM_TIMESTAMP_HOST) != STREAM_TIMESTAMP_HOST:
+            LOGGER.warning('Device timestamps not supported with FIFO stream, using host time.')
+        if evkit_config.get('stream_packet_count', 0):
+            LOGGER.warning('Packet counters not supported with FIFO stream, lost samples are estimated from buffer level.')
+        StreamConfig.__init__(self, sensors[0], timestamp=STREAM_TIMESTAMP_HOST, packet_count=0)
+        if timer is not None:
+            raise EvaluationKitException('Timer not supported with FIFO stream.')
+        if self.adapter.engine.version != 2:
+            raise EvaluationKitException('FIFO stream needs firmware protocol version 2.')
+
+        # get pin_index if it is not given
+        if pin_index is None:
+            pin_index = get_drdy_pin_index()
+
+        if self.sensor.get_fifo_resolution() > 0:
+            self.sample_size, self.capacity, fmt = 6, FIFO_CAPACITY_16BIT, '<Bhhh'
+        else:
+            self.sample_size, self.capacity, fmt = 3, FIFO_CAPACITY_8BIT, '<Bbbb'
+
+        self.watermark = self.sensor.read_register(self.reg_buf_cntl1)[0]
+        self.odr = evkit_config.odr
+        self.triggers = 0
+        self.samples = 0
+        self.overflows = 0
+        self.lost_samples = 0
+        self._status_time = None
+        self._level_after_drain = 0
+
+        message = RequestMessageDefinition(self.sensor, fmt=fmt, hdr=self.hdr, reg=self.reg_buf_read, pin_index=pin_index)
+        self._create_macro(message)
+
+    def _create_macro(self, message):
+        protocol = self.adapter.protocol
+        req = protocol.create_macro_req(
+            trigger_type=protocol.EVKIT_MACRO_TYPE_INTR,
+            gpio_pin=message.gpio_pin,
+            gpio_sense=self.sense_dict[self.sensor.resource[CFG_POLARITY]],
+            gpio_pullup=self.pullup_dict[self.sensor.resource[CFG_PULLUP]])
+        self.adapter.send_message(req)
+        _, macro_id = self.adapter.receive_message(wait_for_message=protocol.EVKIT_MSG_CREATE_MACRO_RESP)
+        self.macro_id_list.append(macro_id)
+        self.msg_ind_dict[macro_id] = message
+        message.msg_req.append(req)
+        LOGGER.debug('Macro created with id %d', macro_id)
+
+        spi_mode = 0 if CFG_SAD in self.sensor.resource else 128
+        per_packet = samples_per_packet(self.sample_size)
+        # (register, bytes_to_read, run_count): buffer level followed by watermark amount of samples
+        reads = [(self.reg_buf_status_1, BUF_STATUS_LENGTH, 1)]
+        if self.watermark >= per_packet:
+            reads.append((self.reg_buf_read, per_packet * self.sample_size, self.watermark // per_packet))
+        if self.watermark % per_packet:
+            reads.append((self.reg_buf_read, self.watermark % per_packet * self.sample_size, 1))
+
+        for register, bytes_to_read, run_count in reads:
+            req = protocol.add_macro_action_req(
+                macro_id,
+                action=protocol.EVKIT_MACRO_ACTION_READ,
+                target=self.sensor.resource[CFG_TARGET],
+                identifier=self.sensor.get_identifier(),
+                start_register=register | spi_mode,
+                bytes_to_read=bytes_to_read,
+                append=False,
+                run_count=run_count)
+            self.adapter.send_message(req)
+            self.adapter.receive_message(wait_for_message=protocol.EVKIT_MSG_ADD_MACRO_ACTION_RESP)
+            message.msg_req.append(req)
+            LOGGER.debug(req)
+
+    def _buffer_status(self, status_1, status_2):
+        "Update statistics from buffer level read when watermark interrupt triggered"
+        now = TIMING.time_elapsed()
+        level = (status_1 | (status_2 & BUF_STATUS_2_SMP_LEV_H_MASK) << 8) // self.sample_size
+        self.triggers += 1
+
+        if level >= self.capacity:
+            self.overflows += 1
+            if self._status_time is not None:
+                # samples which sensor produced but could not store to full buffer
+                expected = int(round(self.odr * (now - self._status_time)))
+                self.lost_samples += max(0, expected - (level - self._level_after_drain))
+
+        self._status_time = now
+        self._level_after_drain = max(0, level - self.watermark)
+        if self._level_after_drain >= self.watermark:
+            # interrupt line would stay active and no new trigger would come
+            LOGGER.warning('Sample buffer not drained fast enough. %d samples discarded.' % self._level_after_drain)
+            self.sensor.clear_buffer()
+            self.lost_samples += self._level_after_drain
+            self._level_after_drain = 0
+
+    def statistics(self):
+        return {
+            'triggers': self.triggers,
+            'samples': self.samples,
+            'overflows': self.overflows,
+            'lost_samples': self.lost_samples}
+
+    def read_data_stream(self,
+                         loop=None,
+                         console=True,
+                         log_file_name=None,
+                         callback=None,
+                         max_timeout_count=1,
+                         additional_info=None,
+                         batch=None):
+        """Main loop for reading buffer samples after data streams are activated.
+
+        Arguments are same as in StreamConfig.read_data_stream(). loop counts samples.
+        Batch decoding is not supported.
+        """
+        if batch is not None:
+            raise EvaluationKitException('Batch decoding not supported with FIFO stream.')
+
+        timeout_count = 0  # how many successive timeouts received
+
+        if additional_info is None:
+            additional_info = self.get_log_metadata()
+            additional_info['watermark'] = self.watermark
+
+        self.data_logger = SensorDataLogger(console=console,
+                                            log_file_name=log_file_name,
+                                            additional_info=additional_info)
+
+        self._start_streaming()
+        for channel, request in iter(self.msg_ind_dict.items()):
+            self.data_logger.add_channel(request.msg_hdr, channel,
+                                         fmt=request.msg_fmt, axis_map=request.axis_mapper.axis_map)
+        self.data_logger.start()
+
+        try:
+            while (loop is None) or (self.samples < loop):
+                with DelayedKeyboardInterrupt():
+                    try:
+                        macro_index, resp = self.adapter.receive_message()
+                    except ProtocolTimeoutException:
+                        resp = None
+
+                if resp is None:
+                    LOGGER.debug("Timeout when receiving data")
+                    timeout_count += 1
+                    if max_timeout_count is not None and timeout_count >= max_timeout_count:
+                        raise ProtocolBus1Exception('Timeout when receiving data. Max timeout count reached.')
+                    continue
+
+                timeout_count = 0
+                request = self.msg_ind_dict[macro_index]
+                payload_length = len(resp) - 1
+
+                if payload_length == BUF_STATUS_LENGTH:
+                    self._buffer_status(resp[1], resp[2])
+                    continue
+
+                if payload_length % self.sample_size:
+                    LOGGER.error("Length of received message was wrong (%d)." % len(resp))
+                    continue
+
+                for offset in range(1, len(resp), self.sample_size):
+                    raw = resp[:1] + resp[offset:offset + self.sample_size]
+                    data = request.decode(raw)
+                    self.data_logger.feed_values(data, raw)
+                    self.samples += 1
+
+                    # callback function returns False if need to stop reading
+                    if callback is not None and callback(data) is False:
+                        return
+
+        except KeyboardInterrupt:
+            # CTRL+C will stop data reading
+            pass
+
+        finally:
+            self._stop_streaming()
+            self.data_logger.stop()
+            LOGGER.info('%d samples in %d watermark interrupts, %d overflows, %d samples lost' %
+                        (self.samples, self.triggers, self.overflows, self.lost_samples))
@@ -0,0 +1,561 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Log file writers used by SensorDataLogger.
+
+CSV format (CsvLogWriter):
+    Header lines start with #. Column header line per channel is
+    "# timestamp;<tab>ch;<tab>ax..." followed by one text row per sample.
+    Logs with device timestamps can have host time in second column "host_timestamp".
+
+Binary format (BinaryLogWriter):
+    magic (8 bytes) + header length (uint32 little endian) + json header
+    followed by fixed width little endian records:
+    channel (uint8), timestamp (float64), payload padded to record_size.
+    If header has "host_timestamp" true then host time (float64) follows the timestamp.
+
+    Payload is the raw indication payload when channel has "fmt" defined in the header.
+    In that case "axis_map" is applied when reading the data. Otherwise payload is
+    already decoded values as int32.
+"""
+import json
+import os
+import struct
+import time
+import traceback
+from kx_lib.kx_exception import EvaluationKitException
+from kx_lib.kx_axis_map import axis_tables, axis_mapping
+
+DELIMITER = ';\t'
+NEW_LINE = '\n'
+
+LOG_FORMAT_CSV = 'csv'
+LOG_FORMAT_BINARY = 'binary'
+
+BINARY_MAGIC = b'KXLOGBIN'
+BINARY_VERSION = 1
+RECORD_HEADER = struct.Struct('<Bd')  # channel, timestamp
+RECORD_HEADER_HOST_TIME = struct.Struct('<Bdd')  # channel, device timestamp, host timestamp
+HOST_TIMESTAMP = 'host_timestamp'
+FILE_BUFFER_SIZE = 1024 * 1024
+INDEX_BLOCK_RECORDS = 100000  # records scanned at a time when searching records of a channel
+
+
+# struct module format characters and matching numpy types with standard sizes
+NUMPY_TYPES = {
+    'b': 'i1', 'B': 'u1', '?': 'b1',
+    'h': 'i2', 'H': 'u2',
+    'i': 'i4', 'I': 'u4', 'l': 'i4', 'L': 'u4',
+    'q': 'i8', 'Q': 'u8',
+    'e': 'f2', 'f': 'f4', 'd': 'f8'
+}
+
+
+def struct_format_fields(fmt):
+    """Returns numpy type and byte offset of each value of struct format string.
+
+    Args:
+        fmt(string): struct format string with standard sizes (starting with <, > or !)
+
+    Returns:
+        tuple: list of numpy type strings and list of offsets
+    """
+    if not fmt or fmt[0] not in '<>!':
+        raise EvaluationKitException('Byte order must be defined in format "%s"' % fmt)
+
+    byte_order = '<' if fmt[0] == '<' else '>'
+    formats, offsets = [], []
+    offset = 0
+    repeat = ''
+    for char in fmt[1:]:
+        if char.isdigit():
+            repeat += char
+            continue
+
+        count = int(repeat) if repeat else 1
+        repeat = ''
+        if char == 'x':
+            offset += count
+        elif char in NUMPY_TYPES:
+            item_size = struct.calcsize(fmt[0] + char)
+            for _ in range(count):
+                formats.append(byte_order + NUMPY_TYPES[char])
+                offsets.append(offset)
+                offset += item_size
+        else:
+            raise EvaluationKitException('Format character "%s" not supported' % char)
+
+    return formats, offsets
+
+
+def struct_format_to_dtype(fmt):
+    """Convert struct module format string to numpy structured dtype.
+
+    Fields are named f0, f1, ... Pad bytes are skipped with field offsets.
+
+    Args:
+        fmt(string): struct format string with standard sizes (starting with <, > or !)
+
+    Returns:
+        numpy.dtype
+    """
+    import numpy
+    formats, offsets = struct_format_fields(fmt)
+    names = ['f%d' % ind for ind in range(len(formats))]
+    return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': struct.calcsize(fmt)})
+
+
+def timenow_str():
+    return time.strftime('%Y-%m-%d %H:%M:%S:000')
+
+
+def caller_name():
+    caller = 'NA'
+    try:
+        caller = os.path.split(traceback.extract_stack()[0][0])[1]
+    except BaseException:
+        caller = 'Error'
+    return caller
+
+
+def start_time_str(caller=None, start_time=None):
+    if caller is None:
+        caller = caller_name()
+    if start_time is None:
+        start_time = timenow_str()
+    return '# Log File Format Version = 1.0\n# Stream Configuration File = {}\n# Start time = {}'.format(caller, start_time)
+
+
+def timestamp_header(host_timestamp=False):
+    "Names of timestamp columns in CSV column header"
+    return '# timestamp' + (DELIMITER + HOST_TIMESTAMP if host_timestamp else '')
+
+
+def timestamp_format(host_timestamp=False):
+    "str.format() string of timestamp columns, takes timestamp and host timestamp"
+    return '{0:.6f}' + DELIMITER + ('{1:.6f}' + DELIMITER if host_timestamp else '')
+
+
+def end_time_str(end_time=None):
+    if end_time is None:
+        end_time = timenow_str()
+    return '# End time = ' + end_time
+
+
+class LogWriterBase(object):
+    """Interface of SensorDataLogger log writers.
+
+    Args:
+        file_name(string): log file name
+        metadata(dict): additional information stored to the log, e.g. board_id, firmware_id, odr.
+        host_timestamp(bool): store host time in addition to device timestamp
+    """
+    text_format = False  # True if writer takes lines formatted by SensorDataLogger with write_line()
+
+    def __init__(self, file_name, metadata=None, host_timestamp=False):
+        self.file_name = file_name
+        self.metadata = metadata or {}
+        self.host_timestamp = host_timestamp
+
+    def start(self, channels):
+        """Write log header.
+
+        Args:
+            channels(list): SensorDataLogger channel definitions
+        """
+        raise NotImplementedError()
+
+    def write_values(self, timestamp, data, raw=None, host_timestamp=None):
+        """Write one sample.
+
+        Args:
+            timestamp(float): seconds from start
+            data(list): decoded values, first value is channel number
+            raw(array): raw indication payload if available
+            host_timestamp(float): host time in seconds from start if host_timestamp is enabled
+        """
+        raise NotImplementedError()
+
+    def write_batch(self, timestamps, values, raw=None, host_timestamps=None):
+        """Write multiple samples.
+
+        Args:
+            timestamps(list): N timestamps
+            values(list): N rows of decoded values
+            raw(list): N raw payloads if available
+            host_timestamps(list): N host timestamps if host_timestamp is enabled
+        """
+        raw = raw or [None] * len(values)
+        host_timestamps = host_timestamps or timestamps
+        for timestamp, data, resp, host_timestamp in zip(timestamps, values, raw, host_timestamps):
+            self.write_values(timestamp, data, resp, host_timestamp)
+
+    def stop(self):
+        raise NotImplementedError()
+
+
+class CsvLogWriter(LogWriterBase):
+    text_format = True
+
+    def __init__(self, file_name, metadata=None, host_timestamp=False):
+        LogWriterBase.__init__(self, file_name, metadata, host_timestamp)
+        self.file_handle = open(file_name, 'w')
+        self._time_fmt = timestamp_format(host_timestamp)
+
+    def start(self, channels):
+        header = start_time_str()
+        for key, value in sorted(self.metadata.items()):
+            header += NEW_LINE + '# {} = {}'.format(key, value)
+        for channel in channels:
+            header += NEW_LINE + '%s%s%s' % (timestamp_header(self.host_timestamp), DELIMITER, channel[0].replace('!', DELIMITER))
+        self.file_handle.write(header + NEW_LINE)
+
+    def write_line(self, line):
+        self.file_handle.write(line + NEW_LINE)
+
+    def write_values(self, timestamp, data, raw=None, host_timestamp=None):
+        self.write_line(self._time_fmt.format(timestamp, host_timestamp) + DELIMITER.join('{:d}'.format(t) for t in data))
+
+    def stop(self):
+        self.file_handle.write(end_time_str())
+        self.file_handle.close()
+
+
+class BinaryLogWriter(LogWriterBase):
+    def __init__(self, file_name, metadata=None, host_timestamp=False):
+        LogWriterBase.__init__(self, file_name, metadata, host_timestamp)
+        self.file_handle = open(file_name, 'wb', FILE_BUFFER_SIZE)
+        self.channels = {}  # {channel number: payload struct}
+        self.record = None
+        self.record_header = RECORD_HEADER_HOST_TIME if host_timestamp else RECORD_HEADER
+
+    def start(self, channels):
+        header = {
+            'version': BINARY_VERSION,
+            'stream_configuration': caller_name(),
+            'start_time': timenow_str(),
+            'metadata': self.metadata,
+            'channels': []
+        }
+        if self.host_timestamp:
+            header[HOST_TIMESTAMP] = True
+        record_size = 0
+        for labels, channel_number, _, fmt, axis_map in channels:
+            if fmt is None:
+                # decoded values, first one is channel number
+                payload = struct.Struct('<B' + 'i' * (len(labels.split('!')) - 1))
+            else:
+                payload = struct.Struct(fmt)
+            self.channels[channel_number] = payload
+            record_size = max(record_size, payload.size)
+            header['channels'].append({
+                'channel': channel_number,
+                'hdr': labels,
+                'fmt': fmt,
+                'axis_map': axis_map
+            })
+
+        header['record_size'] = self.record_header.size + record_size
+        self.record = bytearray(header['record_size'])
+        header = json.dumps(header).encode('utf-8')
+        self.file_handle.write(BINARY_MAGIC + struct.pack('<I', len(header)) + header)
+
+    def write_values(self, timestamp, data, raw=None, host_timestamp=None):
+        channel = data[0]
+        record_header = self.record_header
+        if self.host_timestamp:
+            record_header.pack_into(self.record, 0, channel, timestamp, host_timestamp)
+        else:
+            record_header.pack_into(self.record, 0, channel, timestamp)
+        if raw is not None:
+            if len(raw) != self.channels[channel].size:
+                raise EvaluationKitException('Raw payload of channel %d is %d bytes, expected %d' %
+                                             (channel, len(raw), self.channels[channel].size))
+            self.record[record_header.size:record_header.size + len(raw)] = raw
+        else:
+            self.channels[channel].pack_into(self.record, record_header.size, *data)
+        self.file_handle.write(self.record)
+
+    def stop(self):
+        self.file_handle.close()
+
+
+LOG_WRITERS = {
+    LOG_FORMAT_CSV: CsvLogWriter,
+    LOG_FORMAT_BINARY: BinaryLogWriter
+}
+
+LOG_FILE_EXTENSIONS = {
+    LOG_FORMAT_CSV: '.csv',
+    LOG_FORMAT_BINARY: '.bin'
+}
+
+
+def bisect_timestamp(timestamps, value, right=False):
+    """Binary search of sorted timestamps which reads only the visited elements.
+
+    numpy.searchsorted would copy a strided memmap column to memory first.
+
+    Args:
+        timestamps(numpy.ndarray): sorted timestamps, e.g. column of BinaryLogReader records
+        value(float): timestamp to search
+        right(bool): return index after equal timestamps instead of index of the first one
+
+    Returns:
+        int: index where value would be inserted to keep timestamps sorted
+    """
+    low, high = 0, len(timestamps)
+    while low < high:
+        middle = (low + high) // 2
+        if timestamps[middle] < value or (right and timestamps[middle] == value):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def is_binary_log(file_name):
+    with open(file_name, 'rb') as infile:
+        return infile.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+class BinaryLogReader(object):
+    """Reader for BinaryLogWriter files.
+
+    Args:
+        file_name(string): binary log file name
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, 'rb') as infile:
+            if infile.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise EvaluationKitException('%s is not binary log file' % file_name)
+            header_length = struct.unpack('<I', infile.read(4))[0]
+            self.header = json.loads(infile.read(header_length).decode('utf-8'))
+
+        self.data_offset = len(BINARY_MAGIC) + 4 + header_length
+        self.record_size = self.header['record_size']
+        self.host_timestamp = self.header.get(HOST_TIMESTAMP, False)
+        self.record_header = RECORD_HEADER_HOST_TIME if self.host_timestamp else RECORD_HEADER
+        self._channel_indexes = {}  # {channel number: numpy array of record indexes}
+        self.channels = {}  # {channel number: (payload struct, axis mapping function)}
+        for channel in self.header['channels']:
+            if channel['fmt'] is None:
+                payload = struct.Struct('<B' + 'i' * (len(channel['hdr'].split('!')) - 1))
+                map_xyz_axis = axis_mapping(channel['hdr'], None)
+            else:
+                payload = struct.Struct(channel['fmt'])
+                map_xyz_axis = axis_mapping(channel['hdr'], channel['axis_map'])
+            self.channels[channel['channel']] = (payload, map_xyz_axis)
+
+    @property
+    def metadata(self):
+        return self.header['metadata']
+
+    def get_channel(self, channel=None):
+        """Returns header information of channel. Defaults to first channel."""
+        for channel_header in self.header['channels']:
+            if channel is None or channel_header['channel'] == channel:
+                return channel_header
+        raise EvaluationKitException('Channel %s not found from %s' % (channel, self.file_name))
+
+    def last_timestamp(self):
+        if not len(self):
+            return 0.0
+        with open(self.file_name, 'rb') as infile:
+            infile.seek(self.data_offset + (len(self) - 1) * self.record_size)
+            return self.record_header.unpack(infile.read(self.record_header.size))[1]
+
+    def memmap(self, channel=None):
+        """Map records of a channel to numpy structured array without reading the file.
+
+        Record fields are channel, timestamp, host_timestamp if the log has it and
+        payload values f0, f1, ... Axis map is not applied, see read_columns().
+
+        Args:
+            channel(int): channel number. Defaults to first channel.
+
+        Returns:
+            numpy.ndarray: records of given channel
+        """
+        records = self._map_records(self.get_channel(channel))
+        if len(self.channels) > 1:
+            records = records[self.channel_index(channel)]
+        return records
+
+    def channel_index(self, channel=None):
+        """Indexes of the records of a channel among all records. Computed once per channel.
+
+        The file is scanned INDEX_BLOCK_RECORDS records at a time.
+
+        Args:
+            channel(int): channel number. Defaults to first channel.
+
+        Returns:
+            numpy.ndarray: record indexes
+        """
+        import numpy
+        channel_header = self.get_channel(channel)
+        number = channel_header['channel']
+        if number not in self._channel_indexes:
+            channel_numbers = self._map_records(channel_header)['channel']
+            self._channel_indexes[number] = numpy.concatenate(
+                [numpy.flatnonzero(channel_numbers[block:block + INDEX_BLOCK_RECORDS] == number) + block
+                 for block in range(0, len(channel_numbers), INDEX_BLOCK_RECORDS)] or
+                [numpy.empty(0, dtype=numpy.intp)])
+        return self._channel_indexes[number]
+
+    def _map_records(self, channel_header):
+        "All records mapped with payload format of given channel"
+        import numpy
+        fmt = channel_header['fmt']
+        if fmt is None:
+            fmt = '<B' + 'i' * (len(channel_header['hdr'].split('!')) - 1)
+        formats, offsets = struct_format_fields(fmt)
+        names, header_formats, header_offsets = ['channel', 'timestamp'], ['u1', '<f8'], [0, 1]
+        if self.host_timestamp:
+            names.append(HOST_TIMESTAMP)
+            header_formats.append('<f8')
+            header_offsets.append(9)
+        dtype = numpy.dtype({
+            'names': names + ['f%d' % ind for ind in range(len(formats))],
+            'formats': header_formats + formats,
+            'offsets': header_offsets + [offset + self.record_header.size for offset in offsets],
+            'itemsize': self.record_size})
+
+        if not len(self):
+            return numpy.empty(0, dtype=dtype)
+
+        return numpy.memmap(self.file_name, dtype=dtype, mode='r', offset=self.data_offset, shape=(len(self),))
+
+    def read_columns(self, dimensions=None, channel=None, start=None, stop=None):
+        """Read values of selected dimensions and apply axis map.
+
+        Args:
+            dimensions(list): channel names to read. Defaults to all except channel number.
+            channel(int): channel number. Defaults to first channel.
+            start(int): index of first record
+            stop(int): index of end record
+
+        Returns:
+            tuple: numpy array of timestamps and dict of {dimension: numpy array}
+        """
+        channel_header = self.get_channel(channel)
+        if len(self.channels) > 1:
+            # gather only the requested records of the channel
+            records = self._map_records(channel_header)[self.channel_index(channel)[start:stop]]
+        else:
+            records = self.memmap(channel)[start:stop]
+        return records['timestamp'], self._columns(records, channel_header, dimensions)
+
+    def iter_columns(self, dimensions=None, channel=None, start=None, end=None, chunksize=INDEX_BLOCK_RECORDS):
+        """Read values of selected dimensions between two timestamps in chunks and apply axis map.
+
+        Memory use is bounded by chunksize records, the file is neither read nor indexed as whole.
+
+        Args:
+            dimensions(list): channel names to read. Defaults to all except channel number.
+            channel(int): channel number. Defaults to first channel.
+            start(float): timestamp of first sample. Defaults to first sample of the log.
+            end(float): timestamp of last sample. Defaults to last sample of the log.
+            chunksize(int): max records in a chunk
+
+        Yields:
+            tuple: numpy array of sample indexes of the channel, numpy array of timestamps
+                and dict of {dimension: numpy array}
+        """
+        import numpy
+        channel_header = self.get_channel(channel)
+        number = channel_header['channel']
+        records = self._map_records(channel_header)
+
+        if len(self.channels) == 1:
+            timestamps = records['timestamp']
+            first = 0 if start is None else bisect_timestamp(timestamps, start)
+            last = len(records) if end is None else bisect_timestamp(timestamps, end, right=True)
+            for chunk_start in range(first, last, chunksize):
+                chunk = records[chunk_start:min(chunk_start + chunksize, last)]
+                yield (numpy.arange(chunk_start, chunk_start + len(chunk)), chunk['timestamp'],
+                       self._columns(chunk, channel_header, dimensions))
+            return
+
+        sample_index = 0  # samples of the channel before the block
+        for block in range(0, len(records), chunksize):
+            chunk = records[block:block + chunksize]
+            chunk = chunk[chunk['channel'] == number]
+            timestamps = chunk['timestamp']
+            first = 0 if start is None else int(numpy.searchsorted(timestamps, start))
+            last = len(chunk) if end is None else int(numpy.searchsorted(timestamps, end, side='right'))
+            if first < last:
+                yield (numpy.arange(sample_index + first, sample_index + last), timestamps[first:last],
+                       self._columns(chunk[first:last], channel_header, dimensions))
+            if last < len(chunk):
+                break
+            sample_index += len(chunk)
+
+    def _columns(self, records, channel_header, dimensions):
+        "Dimensions of records as {dimension: numpy array} with axis map applied"
+        labels = channel_header['hdr'].split('!')
+        if dimensions is None:
+            dimensions = labels[1:]
+        gather, negate = axis_tables(channel_header['hdr'], channel_header['axis_map'] if channel_header['fmt'] else None)
+
+        columns = {}
+        for dimension in dimensions:
+            if dimension not in labels:
+                raise EvaluationKitException('Dimension "%s" does not exist in the log file "%s"' % (dimension, self.file_name))
+            ind = labels.index(dimension)
+            column = records['f%d' % gather[ind]]
+            if ind in negate:
+                # widen before negation so that negated full scale value fits
+                column = -column.astype('i8' if column.dtype.kind in 'iub' else column.dtype)
+            columns[dimension] = column
+        return columns
+
+    def __len__(self):
+        return (os.path.getsize(self.file_name) - self.data_offset) // self.record_size
+
+    def __iter__(self):
+        """Iterate (timestamp, values) of all samples."""
+        for timestamp, _, values in self.records():
+            yield timestamp, values
+
+    def records(self):
+        """Iterate (timestamp, host timestamp, values) of all samples. Host timestamp is None if log does not have it."""
+        record_header = self.record_header
+        with open(self.file_name, 'rb') as infile:
+            infile.seek(self.data_offset)
+            while True:
+                record = infile.read(self.record_size)
+                if len(record) < self.record_size:
+                    break
+                header = record_header.unpack_from(record)
+                payload, map_xyz_axis = self.channels[header[0]]
+                host_timestamp = header[2] if self.host_timestamp else None
+                yield header[1], host_timestamp, map_xyz_axis(payload.unpack_from(record, record_header.size))
+
+
+def binary_to_csv(binary_file_name, csv_file_name):
+    """Convert binary log to the CSV log layout.
+
+    Args:
+        binary_file_name(string): BinaryLogWriter file
+        csv_file_name(string): CSV file to write
+    """
+    reader = BinaryLogReader(binary_file_name)
+    end_time = time.strftime('%Y-%m-%d %H:%M:%S:000', time.localtime(os.path.getmtime(binary_file_name)))
+
+    with open(csv_file_name, 'w') as outfile:
+        outfile.write(start_time_str(reader.header['stream_configuration'], reader.header['start_time']) + NEW_LINE)
+        for key, value in sorted(reader.metadata.items()):
+            outfile.write('# {} = {}'.format(key, value) + NEW_LINE)
+        for channel in reader.header['channels']:
+            outfile.write('%s%s%s' % (timestamp_header(reader.host_timestamp), DELIMITER,
+                                      channel['hdr'].replace('!', DELIMITER)) + NEW_LINE)
+        time_fmt = timestamp_format(reader.host_timestamp)
+        for timestamp, host_timestamp, data in reader.records():
+            outfile.write(time_fmt.format(timestamp, host_timestamp) + DELIMITER.join('{:d}'.format(t) for t in data) + NEW_LINE)
+        outfile.write(end_time_str(end_time))
+
+    return len(reader)
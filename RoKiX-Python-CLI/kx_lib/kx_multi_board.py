@@ -0,0 +1,325 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Stream data from multiple evaluation boards at the same time.
+
+Every serial port having board matching the board configuration is opened with own
+ConnectionManager. Each board has a reader thread which receives and decodes stream
+indications to a board specific queue. MultiBoardCollector merges the queues to one
+time ordered output where each sample is tagged with board UID.
+"""
+import threading
+from collections import deque
+from serial import SerialException
+from kx_lib.kx_board import ConnectionManager, load_board_config
+from kx_lib.kx_bus2 import KxComPort
+from kx_lib.kx_configuration_enum import BUS2_USB_SERIAL
+from kx_lib.kx_data_logger import TIMING
+from kx_lib.kx_exception import EvaluationKitException, ProtocolException, ProtocolTimeoutException
+from kx_lib.kx_log_writer import CsvLogWriter, DELIMITER, start_time_str, end_time_str
+from kx_lib.kx_util import evkit_config, get_log_file_name
+from kx_lib import kx_logger
+LOGGER = kx_logger.get_logger(__name__)
+
+# LOGGER.setLevel(kx_logger.DEBUG)
+
+BOARD_QUEUE_SIZE = 10000  # max amount of decoded samples queued per board
+MAX_LATENCY = 0.5  # seconds to wait samples from other boards before output
+
+
+def find_serial_ports(board_config_json=None):
+    """Serial ports of all connected evaluation boards supported by the board configuration.
+
+    Args:
+        board_config_json(string): File name of board configuration json file. Defaults to board setting.
+
+    Returns:
+        list: serial port names
+    """
+    board_config = load_board_config(board_config_json or evkit_config.board)
+    for bus2_configuration in board_config['configuration']['bus2']['connections']:
+        if bus2_configuration['connection'] == BUS2_USB_SERIAL:
+            return KxComPort(bus2_configuration=bus2_configuration).get_com_port()
+
+    raise EvaluationKitException('Bus2 %s not found from board configuration.' % BUS2_USB_SERIAL)
+
+
+def open_boards(board_config_json=None, odr=None, ports=None):
+    """Open all boards which match the board configuration.
+
+    Args:
+        board_config_json(string): File name of board configuration json file. Defaults to board setting.
+        odr(int): ODR used to select board power save mode
+        ports(list): serial ports to open. If None then all found serial ports are tried.
+
+    Returns:
+        list: ConnectionManager instance per board
+    """
+    if ports is None:
+        ports = find_serial_ports(board_config_json)
+
+    connection_managers = []
+    for port in ports:
+        try:
+            connection_managers.append(ConnectionManager(board_config_json, odr=odr, serial_port=port))
+            LOGGER.info('Board found from %s' % port)
+        except (EvaluationKitException, SerialException) as exception:
+            LOGGER.info('No board from %s: %s' % (port, exception))
+
+    if not connection_managers:
+        raise EvaluationKitException('Expected evaluation board not found.')
+
+    return connection_managers
+
+
+def board_uid(adapter, default=None):
+    "Board unique hw identifier as text. Protocol v1 boards do not report it and default is returned."
+    if adapter.engine.version != 2:
+        return default
+    if adapter.dev_id:
+        return adapter.dev_id
+    return ':'.join(['%02X' % t for t in adapter.get_dev_id()])
+
+
+class BoardReader(threading.Thread):
+    """Receives and decodes stream indications of one board.
+
+    Args:
+        uid(string): board identifier attached to samples
+        stream_config(StreamConfig): stream definitions of the board
+        condition(threading.Condition): notified when new sample is queued
+        queue_size(int): max amount of queued samples before oldest ones are dropped
+
+    Attributes:
+        received(int): samples received
+        dropped(int): samples dropped due to full queue
+        errors(int): indications with unknown stream or wrong length
+        lost(int): indications lost on the way, if stream_packet_count is enabled
+        timeouts(int): bus2 timeouts
+    """
+
+    def __init__(self, uid, stream_config, condition, queue_size=BOARD_QUEUE_SIZE):
+        threading.Thread.__init__(self, name='BoardReader %s' % uid)
+        self.daemon = True
+        self.uid = uid
+        self.stream_config = stream_config
+        self.samples = deque()  # (timestamp, data, device timestamp or None)
+        self.queue_size = queue_size
+        self._condition = condition
+        self._stop_event = threading.Event()
+        self.error = None
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lost = 0
+        self.timeouts = 0
+        self.start_time = None
+        self.stop_time = None
+
+    def run(self):
+        adapter = self.stream_config.adapter
+        msg_ind_dict = self.stream_config.msg_ind_dict
+        self.start_time = TIMING.time_elapsed()
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    macro_index, resp = adapter.receive_message()
+                except ProtocolTimeoutException:
+                    self.timeouts += 1
+                    continue
+
+                timestamp = TIMING.time_elapsed()
+                request = msg_ind_dict.get(macro_index)
+                if request is None or len(resp) != request.ind_size:
+                    self.errors += 1
+                    continue
+
+                lost, device_time = self.stream_config.decode_appended(macro_index, resp)
+                data = request.decode(resp)
+                with self._condition:
+                    self.lost += lost
+                    if len(self.samples) >= self.queue_size:
+                        self.samples.popleft()
+                        self.dropped += 1
+                    self.samples.append((timestamp, data, device_time))
+                    self.received += 1
+                    self._condition.notify()
+
+        except ProtocolException as exception:
+            LOGGER.error('Board %s reader stopped: %s' % (self.uid, exception))
+            self.error = exception
+
+        finally:
+            self.stop_time = TIMING.time_elapsed()
+            with self._condition:
+                self._condition.notify_all()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def statistics(self):
+        stop_time = self.stop_time if self.stop_time is not None else TIMING.time_elapsed()
+        duration = stop_time - self.start_time if self.start_time is not None else 0
+        result = {
+            'received': self.received,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'lost': self.lost,
+            'timeouts': self.timeouts,
+            'samples_per_second': self.received / duration if duration > 0 else 0.0}
+
+        reader = getattr(self.stream_config.adapter.bus2, 'reader', None)
+        if reader is not None:
+            result['dropped_frames'] = reader.dropped_frames
+
+        return result
+
+
+class MultiBoardCollector(object):
+    """Merge stream data of multiple boards to one time ordered output.
+
+    Samples are timestamped when received and ordered by that host time, because device
+    timestamps of different boards are not comparable. Oldest queued sample is output when every running
+    board has a sample queued, or when the sample is older than max_latency so that one
+    stalled board does not stop the output.
+
+    Args:
+        queue_size(int): max amount of queued samples per board
+        max_latency(float): seconds to wait samples from other boards
+    """
+
+    def __init__(self, queue_size=BOARD_QUEUE_SIZE, max_latency=MAX_LATENCY):
+        self.queue_size = queue_size
+        self.max_latency = max_latency
+        self.readers = []
+        self._condition = threading.Condition()
+
+    def add_stream(self, stream_config, uid=None):
+        """Add data streams of one board. Streams must be defined but not started.
+
+        Args:
+            stream_config(StreamConfig): stream definitions of the board
+            uid(string): board identifier. Defaults to board UID.
+        """
+        if uid is None:
+            uid = board_uid(stream_config.adapter, default='board%d' % len(self.readers))
+        self.readers.append(BoardReader(uid, stream_config, self._condition, self.queue_size))
+
+    def start(self):
+        TIMING.reset()
+        for reader in self.readers:
+            reader.stream_config.start_streaming()
+            reader.start()
+
+    def stop(self):
+        for reader in self.readers:
+            reader.stop()
+
+        for reader in self.readers:
+            reader.join()
+            try:
+                reader.stream_config.stop_streaming()
+            except ProtocolException as exception:
+                LOGGER.error('Board %s stream stop failed: %s' % (reader.uid, exception))
+
+    def _pop_sample(self):
+        "Returns oldest sample which can be output or None"
+        heads = [(reader.samples[0][0], index) for index, reader in enumerate(self.readers) if reader.samples]
+        if not heads:
+            return None
+
+        timestamp, index = min(heads)
+        complete = all(reader.samples or not reader.is_alive() for reader in self.readers)
+        if not complete and timestamp > TIMING.time_elapsed() - self.max_latency:
+            return None
+
+        reader = self.readers[index]
+        timestamp, data, device_time = reader.samples.popleft()
+        return timestamp, reader.uid, data, device_time
+
+    def samples(self):
+        """Time ordered samples of all boards. Ends when all readers are stopped and queues emptied.
+
+        Yields:
+            tuple: (timestamp, board uid, data, device timestamp). Device timestamp is None
+                if stream_timestamp setting is host.
+        """
+        while True:
+            with self._condition:
+                sample = self._pop_sample()
+                while sample is None:
+                    if not any(reader.is_alive() or reader.samples for reader in self.readers):
+                        return
+                    self._condition.wait(self.max_latency / 4)
+                    sample = self._pop_sample()
+            yield sample
+
+    def statistics(self):
+        "Counters per board uid"
+        return dict((reader.uid, reader.statistics()) for reader in self.readers)
+
+    def read(self, loop=None, console=True, log_file_name=None, callback=None):
+        """Stream data from all boards until stopped or loop count reached.
+
+        Args:
+            loop(int/None): Number of samples to read. If None then infinite loop until KeyboardInterrupt is received.
+            console(bool): print values to console
+            log_file_name(string/None): csv log file. If None then name is generated from rokix_settings.cfg.
+            callback(function): called with board uid and data of each sample. Reading stops if it returns False.
+
+        Host time is in the first column. If boards stream device timestamps then they are in the
+        second column "device_timestamp".
+        """
+        if log_file_name is None:
+            log_file_name = get_log_file_name()
+
+        writer = None
+        if log_file_name:
+            writer = CsvLogWriter(log_file_name, {'boards': [reader.uid for reader in self.readers]})
+
+        device_time = any(reader.stream_config.device_clock is not None for reader in self.readers)
+        time_fmt = '{0:.6f}' + DELIMITER + ('{1:.6f}' + DELIMITER if device_time else '')
+        channels = []
+        for reader in self.readers:
+            for request in reader.stream_config.msg_ind_dict.values():
+                labels = ('device_timestamp!' if device_time else '') + 'board!' + request.msg_hdr
+                if labels not in [channel[0] for channel in channels]:
+                    channels.append((labels,))
+
+        if console:
+            print(start_time_str())
+            for channel in channels:
+                print('# timestamp%s%s' % (DELIMITER, channel[0].replace('!', DELIMITER)))
+        if writer is not None:
+            writer.start(channels)
+
+        count = 0
+        self.start()
+        try:
+            for timestamp, uid, data, device_timestamp in self.samples():
+                count += 1
+                line = time_fmt.format(timestamp, device_timestamp) + uid + DELIMITER + \
+                    DELIMITER.join('{:d}'.format(t) for t in data)
+                if console:
+                    print(line)
+                if writer is not None:
+                    writer.write_line(line)
+
+                if callback is not None and callback(uid, data) is False:
+                    break
+                if loop is not None and count >= loop:
+                    break
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            self.stop()
+            if console:
+                print(end_time_str())
+            if writer is not None:
+                writer.stop()
+
+            for uid, counters in sorted(self.statistics().items()):
+                LOGGER.info('Board %s: %d samples, %.1f samples/s, %d dropped, %d lost' % (
+                    uid, counters['received'], counters['samples_per_second'], counters['dropped'], counters['lost']))
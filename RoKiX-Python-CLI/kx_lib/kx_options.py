@@ -5,8 +5,6 @@
 from configparser import ConfigParser
 from argparse import ArgumentParser, ArgumentError
 
-from jsonschema import Draft6Validator
-
 from kx_lib.kx_cfg_schema import CfgSchema
 
 
@@ -74,7 +72,7 @@ class EvkitConfigurations(ArgumentParser):
         else:
             include_sections.extend(self.BASE_SECTIONS)
         self.schema = schema
-        self.arg_validator = Draft6Validator(schema)
+        self._validator = None
         self._schema_properties = self.schema['properties']
 
         self.evkit_config = ConfigParser(
@@ -101,6 +99,14 @@ class EvkitConfigurations(ArgumentParser):
         for option, value in self.evkit_config.items(section):
             self._add_config_arg(option, value)
 
+    @property
+    def arg_validator(self):
+        "jsonschema validator of the schema. Built and cached on first option check."
+        if self._validator is None:
+            from jsonschema import Draft6Validator
+            self._validator = Draft6Validator(self.schema)
+        return self._validator
+
     def _check_option(self, option, value):
         '''
             Maps option to its type as specified in schema, if exists
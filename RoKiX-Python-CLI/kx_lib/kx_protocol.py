@@ -3,7 +3,10 @@
 #
 # pylint: disable=duplicate-code
 from array import array
+from collections import deque
 import struct
+import tempfile
+import threading
 from kx_lib.kx_exception import *  # pylint: disable=unused-wildcard-import,wildcard-import
 from kx_lib.kx_protocol_definition import *  # pylint: disable=unused-wildcard-import,wildcard-import
 from kx_lib.kx_configuration_enum import MAX_PACKET_SIZE
@@ -152,6 +155,10 @@ class KxMessageContainer(object):
         return message
 
 
+# read response: length, type, sad, register, status + register values
+READ_RESP_HEADER_LENGTH = 5
+
+
 def unpack_response_data(message):
     # convert string to list of int8
     LOGGER.debug('Received message : %s' % message)
@@ -217,15 +224,239 @@ def unpack_response_data(message):
     return message_type
 
 
+class KxFrameBuffer(object):
+    """Reassembles protocol messages from a raw byte stream.
+
+    Bytes received from bus2 are appended to one reusable bytearray and all complete
+    messages are split out of it. Each message starts with a length byte which also
+    counts the length byte itself.
+    """
+
+    def __init__(self, compact_limit=4096):
+        self._buffer = bytearray()
+        self._start = 0  # index of first unprocessed byte in self._buffer
+        self._compact_limit = compact_limit
+
+    def __len__(self):
+        return len(self._buffer) - self._start
+
+    def clear(self):
+        del self._buffer[:]
+        self._start = 0
+
+    def feed(self, data):
+        """Append received bytes.
+
+        Args:
+            data (bytes/bytearray/array.array/str): received data. BLE_PYGATT on python 3 returns str.
+        """
+        if not isinstance(data, (bytes, bytearray, array)):
+            data = bytearray(ord(_char) for _char in data)
+        self._buffer.extend(data)
+
+    def has_partial_frame(self):
+        return len(self) > 0
+
+    def bytes_needed(self):
+        "Returns how many bytes are missing from next complete message (at least 1)"
+        available = len(self)
+        if available == 0:
+            return 1
+        return max(self._buffer[self._start] - available, 1)
+
+    def pop_frame(self):
+        """Returns next complete message as array.array or None if no complete message is buffered."""
+        while len(self):
+            message_length = self._buffer[self._start]
+            if message_length < 2:
+                # length must cover at least length byte and message type. Skip the byte to resync.
+                LOGGER.warning('Invalid message length %d received. Byte discarded.' % message_length)
+                self._start += 1
+                continue
+
+            end = self._start + message_length
+            if end > len(self._buffer):
+                break
+
+            message = array('B', self._buffer[self._start:end])
+            self._start = end
+            self._compact()
+            return message
+
+        self._compact()
+        return None
+
+    def pop_frames(self):
+        """Returns list of all complete messages buffered."""
+        messages = []
+        message = self.pop_frame()
+        while message is not None:
+            messages.append(message)
+            message = self.pop_frame()
+        return messages
+
+    def _compact(self):
+        if self._start == len(self._buffer):
+            del self._buffer[:]
+            self._start = 0
+        elif self._start > self._compact_limit:
+            del self._buffer[:self._start]
+            self._start = 0
+
+
+# What to do when message cache is full
+FIFO_POLICY_ERROR = 'error'  # raise ProtocolException
+FIFO_POLICY_DROP_OLDEST = 'drop_oldest'  # discard oldest message from cache
+FIFO_POLICY_SPILL = 'spill'  # store new messages to temporary file
+FIFO_POLICIES = [FIFO_POLICY_ERROR, FIFO_POLICY_DROP_OLDEST, FIFO_POLICY_SPILL]
+
+
+class KxMessageCache(object):
+    """Storage for received messages which were not waited when received.
+
+    Messages are stored in own FIFO per message type. Each macro id has own message
+    type so that indications of different macros are stored separately. Both storing
+    and getting a message of given type are O(1) operations.
+
+    Args:
+        max_size (int): Max amount of messages kept in memory.
+        policy (str): One of FIFO_POLICIES, what to do when cache is full.
+    """
+
+    def __init__(self, max_size=1000, policy=FIFO_POLICY_ERROR):
+        assert policy in FIFO_POLICIES, 'Unknown message cache policy %s' % policy
+        self.max_size = max_size
+        self.policy = policy
+        self.dropped_messages = 0
+        self._queues = {}  # message type : deque of (sequence number, message)
+        self._spilled = {}  # message type : deque of (sequence number, file offset, length)
+        self._spill_file = None
+        self._spill_count = 0
+        self._sequence = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size + self._spill_count
+
+    def put(self, message_type, message):
+        """Store message to the cache.
+
+        Raises:
+            ProtocolException: Cache is full and policy is FIFO_POLICY_ERROR.
+        """
+        with self._lock:
+            self._sequence += 1
+
+            # keep order of the messages once this message type has been spilled to file
+            if self._spilled.get(message_type):
+                self._spill(message_type, message)
+                return
+
+            if self._size >= self.max_size:
+                if self.policy == FIFO_POLICY_ERROR:
+                    raise ProtocolException('Message FIFO full')
+
+                elif self.policy == FIFO_POLICY_DROP_OLDEST:
+                    self._drop_oldest()
+
+                else:  # FIFO_POLICY_SPILL
+                    self._spill(message_type, message)
+                    return
+
+            self._queues.setdefault(message_type, deque()).append((self._sequence, message))
+            self._size += 1
+
+    def get(self, message_type=None):
+        """Remove and return oldest message of given type.
+
+        Args:
+            message_type (int): Message type or macro id. None for oldest message of any type.
+
+        Returns:
+            array or None if there is no such message in the cache.
+        """
+        with self._lock:
+            if message_type is None:
+                message_type = self._oldest_message_type()
+                if message_type is None:
+                    return None
+
+            queue = self._queues.get(message_type)
+            if queue:
+                self._size -= 1
+                return queue.popleft()[1]
+
+            spilled = self._spilled.get(message_type)
+            if spilled:
+                return self._unspill(spilled)
+
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._queues.clear()
+            self._spilled.clear()
+            self._size = 0
+            self._spill_count = 0
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+    def _oldest_message_type(self):
+        oldest_type = None
+        oldest_sequence = None
+        for queues in [self._queues, self._spilled]:
+            for message_type, queue in queues.items():
+                if queue and (oldest_sequence is None or queue[0][0] < oldest_sequence):
+                    oldest_type = message_type
+                    oldest_sequence = queue[0][0]
+        return oldest_type
+
+    def _drop_oldest(self):
+        message_type = self._oldest_message_type()
+        queue = self._queues.get(message_type)
+        if queue:
+            queue.popleft()
+            self._size -= 1
+        else:
+            self._unspill(self._spilled[message_type])
+        self.dropped_messages += 1
+        LOGGER.debug('Message FIFO full, oldest message of type 0x%02x dropped' % message_type)
+
+    def _spill(self, message_type, message):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile()
+            LOGGER.debug('Message FIFO full, spilling messages to temporary file')
+
+        self._spill_file.seek(0, 2)
+        offset = self._spill_file.tell()
+        self._spill_file.write(bytearray(message))
+        self._spilled.setdefault(message_type, deque()).append((self._sequence, offset, len(message)))
+        self._spill_count += 1
+
+    def _unspill(self, spilled):
+        _, offset, length = spilled.popleft()
+        self._spill_file.seek(offset)
+        message = array('B', bytearray(self._spill_file.read(length)))
+        self._spill_count -= 1
+        if self._spill_count == 0:
+            # all spilled messages consumed, reclaim the space
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+        return message
+
+
 class ProtocolEngine(object):
     "Class for sending, receiving and interpreting evaluation kit protocol messages"
 
     def __init__(self, connection):
         "Connection = instance of kx_connection"
         self.connection = connection
-        self.message_fifo = []
+        self.frame_buffer = KxFrameBuffer()
+        self.message_cache = KxMessageCache()
         self.max_retry_count = 2  # max_retry_count
-        self.max_fifo_size = 1000  # max_fifo_size
+        self.max_skip_count = 1000  # max amount of other messages received while waiting for a message
         self.EVKIT_MSG_ERROR_IND = EVKIT_MSG_ERROR_IND  # from kx_protocol_definition
         self.version = 1
 
@@ -256,60 +487,54 @@ class ProtocolEngine(object):
                             is received (default True)
 
         """
-        retry_count = self.max_fifo_size  # max size of FIFO
-
-        # check if wanted message already received and can be found from FIFO
-        if self.message_fifo:  # if len > 0
-            for fifo_index in range(len(self.message_fifo)):
-                received_message = self.message_fifo[fifo_index]
-
-                if wait_for_message is None or \
-                   self.get_message_type(received_message) == wait_for_message:
-                    self.message_fifo.pop(fifo_index)  # remove this message from fifo
-                    return received_message
-
-        # continue to receive new messages if wanted message was not in FIFO
-        while retry_count:
+        # check if wanted message already received and can be found from cache
+        received_message = self.message_cache.get(wait_for_message)
+        if received_message is not None:
+            return received_message
+
+        # continue to receive new messages if wanted message was not in cache
+        skip_count = 0
+        while True:
             received_message = self._receive_single_message()
-            if wait_for_message is None or \
-               self.get_message_type(received_message) == wait_for_message:
+            message_type = self.get_message_type(received_message)
+            if wait_for_message is None or message_type == wait_for_message:
                 return received_message
 
             # not an error message?
-            elif self.get_message_type(received_message) != self.EVKIT_MSG_ERROR_IND:
-                retry_count -= 1
-
-                # store message to FIFO
+            elif message_type != self.EVKIT_MSG_ERROR_IND:
+                # store message to cache
                 if cache_messages:
-                    self.message_fifo.append(received_message)
+                    self.message_cache.put(message_type, received_message)
+                skip_count += 1
+                if skip_count >= self.max_skip_count:
+                    raise ProtocolException('Message 0x%02x not received, %d other messages received (%s)' % (
+                        wait_for_message, skip_count, 'cached' if cache_messages else 'discarded'))
 
             else:
                 # handle error message
-                message_status = ord(received_message[2])
+                message_status = received_message[2]
                 raise ProtocolException('Error message received. Error id %d' % message_status)
 
-        raise ProtocolException('Message FIFO full')
+    def flush(self):
+        """Discard buffered data both from the connection and from the frame buffer."""
+        self.connection.flush()
+        self.frame_buffer.clear()
 
     def _receive_single_message(self):
-        received_message = array('B')
-        partial_message = array('B')
+        if self.connection.reader is not None:
+            # threaded receive mode, messages are already split by the reader thread
+            return self.connection.read_frame()
+
         retry_count = self.max_retry_count
-        # BLE_PYGATT returns strings, windows
-        length_byte = array('B', [ord(self.connection.read(1))])
-        if not length_byte:
-            raise ProtocolTimeoutException('Timeout on message receiving 1.')
-
-        message_length = length_byte[0] - 1  # -1 since length takes 1 byte
-        while retry_count:
-            partial_message = self.connection.read(message_length - len(partial_message))
-            retry_count -= 1
-            if isinstance(partial_message, str):
-                partial_message = [ord(msg_item) for msg_item in partial_message]
-            received_message += array('B', partial_message)
-            if len(partial_message) == message_length:
-                if len(received_message) < 1:
-                    raise ProtocolBus2Exception("No data received.")
-
-                return length_byte + received_message
-
-        raise ProtocolTimeoutException('Timeout on message receiving 2.')
+        while True:
+            received_message = self.frame_buffer.pop_frame()
+            if received_message is not None:
+                return received_message
+
+            if self.frame_buffer.has_partial_frame():
+                if not retry_count:
+                    raise ProtocolTimeoutException('Timeout on message receiving 2.')
+                retry_count -= 1
+
+            # read everything what is already waiting but block until next frame can be completed
+            self.frame_buffer.feed(self.connection.read_available(self.frame_buffer.bytes_needed()))
@@ -486,6 +486,26 @@ def configure_fw_reqest(sleep_mode):
 # response message unpacking
 #
 
+# read response: length, type, status + register values
+READ_RESP_HEADER_LENGTH = 3
+
+# payload bytes of EVKIT_MACRO_ACTION_PKT_COUNT, identifier of the action defines the counter width
+PKT_COUNT_LENGTH = {
+    EVKIT_BITWIDTH_8: 1,
+    EVKIT_BITWIDTH_16: 2,
+    EVKIT_BITWIDTH_32: 4}
+
+# payload bytes of EVKIT_MACRO_ACTION_TIMESTAMP, unsigned little endian counter of time scale units
+TIMESTAMP_LENGTH = 4
+
+# seconds per unit of EVKIT_TIME_SCALE_x
+TIME_SCALE_SECONDS = {
+    EVKIT_TIME_SCALE_US: 1e-6,
+    EVKIT_TIME_SCALE_MS: 1e-3,
+    EVKIT_TIME_SCALE_S: 1.0,
+    EVKIT_TIME_SCALE_M: 60.0,
+    EVKIT_TIME_SCALE_NATIVE: 1.0 / 32768}  # 32.768 kHz RTC tick
+
 
 def unpack_response_data(message):
     # convert string to list of int8
@@ -0,0 +1,170 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+"""Sensor register dumps in text, json and csv format and comparison of two dumps.
+
+Register values are read by SensorDriver.read_register_dump() which uses burst reads.
+"""
+import csv
+import json
+import os
+from kx_lib.kx_exception import EvaluationKitException
+
+DUMP_FORMAT_TEXT = 'text'
+DUMP_FORMAT_JSON = 'json'
+DUMP_FORMAT_CSV = 'csv'
+DUMP_FORMATS = [DUMP_FORMAT_TEXT, DUMP_FORMAT_JSON, DUMP_FORMAT_CSV]
+
+CSV_HEADER = ['address', 'name', 'value']
+
+
+def register_name_index(registers):
+    """Address to name index of register definitions.
+
+    Args:
+        registers(dict): register name -> address. Entries which are not addresses are skipped.
+
+    Returns:
+        dict: address -> name. First defined name is used if many names have same address.
+    """
+    index = {}
+    for name, address in registers.items():
+        if isinstance(address, int) and not name.startswith('_'):
+            index.setdefault(address, name)
+    return index
+
+
+def read_chunks(addresses, max_length):
+    """Split register addresses to burst reads of consecutive registers.
+
+    Args:
+        addresses(list): sorted register addresses
+        max_length(int): max amount of registers in one read
+
+    Returns:
+        list: (start address, length) tuples
+    """
+    chunks = []
+    for address in addresses:
+        if chunks:
+            start, length = chunks[-1]
+            if address == start + length and length < max_length:
+                chunks[-1] = (start, length + 1)
+                continue
+        chunks.append((address, 1))
+    return chunks
+
+
+def dump_format(file_name):
+    "Dump format matching file name extension. Text format is used for unknown extensions."
+    extension = os.path.splitext(file_name)[1].lstrip('.').lower()
+    return extension if extension in DUMP_FORMATS else DUMP_FORMAT_TEXT
+
+
+class RegisterDump(object):
+    """Register values of one sensor.
+
+    Args:
+        values(dict): register address -> value
+        names(dict): register address -> name
+        sensor(string): sensor name
+    """
+
+    def __init__(self, values, names=None, sensor=None):
+        self.values = dict(values)
+        self.names = names or {}
+        self.sensor = sensor
+
+    def name(self, address):
+        return self.names.get(address, '')
+
+    def to_text(self):
+        return '\n'.join('{:03d}\t0x{:02x}\t{:20s}\t0x{:02x}\t0b{:08b}\t{:03d}'.format(
+            address, address, self.name(address), value, value, value)
+            for address, value in sorted(self.values.items()))
+
+    def to_json(self):
+        return json.dumps({
+            'sensor': self.sensor,
+            'registers': [{'address': address, 'name': self.name(address), 'value': value}
+                          for address, value in sorted(self.values.items())]
+        }, indent=4)
+
+    def to_csv(self):
+        lines = [','.join(CSV_HEADER)]
+        for address, value in sorted(self.values.items()):
+            lines.append('0x%02x,%s,0x%02x' % (address, self.name(address), value))
+        return '\n'.join(lines) + '\n'
+
+    def format(self, fmt=DUMP_FORMAT_TEXT):
+        if fmt == DUMP_FORMAT_JSON:
+            return self.to_json()
+        elif fmt == DUMP_FORMAT_CSV:
+            return self.to_csv()
+        elif fmt == DUMP_FORMAT_TEXT:
+            return self.to_text()
+        raise EvaluationKitException('Unknown register dump format %s' % fmt)
+
+    def save(self, file_name, fmt=None):
+        """Write dump to file.
+
+        Args:
+            file_name(string): output file name
+            fmt(string): one of DUMP_FORMATS. Defaults to format matching file name extension.
+        """
+        with open(file_name, 'w') as out_file:
+            out_file.write(self.format(fmt or dump_format(file_name)))
+
+    @classmethod
+    def load(cls, file_name):
+        """Read dump saved in json or csv format.
+
+        Args:
+            file_name(string): dump file name
+
+        Returns:
+            RegisterDump: loaded dump
+        """
+        fmt = dump_format(file_name)
+        with open(file_name, 'r') as in_file:
+            if fmt == DUMP_FORMAT_JSON:
+                content = json.load(in_file)
+                rows = [(t['address'], t['name'], t['value']) for t in content['registers']]
+                sensor = content.get('sensor')
+            elif fmt == DUMP_FORMAT_CSV:
+                reader = csv.reader(in_file)
+                if next(reader, None) != CSV_HEADER:
+                    raise EvaluationKitException('%s is not a register dump file' % file_name)
+                rows = [(int(t[0], 0), t[1], int(t[2], 0)) for t in reader if t]
+                sensor = None
+            else:
+                raise EvaluationKitException('Register dump must be json or csv file: %s' % file_name)
+
+        return cls(dict((t[0], t[2]) for t in rows), dict((t[0], t[1]) for t in rows), sensor)
+
+    def diff(self, other):
+        """Compare register values with other dump.
+
+        Args:
+            other(RegisterDump): dump to compare with
+
+        Returns:
+            list: (address, name, value, other value) of differing registers. Value is None if
+                register is missing from the dump.
+        """
+        differences = []
+        for address in sorted(set(self.values) | set(other.values)):
+            value = self.values.get(address)
+            other_value = other.values.get(address)
+            if value != other_value:
+                differences.append((address, self.name(address) or other.name(address), value, other_value))
+        return differences
+
+
+def format_diff(differences):
+    "Printable text of RegisterDump.diff() result"
+    def hex_value(value):
+        return '  --' if value is None else '0x{:02x}'.format(value)
+
+    return '\n'.join('0x{:02x}\t{:20s}\t{}\t{}'.format(address, name, hex_value(value), hex_value(other_value))
+                     for address, name, value, other_value in differences)
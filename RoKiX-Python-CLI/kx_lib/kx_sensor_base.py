@@ -2,9 +2,13 @@
 # Copyright 2020 Rohm Semiconductor
 #
 import time
+from array import array
+from collections import OrderedDict
 from kx_lib.kx_exception import ProtocolTimeoutException, FunctionalityNotInDevice
-from kx_lib.kx_configuration_enum import BUS1_I2C, BUS1_SPI, CFG_SAD, CFG_CS, CFG_POLARITY, EVKIT_GPIO_PIN_SENSE_HIGH, EVKIT_GPIO_PIN_SENSE_LOW, SENSOR_TYPE_DIGITAL_3D, CH_ACC, CFG_AXIS_MAP, ADAPTER_GPIO1_INT, ADAPTER_GPIO2_INT, TIMER_POLL, REG_POLL
+from kx_lib.kx_configuration_enum import BUS1_I2C, BUS1_SPI, CFG_SAD, CFG_CS, CFG_POLARITY, EVKIT_GPIO_PIN_SENSE_HIGH, EVKIT_GPIO_PIN_SENSE_LOW, SENSOR_TYPE_DIGITAL_3D, CH_ACC, CFG_AXIS_MAP, ADAPTER_GPIO1_INT, ADAPTER_GPIO2_INT, MACRO_GPIO1_INT, MACRO_GPIO2_INT, TIMER_POLL, REG_POLL
 from kx_lib.kx_util import evkit_config, get_timer
+from kx_lib.kx_register_dump import RegisterDump, register_name_index, read_chunks
+from kx_lib.kx_axis_map import axis_tables, axis_mapping
 import kx_lib.kx_logger as kx_logger
 LOGGER = kx_logger.get_logger(__name__)
 # LOGGER.setLevel(kx_logger.INFO)
@@ -36,6 +40,9 @@ class AxisMapper(object):
                  [3,4,5] maps -x,-y,-z
                  [0,1,5] maps x,y,-z
         """
+        self.channel_header = channel_header
+        self._mappings = {}  # {sample length: mapping function}
+        self._batch_tables = {}  # {sample length: (xyz columns, source columns, negated columns)}
         # header and map is not defined if no 3d data
         if not axis_map:  # empty list or None etc...
             self.axis_map = None
@@ -47,6 +54,24 @@ class AxisMapper(object):
         else:
             self.axis_map = axis_map
 
+    def index_table(self, length):
+        """Index and sign table of the mapping.
+
+        Args:
+            length(int): amount of values in a sample
+
+        Returns:
+            tuple: list of value indexes where each value is taken from and list of negated value indexes
+        """
+        return axis_tables(self.channel_header, self.axis_map, length)
+
+    def mapping(self, length):
+        "Precompiled function doing map_xyz_axis for samples of given length"
+        mapping = self._mappings.get(length)
+        if mapping is None:
+            mapping = self._mappings[length] = axis_mapping(self.channel_header, self.axis_map, length)
+        return mapping
+
     def map_xyz_axis(self, measurement):
         """ Conver measurement to match wanted sensor axis directions.
 
@@ -56,32 +81,119 @@ class AxisMapper(object):
         Args:
             measurement (list) : full data from channel
 
+        Returns:
+            tuple: mapped data. measurement as is if there is no mapping.
         """
         # is this 3d sensor data
         if self.axis_map is None:
             return measurement
 
-        # covert tuple to list
-        measurement = list(measurement)
-
-        # get xyz data values from full data
-        xyz_data = [measurement[ind] for ind in self.xyz_ind]
-
-        # make list of xyz data + negated xyz data
-        xyz_data_extended = xyz_data + [-value for value in xyz_data]
+        return self.mapping(len(measurement))(measurement)
 
-        # make mapping for extended xyz data (e.g. update location and sign)
-        xyz_mapped = [xyz_data_extended[ind] for ind in self.axis_map]
+    def map_xyz_axis_batch(self, values):
+        """Map xyz axis of multiple samples in place.
 
-        # apply mapped data back to raw data
-        for xyz_data_ind, measurement_data_ind in enumerate(self.xyz_ind):
-            measurement[measurement_data_ind] = xyz_mapped[xyz_data_ind]
+        Args:
+            values(numpy.ndarray): (N, k) array of N samples. Data type must be able to hold negated values.
 
-        return measurement
+        Returns:
+            numpy.ndarray: values
+        """
+        if self.axis_map is None:
+            return values
+
+        length = values.shape[1]
+        tables = self._batch_tables.get(length)
+        if tables is None:
+            gather, negate = self.index_table(length)
+            columns = [ind for ind in range(length) if gather[ind] != ind]
+            tables = self._batch_tables[length] = (columns, [gather[ind] for ind in columns], negate)
+
+        columns, sources, negate = tables
+        if columns:
+            values[:, columns] = values[:, sources]
+        if negate:
+            values[:, negate] *= -1
+        return values
+
+
+class RegisterShadow(object):
+    """Last known values of sensor configuration registers.
+
+    Args:
+        registers(list): addresses of registers which can be cached. Registers which hardware
+            changes or which have side effects on read must not be listed.
+
+    Attributes:
+        hits(int): reads served from shadow
+        misses(int): reads which needed sensor access
+    """
+
+    def __init__(self, registers):
+        self.registers = set(registers)
+        self.values = {}  # {register address: value}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, register, length=1):
+        """Returns cached values as array or None if any of the registers is not cached."""
+        values = [self.values.get(reg) for reg in range(register, register + length)]
+        if None in values:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return array('B', values)
+
+    def update(self, register, values):
+        """Store values read from or written to consecutive registers starting from register."""
+        if isinstance(values, int):
+            values = [values]
+        for reg, value in enumerate(values, register):
+            if reg in self.registers:
+                self.values[reg] = value & 0xff
+
+    def forget(self, register, length=1):
+        for reg in range(register, register + length):
+            self.values.pop(reg, None)
+
+    def invalidate(self):
+        self.values.clear()
+
+
+class RegisterBatch(object):
+    """Context manager which defers register writes of sensor until the with-block ends.
+
+    Batches can be nested, writes are sent when outermost batch ends. If the with-block
+    raises an exception, pending writes are discarded.
+    """
+
+    def __init__(self, sensor):
+        self.sensor = sensor
+
+    def __enter__(self):
+        if self.sensor._batch_depth == 0:
+            self.sensor._pending_writes = OrderedDict()
+        self.sensor._batch_depth += 1
+        return self.sensor
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.sensor._batch_depth -= 1
+        if self.sensor._batch_depth == 0:
+            if exc_type is None:
+                self.sensor.flush_writes()
+            elif self.sensor._pending_writes:
+                LOGGER.warning('%d pending register writes discarded' % len(self.sensor._pending_writes))
+            self.sensor._pending_writes = None
+        return False
 
 
 class SensorDriver(object):
     supported_parts = ['undefined']  # define names of sensor parts which are supported by the driver
+    _volatile_registers = []  # define in driver: registers which hardware changes or which have side effects on read
+    _barrier_registers = []  # define in driver: registers which must be written in program order, e.g. operating mode
+    _burst_write = False  # True if sensor supports auto-increment writes over its whole register table
+    _macro_read_registers = None  # define in driver: (first register, length) read by interrupt macro in MACRO_GPIO modes
 
     def __init__(self):
 
@@ -109,6 +221,12 @@ class SensorDriver(object):
         self.poll_delay_s_other = evkit_config.other_timer_interval
         self.axis_mapper = None
         self.selected_connectivity = None
+        self._shadow = None  # RegisterShadow instance when register shadow is enabled
+        self._pending_writes = None  # OrderedDict {register: value} in order of first write when writes are batched
+        self._batch_depth = 0
+        self._register_names = None  # (_registers, address -> name index)
+        self._macro_pollers = {}  # {pin: MacroPoller} when MACRO_GPIO1_INT / MACRO_GPIO2_INT is used
+        self._macro_data = {}  # {register: value} read by interrupt macro and not yet consumed
 
         # to be fixed later
         self.channel_header = 'ax!ay!az'  # define in driver
@@ -119,6 +237,8 @@ class SensorDriver(object):
             REG_POLL: self._poll_drdy_register,
             ADAPTER_GPIO1_INT: self._poll_gpio_line1,
             ADAPTER_GPIO2_INT: self._poll_gpio_line2,
+            MACRO_GPIO1_INT: self._poll_macro_line1,
+            MACRO_GPIO2_INT: self._poll_macro_line2,
         }
 
         # Drdy function mode
@@ -173,10 +293,161 @@ class SensorDriver(object):
             channel_header=self.channel_header,
             axis_map=self.resource[CFG_AXIS_MAP])
 
+    def enable_register_shadow(self, enabled=True):
+        """Serve reads of configuration registers from last written or read values.
+
+        Makes read-modify-write operations like set_bit() cost only the register write.
+        Registers listed in _volatile_registers are always read from the sensor.
+        Sensor must be probed before enabling.
+
+        Args:
+            enabled(bool): enable or disable the register shadow
+        """
+        if not enabled:
+            self._shadow = None
+            return
+
+        if not self._registers:
+            LOGGER.warning('Register table of %s not available. Register shadow not enabled.' % self.name)
+            return
+
+        volatile = set(self._volatile_registers)
+        self._shadow = RegisterShadow([reg for reg in self._registers.values() if reg not in volatile])
+
+    def invalidate_register_shadow(self):
+        "Forget all shadowed register values. Must be called when sensor registers are reset."
+        if self._shadow is not None:
+            self._shadow.invalidate()
+
+    def verify(self):
+        """Read shadowed registers from sensor and re-sync the register shadow.
+
+        Returns:
+            list: (register, shadow value, sensor value) of registers which were out of sync
+        """
+        if self._shadow is None:
+            return []
+
+        mismatches = []
+        registers = sorted(self._shadow.values)
+        while registers:
+            # read consecutive registers with one burst read
+            start = registers[0]
+            length = 1
+            while length < len(registers) and registers[length] == start + length:
+                length += 1
+            del registers[:length]
+
+            values = self.connection_manager.read_sensor_register(self, start, length)
+            for reg, value in enumerate(values, start):
+                if self._shadow.values[reg] != value:
+                    mismatches.append((reg, self._shadow.values[reg], value))
+            self._shadow.update(start, values)
+
+        for reg, shadow_value, value in mismatches:
+            LOGGER.warning('Register 0x%02x shadow value 0x%02x, sensor value 0x%02x' % (reg, shadow_value, value))
+
+        return mismatches
+
+    def batch(self):
+        """Collect register writes and send them as few messages as possible.
+
+        Repeated writes to same register are coalesced to the place of its first write and
+        registers written one after the other in address order are merged to auto-increment
+        writes if the sensor supports it. Pending writes are sent in program order. Writes to
+        barrier and volatile registers are done right away after pending writes. Reads of
+        pending registers return the pending values.
+
+        Example:
+            with sensor.batch():
+                sensor.set_range(...)
+                sensor.set_odr(...)
+        """
+        return RegisterBatch(self)
+
+    def flush_writes(self):
+        "Send pending batched register writes"
+        if not self._pending_writes:
+            return
+
+        pending = self._pending_writes
+        self._pending_writes = OrderedDict()
+        writes = self._coalesce_writes(pending)
+        LOGGER.debug('%d register writes sent in %d messages' % (len(pending), len(writes)))
+        self._write_registers(writes)
+
+    def _coalesce_writes(self, pending):
+        """Merge pending {register: value} to list of (register, values) writes.
+        Register is merged only to the write just before it, so write order is not changed."""
+        max_length = 1
+        if self._burst_write:
+            max_length = self.connection_manager.kx_adapter.max_write_length()
+        mergeable = set(self._registers.values()) - set(self._volatile_registers)
+
+        writes = []
+        for register in pending:
+            if writes and register in mergeable \
+                    and writes[-1][0] in mergeable \
+                    and register == writes[-1][0] + len(writes[-1][1]) \
+                    and len(writes[-1][1]) < max_length:
+                writes[-1][1].append(pending[register])
+            else:
+                writes.append((register, [pending[register]]))
+
+        return [(register, values[0] if len(values) == 1 else values) for register, values in writes]
+
+    def _is_deferred(self, register):
+        "True if write to register can be left pending"
+        if self._pending_writes is None:
+            return False
+        if register in self._barrier_registers or register in self._volatile_registers:
+            self.flush_writes()
+            return False
+        return True
+
     def write_register(self, register, data):
         assert self.connected
+        if self._is_deferred(register):
+            LOGGER.debug('0x%02x=%s deferred' % (register, data))
+            for reg, value in enumerate([data] if isinstance(data, int) else data, register):
+                self._pending_writes[reg] = value
+            return
+
         LOGGER.debug('0x%02x=%s' % (register, data))
+        if self._shadow is None:
+            self.connection_manager.write_sensor_register(self, register, data)
+            return
+
+        # register state is unknown if write fails
+        self._shadow.forget(register, 1 if isinstance(data, int) else len(data))
         self.connection_manager.write_sensor_register(self, register, data)
+        self._shadow.update(register, data)
+
+    def write_registers(self, writes):
+        """Write multiple registers pipelined.
+
+        Args:
+            writes(list): (register, data) tuples in write order
+        """
+        assert self.connected
+        if self._pending_writes is not None:
+            for register, data in writes:
+                self.write_register(register, data)
+            return
+
+        self._write_registers(writes)
+
+    def _write_registers(self, writes):
+        LOGGER.debug(', '.join('0x%02x=%s' % (register, data) for register, data in writes))
+        if self._shadow is None:
+            self.connection_manager.write_sensor_registers(self, writes)
+            return
+
+        for register, data in writes:
+            self._shadow.forget(register, 1 if isinstance(data, int) else len(data))
+        self.connection_manager.write_sensor_registers(self, writes)
+        for register, data in writes:
+            self._shadow.update(register, data)
 
     def set_bit(self, register, bit):
         """Set the specified bits in a register."""
@@ -193,7 +464,32 @@ class SensorDriver(object):
 
     def read_register(self, register, length=1):
         assert self.connected
-        return self.connection_manager.read_sensor_register(self, register, length)
+        if self._pending_writes:
+            pending = [self._pending_writes.get(reg) for reg in range(register, register + length)]
+            if None not in pending:
+                return array('B', pending)
+            elif pending.count(None) < length:
+                # partially pending range
+                self.flush_writes()
+
+        if self._macro_data:
+            values = [self._macro_data.get(reg) for reg in range(register, register + length)]
+            if None not in values:
+                # each value read by macro is used once
+                for reg in range(register, register + length):
+                    del self._macro_data[reg]
+                return array('B', values)
+            elif values.count(None) < length:
+                self._macro_data = {}
+
+        if self._shadow is None:
+            return self.connection_manager.read_sensor_register(self, register, length)
+
+        values = self._shadow.get(register, length)
+        if values is None:
+            values = self.connection_manager.read_sensor_register(self, register, length)
+            self._shadow.update(register, values)
+        return values
 
     def set_range(self, range, channel):
         raise NotImplementedError()
@@ -265,6 +561,46 @@ class SensorDriver(object):
             self.resource[CFG_POLARITY] == EVKIT_GPIO_PIN_SENSE_HIGH,
             timeout=timeout)
 
+    def _poll_macro_line1(self, timeout=5.0):
+        return self.macro_poll(1, timeout)
+
+    def _poll_macro_line2(self, timeout=5.0):
+        return self.macro_poll(2, timeout)
+
+    def macro_poll(self, pin, timeout):
+        """Wait for interrupt with evaluation board firmware macro.
+
+        Macro is created on first call. It reads _macro_read_registers when the interrupt line
+        activates and following read_register() calls of those registers return the read values.
+
+        Args:
+            pin (int): Logical sensor pin to wait.
+            timeout (float): Timeout in seconds.
+
+        Returns:
+            bool: True when interrupt was received.
+        """
+        if self._macro_read_registers is None:
+            raise FunctionalityNotInDevice('Macro based interrupt polling not supported by %s' % self.name)
+
+        poller = self._macro_pollers.get(pin)
+        if poller is None:
+            # kx_data_stream imports this module
+            from kx_lib.kx_data_stream import MacroPoller
+            self.flush_writes()
+            poller = self._macro_pollers[pin] = MacroPoller(self, pin, *self._macro_read_registers)
+
+        values = poller.wait(timeout)
+        self._macro_data = dict(enumerate(values, poller.reg))
+        return True
+
+    def stop_macro_poll(self):
+        "Remove interrupt macros created by macro_poll()"
+        for poller in self._macro_pollers.values():
+            poller.stop()
+        self._macro_pollers = {}
+        self._macro_data = {}
+
     def bus_poll_gpio(self, pin, polarity, timeout):
         """Wait for GPIO line change.
 
@@ -332,18 +668,37 @@ class SensorDriver(object):
         Printout values from registers in reglist.
         :param reglist: list of registers
         """
-        k = list(self._registers.keys())
-        v = list(self._registers.values())
-        for reg in reglist:
-            try:
-                i = v.index(reg)
-            except ValueError:
-                continue
-            name = k[i]
-            name = name.ljust(20)
-            d = self.read_register(reg)[0]
-            #print ('0x{:02x}\t{:10s}\t0x{:02x}\t0b{:08b}\t{:03d}'.format(reg, name, d, d, d))
-            print('{:03d}\t0x{:02x}\t{:10s}\t0x{:02x}\t0b{:08b}\t{:03d}'.format(reg, reg, name, d, d, d))
+        print(self.read_register_dump(reglist).to_text())
+
+    def register_name_index(self):
+        "Address to register name index. Built once per register definitions."
+        if self._register_names is None or self._register_names[0] is not self._registers:
+            self._register_names = (self._registers, register_name_index(self._registers))
+        return self._register_names[1]
+
+    def read_register_dump(self, reglist=None):
+        """Read defined registers from sensor with burst reads.
+
+        Args:
+            reglist(list): register addresses. Defaults to registers in _dump_range.
+
+        Returns:
+            RegisterDump: register values. Addresses without register definition are skipped.
+        """
+        assert self.connected
+        names = self.register_name_index()
+        if reglist is None:
+            startreg, endreg = self._dump_range
+            reglist = range(startreg, endreg + 1)
+        addresses = sorted(set(reg for reg in reglist if reg in names))
+
+        self.flush_writes()
+        values = {}
+        for start, length in read_chunks(addresses, self.connection_manager.kx_adapter.max_read_length()):
+            data = self.connection_manager.read_sensor_register(self, start, length)
+            values.update(enumerate(data, start))
+
+        return RegisterDump(values, names, self.name)
 
 
 class AnalogSensorDriver(SensorDriver):
@@ -96,7 +96,7 @@ def get_datalogger_config():
     return evkit_config
 
 
-def get_log_file_name():
+def get_log_file_name(default_extension='.csv'):
     # find next available file name
     if evkit_config.has_option('log_file'):
         fname = evkit_config.log_file
@@ -106,7 +106,7 @@ def get_log_file_name():
         fname = evkit_config.filename
         name, extension = os.path.splitext(fname)
         if not extension:
-            extension = '.csv'
+            extension = default_extension
         fname = name + extension
         i = 0
         while True:
@@ -174,9 +174,9 @@ def bin2uint8(data):
 def get_drdy_pin_index():
     "Returns 1 if drdy_function_mode == 'ADAPTER_GPIO1_INT' and 2 if it is ADAPTER_GPIO2_INT "
     drdy = evkit_config.drdy_function_mode
-    if drdy == ADAPTER_GPIO1_INT:
+    if drdy in [ADAPTER_GPIO1_INT, MACRO_GPIO1_INT]:
         pin_index = 1
-    elif drdy == ADAPTER_GPIO2_INT:
+    elif drdy in [ADAPTER_GPIO2_INT, MACRO_GPIO2_INT]:
         pin_index = 2
     elif drdy == TIMER_POLL:
         pin_index = None
@@ -204,9 +204,9 @@ def get_other_timer():
 def get_other_pin_index():
     "Returns 1 if other_function_mode == 'ADAPTER_GPIO1_INT' and 2 if it is ADAPTER_GPIO2_INT "
     other_f = evkit_config.other_function_mode
-    if other_f == ADAPTER_GPIO1_INT:
+    if other_f in [ADAPTER_GPIO1_INT, MACRO_GPIO1_INT]:
         pin_index = 1
-    elif other_f == ADAPTER_GPIO2_INT:
+    elif other_f in [ADAPTER_GPIO2_INT, MACRO_GPIO2_INT]:
         pin_index = 2
     elif other_f == TIMER_POLL:
         pin_index = None
@@ -27,7 +27,7 @@ import imports  # pylint: disable=unused-import
 from kx_lib import kx_logger
 from kx_lib.kx_data_stream import StreamConfig
 from kx_lib.kx_util import get_drdy_pin_index, get_drdy_timer, evkit_config, convert_to_enumkey
-from kx_lib.kx_configuration_enum import POLARITY_DICT, CFG_POLARITY, ADAPTER_GPIO1_INT, REG_POLL
+from kx_lib.kx_configuration_enum import POLARITY_DICT, CFG_POLARITY, ADAPTER_GPIO1_INT, MACRO_GPIO1_INT, REG_POLL
 from kx_lib.kx_data_logger import SingleChannelReader
 from kxtj3.kxtj3_driver import KXTJ3Driver, r, b, e
 
@@ -116,7 +116,7 @@ def enable_data_logging(sensor,
 
     _intpin = 0
     if int_number is None:
-        if evkit_config.drdy_function_mode == ADAPTER_GPIO1_INT:
+        if evkit_config.drdy_function_mode in [ADAPTER_GPIO1_INT, MACRO_GPIO1_INT]:
             _intpin = 1
 
         elif evkit_config.drdy_function_mode == REG_POLL:
@@ -44,6 +44,14 @@ hz = [12.5, 25.0, 50.0, 100.0, 200.0, 400.0,
 class KXTJ3Driver(SensorDriver):
     supported_parts = ['KXTJ3']
     _WAI = [b.KXTJ3_WHO_AM_I_WIA_ID, b.KXCJC_WHO_AM_I_WIA_ID]  # KXTJ3,KXCJC
+    # registers which hardware changes or which have side effects on read. Not cached in register shadow.
+    # CTRL_REG2 has self clearing SRST and DCST bits.
+    _volatile_registers = [
+        r.KXTJ3_XOUT_L, r.KXTJ3_XOUT_H, r.KXTJ3_YOUT_L, r.KXTJ3_YOUT_H, r.KXTJ3_ZOUT_L, r.KXTJ3_ZOUT_H,
+        r.KXTJ3_DCST_RESP, r.KXTJ3_INT_SOURCE1, r.KXTJ3_INT_SOURCE2, r.KXTJ3_STATUS_REG, r.KXTJ3_INT_REL,
+        r.KXTJ3_CTRL_REG2]
+    # accelerometer outputs are read by interrupt macro in MACRO_GPIO modes
+    _macro_read_registers = (r.KXTJ3_XOUT_L, 6)
 
     def __init__(self):
         SensorDriver.__init__(self)
@@ -84,6 +92,7 @@ class KXTJ3Driver(SensorDriver):
     def por(self):
         self.set_bit(r.KXTJ3_CTRL_REG2, b.KXTJ3_CTRL_REG2_SRST)
         delay_seconds(1)
+        self.invalidate_register_shadow()
         LOGGER.debug("POR done")
 
     def set_power_on(self, channel=CH_ACC):
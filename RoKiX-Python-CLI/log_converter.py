@@ -0,0 +1,30 @@
+#
+# Copyright 2020 Rohm Semiconductor
+#
+import argparse
+import os
+from kx_lib.kx_log_writer import binary_to_csv
+
+
+def main():
+    # convert binary log to csv log
+    # >python log_converter.py log.bin
+
+    # convert to given file
+    # >python log_converter.py log.bin -o converted.csv
+
+    parser = argparse.ArgumentParser(description='Convert RoKiX binary log to csv log. Example: %(prog)s log.bin')
+    parser.add_argument('-o', '--output', default=None, help='Output csv file name (default: input file name with .csv extension)')
+    parser.add_argument('fname', type=str, help='binary log file name')
+    kwargs = parser.parse_args()
+
+    output = kwargs.output
+    if output is None:
+        output = os.path.splitext(kwargs.fname)[0] + '.csv'
+
+    count = binary_to_csv(kwargs.fname, output)
+    print('%d samples written to %s' % (count, output))
+
+
+if __name__ == '__main__':
+    main()
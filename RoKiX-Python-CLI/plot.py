@@ -2,11 +2,14 @@
 # Copyright 2020 Rohm Semiconductor
 #
 import argparse
+import mmap
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import logging
 from logging import INFO, DEBUG, WARNING, ERROR  # pylint: disable=unused-import
+from kx_lib.kx_exception import EvaluationKitException
+from kx_lib.kx_log_writer import BinaryLogReader, is_binary_log, HOST_TIMESTAMP
 
 
 def get_logger(name):
@@ -19,6 +22,7 @@ LOGGER = get_logger(__name__)
 
 COLUMN_SEPARATOR = ';'
 ROW_COMMENT = '#'
+CHUNK_SIZE = 100000  # samples read at a time
 kwargs = None
 
 
@@ -26,20 +30,31 @@ class PlotterException(Exception):
     pass
 
 
+def open_log(fname):
+    # memory map the log so that only accessed parts of the file are read
+    with open(fname, 'rb') as infile:
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 def get_header(fname):
     #
     # parse meta data from headers
     #
     global kwargs  # pylint: disable=global-statement
-    header = None
 
-    with open(fname) as infile:
-        for line in infile:
-            if not line.startswith(ROW_COMMENT):
-                break
-            if line.startswith('# timestamp'):
-                header = [t.strip() for t in line.split(kwargs.column_separator)]
-                return header
+    if is_binary_log(fname):
+        channel = BinaryLogReader(fname).get_channel()
+        return ['# timestamp'] + channel['hdr'].split('!')
+
+    log = open_log(fname)
+    try:
+        line = log.readline()
+        while line.startswith(ROW_COMMENT.encode()):
+            if line.startswith(b'# timestamp'):
+                return [t.strip() for t in line.decode().split(kwargs.column_separator)]
+            line = log.readline()
+    finally:
+        log.close()
 
     LOGGER.error('No header found from log file. Defining channel names with --column_header keyword argument could fix the problem.')
     raise PlotterException('No header found from log file.')
@@ -47,34 +62,72 @@ def get_header(fname):
 
 def get_duration(fname):
     global kwargs
-    timestamp = 0
-    with open(fname) as infile:
-        for line in infile:
-            if not line.startswith(ROW_COMMENT):
-                timestamp = float(line.split(kwargs.column_separator)[0])
 
-    return timestamp
+    if is_binary_log(fname):
+        return BinaryLogReader(fname).last_timestamp()
 
-
-def loader(fname, dimensions=None, timestamps=False):
+    # find last data row by seeking from the end of the file
+    log = open_log(fname)
+    try:
+        end = len(log)
+        while end > 0:
+            start = log.rfind(b'\n', 0, end) + 1
+            line = log[start:end].strip()
+            if line and not line.startswith(ROW_COMMENT.encode()):
+                return float(line.decode().split(kwargs.column_separator)[0])
+            end = start - 1
+    finally:
+        log.close()
+
+    return 0
+
+
+def get_metadata(fname):
+    # key = value pairs from log header
+    if is_binary_log(fname):
+        return BinaryLogReader(fname).metadata
+
+    metadata = {}
+    log = open_log(fname)
+    try:
+        line = log.readline()
+        while line.startswith(ROW_COMMENT.encode()):
+            key, separator, value = line.decode().lstrip(ROW_COMMENT).partition('=')
+            if separator:
+                value = value.strip()
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+                metadata[key.strip()] = value
+            line = log.readline()
+    finally:
+        log.close()
+
+    return metadata
+
+
+def csv_read_arguments(fname, dimensions=None, timestamps=False):
+    # arguments for pd.read_csv(), dimensions to read and info if timestamp column is read
     global kwargs  # pylint: disable=global-statement
     if not kwargs.column_header:
         header = get_header(fname)
         header_offset = 2  # time, stamp, ...
+        if HOST_TIMESTAMP in header:
+            header_offset += 1  # time, host time, stamp, ...
         header = header[header_offset:]
+        rokix_log = True
     else:
         header = kwargs.column_header.split(kwargs.column_separator)
         header_offset = 0
-
-    #
-    # load the data to pd dataframe
-    #
+        rokix_log = False
 
     # initial arguments for load()
     pdargs = {
         'filepath_or_buffer': fname,
         'comment': ROW_COMMENT,
-        'delimiter': kwargs.column_separator
+        'delimiter': kwargs.column_separator,
+        'memory_map': True
     }
 
     # populate column indexes and names
@@ -92,9 +145,11 @@ def loader(fname, dimensions=None, timestamps=False):
             raise PlotterException()
 
     pdargs['usecols'] = columns
-    pdargs['names'] = dimensions
+    pdargs['names'] = list(dimensions)
 
-    if timestamps:
+    # RoKiX logs have always timestamps in first column
+    has_time = timestamps or rokix_log
+    if has_time:
         # add timestamp channel
         pdargs['usecols'] = [0] + pdargs['usecols']
         pdargs['names'] = ['time'] + pdargs['names']
@@ -103,66 +158,246 @@ def loader(fname, dimensions=None, timestamps=False):
         LOGGER.warning('Column separator character not found from header.')
         LOGGER.warning('Log has only one column or column separator is incorrectly defined. ')
         LOGGER.warning('Column separator can be defined with keyword argument --column_separator')
-    # read data to dataframe
-    try:
-        data = pd.read_csv(**pdargs)
 
-        test_value = data[pdargs['names'][-1]][0]
-        if not (isinstance(test_value, np.int64)):
-            LOGGER.error('Header or column separator may not be properly configured.')
-            LOGGER.error('Header is defined as "%s".' % dimensions)
-            LOGGER.error('Column separator as "%s".' % pdargs['delimiter'])
-            LOGGER.error('Keyword argument --column_separator can be used to redefine it.')
-            LOGGER.error('This value should contain single integer value: "%s"' % test_value)
+    return pdargs, list(dimensions), has_time
+
+
+def check_values(data, pdargs):
+    test_value = data[pdargs['names'][-1]].iloc[0]
+    if not (isinstance(test_value, np.int64)):
+        LOGGER.error('Header or column separator may not be properly configured.')
+        LOGGER.error('Header is defined as "%s".' % pdargs['names'])
+        LOGGER.error('Column separator as "%s".' % pdargs['delimiter'])
+        LOGGER.error('Keyword argument --column_separator can be used to redefine it.')
+        LOGGER.error('This value should contain single integer value: "%s"' % test_value)
+
+        raise PlotterException()
+
+
+def iter_chunks(fname, dimensions=None, timestamps=False, start=None, end=None, chunksize=CHUNK_SIZE):
+    # Yields (index, time, data) tuples of max chunksize samples between start and end.
+    # index is sample index in the log, time is timestamps or None if log does not have them
+    # and data is DataFrame of dimensions. start and end are seconds, or sample indexes if
+    # the log does not have timestamps.
+
+    if is_binary_log(fname):
+        reader = BinaryLogReader(fname)
+        if dimensions is None:
+            dimensions = get_header(fname)[2:]
 
+        try:
+            for index, time, columns in reader.iter_columns(dimensions, start=start, end=end, chunksize=chunksize):
+                data = pd.DataFrame({dimension: columns[dimension] for dimension in dimensions}, columns=dimensions)
+                yield index, np.asarray(time), data
+        except EvaluationKitException as e:
+            LOGGER.error(e)
+            LOGGER.error('Existing dimensions are %s' % get_header(fname)[2:])
             raise PlotterException()
+        return
+
+    pdargs, dimensions, has_time = csv_read_arguments(fname, dimensions, timestamps)
+    pdargs['chunksize'] = chunksize
+    sample_index = 0
+
+    try:
+        for chunk_number, chunk in enumerate(pd.read_csv(**pdargs)):
+            if chunk_number == 0:
+                check_values(chunk, pdargs)
+
+            index = np.arange(sample_index, sample_index + len(chunk))
+            sample_index += len(chunk)
+            time = chunk['time'].values if has_time else None
+            position = index if time is None else time
+
+            if end is not None and position[0] > end:
+                break
+
+            selected = np.ones(len(chunk), dtype=bool)
+            if start is not None:
+                selected &= position >= start
+            if end is not None:
+                selected &= position <= end
+
+            if selected.any():
+                yield index[selected], None if time is None else time[selected], chunk[dimensions][selected]
 
     except pd.errors.ParserError:
         LOGGER.error('Log file may not use default column separator. Use keyword argument --column_separator to define it.')
         raise
-    return data
 
 
-def plotter(fname, dimensions=None, timestamps=False):
+def loader(fname, dimensions=None, timestamps=False):
+    # load data between --start and --end to one DataFrame
+    global kwargs  # pylint: disable=global-statement
+    chunks = []
+    for _, time, data in iter_chunks(fname, dimensions, timestamps, kwargs.start, kwargs.end):
+        if timestamps:
+            data.insert(0, 'time', time)
+        chunks.append(data)
+
+    if not chunks:
+        raise PlotterException('No data found from log file.')
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+class EnvelopeDecimator(object):
+    # Min/max envelope of samples. Number of bins is kept between points and 2 * points
+    # by merging adjacent bins, so total amount of samples does not need to be known.
+
+    def __init__(self, points):
+        self.points = max(points, 1)
+        self.bin_size = 1
+        self.x = []
+        self.low = []
+        self.high = []
+        self.bins = 0
+        self.carry_x = None
+        self.carry = None
+
+    def add(self, x, values):
+        if self.carry is not None:
+            x = np.concatenate((self.carry_x, x))
+            values = np.concatenate((self.carry, values))
+
+        full = len(values) // self.bin_size * self.bin_size
+        if full:
+            binned = values[:full].reshape(-1, self.bin_size, values.shape[1])
+            self.x.append(x[:full:self.bin_size])
+            self.low.append(binned.min(axis=1))
+            self.high.append(binned.max(axis=1))
+            self.bins += full // self.bin_size
+
+        self.carry_x = x[full:]
+        self.carry = values[full:]
+
+        while self.bins > 2 * self.points:
+            self._merge()
+
+    def _merge(self):
+        x = np.concatenate(self.x)
+        low = np.concatenate(self.low)
+        high = np.concatenate(self.high)
+        even = len(x) // 2 * 2
+
+        self.x = [x[0:even:2], x[even:]]
+        self.low = [np.minimum(low[0:even:2], low[1:even:2]), low[even:]]
+        self.high = [np.maximum(high[0:even:2], high[1:even:2]), high[even:]]
+        self.bins = len(self.x[0]) + len(self.x[1])
+        self.bin_size *= 2
+
+    def result(self):
+        # returns x, minimum and maximum values of bins and bin size
+        if self.carry is not None and len(self.carry):
+            self.x.append(self.carry_x[:1])
+            self.low.append(self.carry.min(axis=0, keepdims=True))
+            self.high.append(self.carry.max(axis=0, keepdims=True))
+            self.carry = None
+
+        if not self.x:
+            raise PlotterException('No data found from log file.')
+
+        return np.concatenate(self.x), np.concatenate(self.low), np.concatenate(self.high), self.bin_size
+
+
+class WelchAccumulator(object):
+    # Power spectral density as average of periodograms of 50 % overlapping Hann windowed segments
+
+    def __init__(self, segment_length):
+        self.segment_length = max(segment_length, 2)
+        self.step = self.segment_length // 2
+        self.window = np.hanning(self.segment_length)
+        self.power = None
+        self.segments = 0
+        self.carry = None
+
+    def _add_segment(self, segment, window):
+        segment = segment - segment.mean(axis=0)
+        power = np.abs(np.fft.rfft(segment * window[:, np.newaxis], axis=0))**2
+        self.power = power if self.power is None else self.power + power
+        self.segments += 1
+
+    def add(self, values):
+        if self.carry is not None:
+            values = np.concatenate((self.carry, values))
+
+        position = 0
+        while position + self.segment_length <= len(values):
+            self._add_segment(values[position:position + self.segment_length], self.window)
+            position += self.step
+
+        self.carry = values[position:]
+
+    def result(self, sample_rate):
+        # returns frequencies and one sided PSD
+        if not self.segments:
+            # log is shorter than one segment
+            if self.carry is None or len(self.carry) < 2:
+                raise PlotterException('Not enough data for spectrum.')
+            self.window = np.hanning(len(self.carry))
+            self._add_segment(self.carry, self.window)
+
+        segment_length = len(self.window)
+        psd = self.power / (self.segments * sample_rate * (self.window**2).sum())
+        if segment_length % 2:
+            psd[1:] *= 2
+        else:
+            psd[1:-1] *= 2
+
+        return np.fft.rfftfreq(segment_length, 1.0 / sample_rate), psd
 
-    data = loader(fname, dimensions, timestamps)
-    dimensions = data.axes[1]
 
-    # by default no data for x axis
-    x = None
+def plotter(fname, dimensions=None, timestamps=False):
+
+    decimator = EnvelopeDecimator(kwargs.points)
+    for index, time, data in iter_chunks(fname, dimensions, timestamps, kwargs.start, kwargs.end):
+        dimensions = list(data.columns)
+        # by default sample index for x axis
+        x = time if timestamps else index
+        decimator.add(x, data.values)
 
-    if timestamps:
-        x = 'time'  # timestamp column is x axis
-        dimensions = dimensions[1:]
+    x, low, high, bin_size = decimator.result()
 
     #
     # view the data
     #
 
-    data.plot(x, dimensions, title=fname, marker=kwargs.tick_marker)
+    if bin_size == 1:
+        plt.plot(x, low, marker=kwargs.tick_marker)
+        plt.legend(dimensions)
+    else:
+        for column, dimension in enumerate(dimensions):
+            plt.fill_between(x, low[:, column], high[:, column], step='post', alpha=0.6, label=dimension)
+        plt.legend()
+        LOGGER.info('Showing min/max envelope of %d samples per point' % bin_size)
+
+    plt.xlabel('time [s]' if timestamps else 'sample')
+    plt.title(fname)
     plt.grid()
     plt.show()
 
 
 def fftplotter(fname, dimensions=None, timestamps=False):
 
-    data = loader(fname, dimensions, timestamps)
-    dimensions = data.axes[1]
+    # sample rate from log metadata or estimated from timestamps
+    sample_rate = get_metadata(fname).get('odr')
 
-    if timestamps:
-        dimensions = dimensions[1:]
+    welch = WelchAccumulator(kwargs.segment_length)
+    for _, time, data in iter_chunks(fname, dimensions, timestamps, kwargs.start, kwargs.end):
+        dimensions = list(data.columns)
+        if not sample_rate and time is not None and len(time) > 1:
+            sample_rate = 1.0 / np.median(np.diff(time))
+        welch.add(data.values.astype(float))
 
-    # calculate FFT
-    fft_data = 10 * np.log10(np.abs(np.fft.fft(data, axis=0)**2))
-    fft_freq = np.fft.fftfreq(len(fft_data), 1)
-    positive_freq = fft_freq > 0
+    freq, psd = welch.result(sample_rate or 1.0)
+    positive_freq = freq > 0
 
     #
     # view the data
     #
-    plt.plot(fft_freq[positive_freq], fft_data[positive_freq])
-    plt.xlabel('x/ODR')
-    plt.ylabel('dB')
+    plt.plot(freq[positive_freq], 10 * np.log10(psd[positive_freq]))
+    plt.xlabel('Hz' if sample_rate else 'x/ODR')
+    plt.ylabel('dB/Hz' if sample_rate else 'dB')
     plt.legend(dimensions)
     plt.title(fname)
     plt.grid()
@@ -187,6 +422,9 @@ def main():
     # same as above but timestamps to x axis
     # >python plot.py -t -s \t -c t\tx\ty\tz -d x y z -- filename
 
+    # plot 10 seconds window starting from 60 s
+    # >python plot.py -t --start 60 --end 70 -d ax ay az -- filename
+
     global kwargs  # pylint: disable=global-statement
     parser = argparse.ArgumentParser(description='RoKiX log visualizer. Example: %(prog)s log.csv -d ax ay az')
     parser.add_argument('-d', '--dimensions', nargs='*', type=str, help='Dimensions to plot.')
@@ -195,14 +433,22 @@ def main():
     parser.add_argument('-g', '--log_length', action='store_true', help='Show last timestamp from the log.')
     parser.add_argument('-s', '--column_separator', default=COLUMN_SEPARATOR, help='Clolumn separator (default ;)')
     parser.add_argument('-c', '--column_header', default=None, help='Column header definition in case log file does not have it.')
-    parser.add_argument('-f', '--fft', action='store_true', help='FFT plot instead of time domain plot')
+    parser.add_argument('-f', '--fft', action='store_true', help='Power spectral density plot instead of time domain plot')
+    parser.add_argument('--start', type=float, default=None,
+                        help='Start of plotted window in seconds (sample index if log does not have timestamps)')
+    parser.add_argument('--end', type=float, default=None,
+                        help='End of plotted window in seconds (sample index if log does not have timestamps)')
+    parser.add_argument('-p', '--points', type=int, default=2000,
+                        help='Max number of points in time domain plot. Longer data is shown as min/max envelope (default 2000)')
+    parser.add_argument('--segment_length', type=int, default=1024,
+                        help='Segment length of averaged power spectral density (default 1024)')
     parser.add_argument(
         '-m',
         '--tick_marker',
         default=None,
         help='Tick marker for data points (see https://matplotlib.org/3.1.0/api/markers_api.html#module-matplotlib.markers)')
 
-    parser.add_argument('fname', type=str, help='log file name')
+    parser.add_argument('fname', type=str, help='log file name (csv or binary)')
     kwargs = parser.parse_args()
 
     # special handling for tab separated values
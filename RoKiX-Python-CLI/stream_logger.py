@@ -2,7 +2,6 @@
 # Copyright 2020 Rohm Semiconductor
 #
 import json
-import struct
 
 from kx_lib.kx_util import *  # pylint: disable=unused-wildcard-import,wildcard-import
 from kx_lib.kx_configuration_enum import *  # pylint: disable=unused-wildcard-import,wildcard-import
@@ -65,11 +64,13 @@ class StandAloneConnectionManager(ConnectionManager):
 
 
 class StandAloneStreamMessageDefinition(RequestMessageDefinition):
-    def __init__(self, fmt, hdr, axis_map):
-        self.msg_fmt = fmt
-        self.msg_hdr = hdr
-        self.msg_size = struct.calcsize(self.msg_fmt)
+    def __init__(self, fmt, hdr, axis_map, target):
+        self.init_payload(fmt, hdr)
+        self.sensor = None
+        self.target = target
+        self.msg_req = []
         self.axis_mapper = AxisMapper(channel_header=hdr, axis_map=None)
+        self.compile_decoder()
 
 class StandAloneDataStream(StreamConfig):
     def __init__(self, stream_config_json):
@@ -83,6 +84,7 @@ class StandAloneDataStream(StreamConfig):
         self.sensor_id = None
         if self.adapter.stream_support is False:
             raise EvaluationKitException("Adapter %s does not support data streaming." % self.adapter)
+        self.init_appended_data()
 
         for section in ['configure', 'activate']:
             for register_write_node in self.stream_config[section]:
@@ -160,7 +162,8 @@ class StandAloneDataStream(StreamConfig):
                     # Generate message_info object for read_data_stream to be able to parse incoming stream msgs
                     message_info = StandAloneStreamMessageDefinition(start_req['fmt'],
                                                                      start_req['hdr'],
-                                                                     self.board.found_sensors[sensor_id][CFG_AXIS_MAP])
+                                                                     self.board.found_sensors[sensor_id][CFG_AXIS_MAP],
+                                                                     self.board.found_sensors[sensor_id][CFG_TARGET])
 
                 if msg[1] == protocol.EVKIT_MSG_CREATE_MACRO_REQ:
                     # Wait for sensor_id to be resolved, should be the following message
@@ -211,9 +214,19 @@ class StandAloneDataStream(StreamConfig):
                     LOGGER.debug(resp)
         LOGGER.debug('<_define_request_message')
 
+    def _add_actions_before_start(self, start_msg):
+        "Append packet counter and firmware timestamp to macros started by start_msg if enabled"
+        macro_id = start_msg[2]
+        macro_ids = list(self.msg_ind_dict) if macro_id == protocol.EVKIT_MACRO_APPLY_ACTION_ALL else [macro_id]
+        for macro_id in macro_ids:
+            if macro_id in self.msg_ind_dict:
+                self._add_stream_actions(macro_id)
+
     def _start_streaming_single_sensor(self):
         LOGGER.debug(">_start_streaming")
         for stream_start_msg_bytes in self.stream_start_msgs:
+            if stream_start_msg_bytes[1] == protocol.EVKIT_MSG_START_MACRO_REQ:
+                self._add_actions_before_start(stream_start_msg_bytes)
             LOGGER.debug(stream_start_msg_bytes)
             self.adapter.send_message(stream_start_msg_bytes)
             resp = self.adapter.receive_message(wait_for_message=stream_start_msg_bytes[1] + 1)
@@ -221,7 +234,8 @@ class StandAloneDataStream(StreamConfig):
                 _, resp_payload = resp
                 message_info = StandAloneStreamMessageDefinition(self.stream_config['start_req']['fmt'],
                                                                  self.stream_config['start_req']['hdr'],
-                                                                 self.board.found_sensors[self.sensor_id][CFG_AXIS_MAP])
+                                                                 self.board.found_sensors[self.sensor_id][CFG_AXIS_MAP],
+                                                                 self.board.found_sensors[self.sensor_id][CFG_TARGET])
 
                 self.msg_ind_dict[resp_payload] = message_info
         LOGGER.debug("<_start_streaming")
@@ -236,6 +250,7 @@ class StandAloneDataStream(StreamConfig):
     def _start_streaming_multi_sensor(self):
         LOGGER.debug(">_start_streaming")
         for stream_start_msg in self.stream_start_msgs:
+            self._add_actions_before_start(stream_start_msg)
             LOGGER.debug(stream_start_msg)
             self.adapter.send_message(stream_start_msg)
             resp = self.adapter.receive_message(wait_for_message=stream_start_msg[1] + 1)